@@ -0,0 +1,95 @@
+import time
+from types import MappingProxyType
+from sqlalchemy.orm import Session
+from app.db import models, versions
+
+# name of the shared version counter
+VERSION_NAME = "activity_tree"
+# seconds between checks of the shared version, lookups in between need no sql at all
+CHECK_INTERVAL = 1.0
+
+class ActivityTree:
+    """
+    Immutable snapshot of the whole activity taxonomy: nodes, parent/children maps, levels and descendant id sets.
+    """
+
+    def __init__(self, version: int, rows: list[tuple[int, str, int]]):
+        self.version = version
+        names = {activity_id: name for activity_id, name, _ in rows}
+        parents = {activity_id: parent_id for activity_id, _, parent_id in rows if parent_id in names and parent_id != activity_id}
+        children = {activity_id: [] for activity_id in names}
+        for activity_id, parent_id in parents.items():
+            children[parent_id].append(activity_id)
+        # levels top-down from the roots, nodes caught in a cycle are never reached and left out
+        levels = {}
+        stack = [(activity_id, 1) for activity_id in names if activity_id not in parents]
+        while stack:
+            activity_id, level = stack.pop()
+            levels[activity_id] = level
+            stack.extend((child_id, level + 1) for child_id in children[activity_id])
+        # descendant sets bottom-up, deepest nodes first
+        descendants = {}
+        for activity_id in sorted(levels, key = levels.get, reverse = True):
+            ids = {activity_id}
+            for child_id in children[activity_id]:
+                ids |= descendants[child_id]
+            descendants[activity_id] = frozenset(ids)
+        self.names = MappingProxyType({activity_id: names[activity_id] for activity_id in levels})
+        self.parents = MappingProxyType({activity_id: parents.get(activity_id) for activity_id in levels})
+        self.children = MappingProxyType({activity_id: tuple(sorted(children[activity_id])) for activity_id in levels})
+        self.levels = MappingProxyType(levels)
+        self.descendants = MappingProxyType(descendants)
+
+    def __contains__(self, activity_id: int) -> bool:
+        return activity_id in self.levels
+
+    def subtree_ids(self, activity_id: int) -> frozenset:
+        # the activity and all of its descendants
+        return self.descendants.get(activity_id, frozenset())
+
+    def as_tree(self, activity_id: int) -> dict:
+        # nested dict in the shape of schemas.ActivityTreeResponse
+        return {
+            "id": activity_id,
+            "name": self.names[activity_id],
+            "parent_id": self.parents[activity_id],
+            "level": self.levels[activity_id],
+            "children": [self.as_tree(child_id) for child_id in self.children[activity_id]],
+        }
+
+class ActivityTreeCache:
+    """
+    Process-wide holder of the current ActivityTree.
+    The activities router calls bump() in its write transaction and reload() after the commit;
+    other workers notice the new shared version on their next check and rebuild.
+    """
+
+    def __init__(self):
+        self._tree = None
+        self._checked_at = 0.0
+
+    # no lock around the queries: under the async stack they yield to other requests on the same thread,
+    # a concurrent rebuild of the (tiny) taxonomy is harmless, the last one wins
+    def get(self, db: Session) -> ActivityTree:
+        tree = self._tree
+        if tree is not None and time.monotonic() - self._checked_at < CHECK_INTERVAL:
+            return tree
+        version = versions.current(db, VERSION_NAME)
+        if tree is None or tree.version != version:
+            tree = self._tree = self._build(db, version)
+        self._checked_at = time.monotonic()
+        return tree
+
+    def bump(self, db: Session):
+        versions.bump(db, VERSION_NAME)
+
+    def reload(self, db: Session):
+        self._tree = self._build(db, versions.current(db, VERSION_NAME))
+        self._checked_at = time.monotonic()
+
+    @staticmethod
+    def _build(db: Session, version: int) -> ActivityTree:
+        rows = db.query(models.Activity.id, models.Activity.name, models.Activity.parent_id).all()
+        return ActivityTree(version, [tuple(row) for row in rows])
+
+activity_tree = ActivityTreeCache()
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Response
+from app.settings import settings
+
+class LocalCache:
+    """
+    In-process LRU cache of bytes with a TTL, bounded by the number of entries and their total size.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (expires at, value), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: bytes):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(key) + len(entry[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "local",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+class RedisCache:
+    """
+    Cache shared by all workers in redis, which handles the TTL and the memory cap (maxmemory + an LRU policy).
+    Needs the redis package, imported only when this backend is configured.
+    """
+
+    def __init__(self, url: str, ttl: float):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> bytes:
+        value = self.client.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes):
+        self.client.set(key, value, px = int(self.ttl * 1000))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def stats(self) -> dict:
+        # hits and misses of this worker, evictions are counted by redis itself (INFO stats)
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+def make_cache():
+    if settings.response_cache_backend == "redis":
+        return RedisCache(settings.response_cache_url, settings.response_cache_ttl)
+    return LocalCache(settings.response_cache_ttl, settings.response_cache_max_entries, settings.response_cache_max_bytes)
+
+response_cache = make_cache()
+
+## serialized responses of single entities, stored with the row version they were built from
+
+def cache_key(kind: str, id: int) -> str:
+    return f"response:{kind}:{id}"
+
+def get_response(kind: str, id: int, version: int) -> bytes:
+    # body cached for this version of the row, None on a miss or an older version (written by another worker)
+    value = response_cache.get(cache_key(kind, id))
+    if value is None:
+        return None
+    cached_version, _, body = value.partition(b"\n")
+    return body if cached_version == str(version).encode() else None
+
+def put_response(kind: str, id: int, version: int, body: bytes):
+    response_cache.set(cache_key(kind, id), str(version).encode() + b"\n" + body)
+
+def invalidate(kind: str, *ids: int):
+    # called by the mutating routes after the commit
+    for id in ids:
+        response_cache.delete(cache_key(kind, id))
+
+def json_response(body: bytes, etag: str) -> Response:
+    return Response(content = body, media_type = "application/json", headers = {"ETag": etag})
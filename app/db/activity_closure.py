@@ -0,0 +1,90 @@
+from sqlalchemy import delete, func, insert, select, true, update
+from sqlalchemy.orm import Session, aliased
+from app.db import models
+
+Closure = models.ActivityClosure
+
+## maintenance of the activity closure table, callers commit
+
+def subtree_ids(activity_id: int):
+    # select of the activity id and all of its descendants
+    return select(Closure.descendant_id).where(Closure.ancestor_id == activity_id)
+
+def subtree_height(db: Session, activity_id: int) -> int:
+    # 0 for a leaf, 1 if it has children only, etc.
+    return db.execute(select(func.max(Closure.depth)).where(Closure.ancestor_id == activity_id)).scalar() or 0
+
+def add_node(db: Session, activity_id: int, parent_id: int = None):
+    db.execute(insert(Closure).values(ancestor_id = activity_id, descendant_id = activity_id, depth = 0))
+    if parent_id is not None:
+        # the new node is one level below every ancestor of its parent
+        db.execute(insert(Closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(Closure.ancestor_id, activity_id, Closure.depth + 1).where(Closure.descendant_id == parent_id)
+        ))
+
+def move_node(db: Session, activity_id: int, new_parent_id: int = None):
+    subtree = subtree_ids(activity_id)
+    # detach the subtree from its old ancestors
+    db.execute(
+        delete(Closure)
+        .where(Closure.descendant_id.in_(subtree), Closure.ancestor_id.not_in(subtree))
+        .execution_options(synchronize_session = False)
+    )
+    # attach it below every ancestor of the new parent
+    if new_parent_id is not None:
+        above, below = aliased(Closure), aliased(Closure)
+        # every ancestor of the new parent paired with every node of the subtree, a deliberate cross join
+        db.execute(insert(Closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .select_from(above)
+            .join(below, true())
+            .where(above.descendant_id == new_parent_id, below.ancestor_id == activity_id)
+        ))
+    update_levels(db, subtree_ids(activity_id))
+
+def remove_node(db: Session, activity_id: int) -> list[int]:
+    # drops the node from the table, its children become roots; returns the ids of the detached descendants
+    descendants = db.execute(
+        select(Closure.descendant_id).where(Closure.ancestor_id == activity_id, Closure.descendant_id != activity_id)
+    ).scalars().all()
+    db.execute(
+        delete(Closure)
+        .where(Closure.descendant_id.in_(descendants + [activity_id]), Closure.ancestor_id.not_in(descendants))
+        .execution_options(synchronize_session = False)
+    )
+    return descendants
+
+def update_levels(db: Session, activity_ids):
+    # level of the activities = number of their ancestors including themselves
+    depth = select(func.count()).where(Closure.descendant_id == models.Activity.id).scalar_subquery()
+    db.execute(
+        update(models.Activity)
+        .where(models.Activity.id.in_(activity_ids))
+        .values(level = depth)
+        .execution_options(synchronize_session = False)
+    )
+
+def rebuild(db: Session):
+    # recreate the whole table from activities.parent_id
+    parents = dict(db.execute(select(models.Activity.id, models.Activity.parent_id)).all())
+    rows = []
+    for activity_id in parents:
+        node, depth, seen = activity_id, 0, set()
+        while node is not None and node not in seen:
+            seen.add(node)
+            rows.append({"ancestor_id": node, "descendant_id": activity_id, "depth": depth})
+            node, depth = parents.get(node), depth + 1
+    db.execute(delete(Closure))
+    if rows:
+        db.execute(insert(Closure), rows)
+    update_levels(db, select(models.Activity.id))
+
+def ensure(db: Session):
+    # backfill after activities were written without maintaining the table (seed data, existing databases)
+    activities = db.execute(select(func.count()).select_from(models.Activity)).scalar()
+    self_rows = db.execute(select(func.count()).select_from(Closure).where(Closure.depth == 0)).scalar()
+    if activities != self_rows:
+        rebuild(db)
+        db.commit()
@@ -0,0 +1,305 @@
+"""
+Bulk ingestion of buildings, activities, organizations, phones and organization activities from CSV or NDJSON.
+
+    python -m app.db.bulk organizations organizations.csv
+    python -m app.db.bulk phones phones.ndjson --format ndjson
+
+Rows are validated and their foreign keys resolved one chunk at a time, then written with PostgreSQL COPY
+(executemany on other databases). Invalid rows are reported with their line number and skipped, the rest is committed.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from pydantic import ValidationError
+from sqlalchemy import insert, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from app.activity_tree import activity_tree
+from app.geo_engine import geo_engine
+from app.search import name_index
+from app.tiles import tile_index
+from app.db import activity_closure, models, schemas, versions
+from app.db.session import SessionLocal
+
+try:
+    # COPY runs on the raw psycopg2 cursor, its errors are not wrapped by SQLAlchemy
+    from psycopg2 import Error as CopyError
+except ImportError:
+    CopyError = DBAPIError
+
+CHUNK_SIZE = 5000
+# errors of a failed write: wrapped by SQLAlchemy (executemany) or raised by the COPY cursor
+WRITE_ERRORS = (DBAPIError, CopyError)
+# errors listed in the report, the rest is only counted
+MAX_REPORTED_ERRORS = 1000
+# deepest activity level, as enforced by the activities router
+MAX_ACTIVITY_LEVEL = 3
+
+class Entity:
+    def __init__(self, table, schema, references: dict = None, unique: str = None, unique_form: tuple = None, max_level: int = None):
+        self.table = table
+        self.schema = schema
+        # foreign key field -> referenced table, resolved per chunk
+        self.references = references or {}
+        # field that must be unique across the database and the import
+        self.unique = unique
+        # (sql expression, function of the value) comparing the unique field in its indexed form, the raw column when None
+        self.unique_form = unique_form
+        # deepest level of a self-referencing tree (parent_id), unlimited when None
+        self.max_level = max_level
+
+ENTITIES = {
+    "buildings": Entity(models.Building.__table__, schemas.BuildingImport),
+    "activities": Entity(
+        models.Activity.__table__,
+        schemas.ActivityImport,
+        {"parent_id": models.Activity.__table__},
+        max_level = MAX_ACTIVITY_LEVEL
+    ),
+    "organizations": Entity(models.Organization.__table__, schemas.OrganizationImport, {"building_id": models.Building.__table__}),
+    "phones": Entity(
+        models.PhoneNumber.__table__,
+        schemas.PhoneNumberImport,
+        {"organization_id": models.Organization.__table__},
+        unique = "number",
+        unique_form = (models.normalized_number, models.normalize_number)
+    ),
+    "organization_activities": Entity(
+        models.organization_activity,
+        schemas.OrganizationActivityImport,
+        {"organization_id": models.Organization.__table__, "activity_id": models.Activity.__table__}
+    ),
+}
+
+class Report:
+    def __init__(self, entity: str):
+        self.result = schemas.ImportReport(entity = entity)
+
+    def error(self, line: int, error: str):
+        self.result.failed += 1
+        if len(self.result.errors) < MAX_REPORTED_ERRORS:
+            self.result.errors.append(schemas.ImportRowError(line = line, error = error))
+
+## reading
+
+def read_rows(stream, format: str):
+    # (line number, row dict or None, parse error or None)
+    if format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {k: (v if v != "" else None) for k, v in row.items()}, None
+    elif format == "ndjson":
+        for line, raw in enumerate(stream, 1):
+            if not raw.strip():
+                continue
+            try:
+                row = json.loads(raw)
+            except ValueError as e:
+                yield line, None, f"invalid json: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line, None, "json object expected"
+                continue
+            yield line, row, None
+    else:
+        raise ValueError(f"unknown format {format}, expected csv or ndjson")
+
+def chunks(rows, size: int):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+## writing
+
+def copy_rows(db: Session, table, columns: list[str], rows: list[dict]):
+    # PostgreSQL COPY through the session connection, NULL is an unquoted empty field
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+def write_rows(db: Session, table, rows: list[dict], copy: bool = True):
+    # rows without an id get it from the database, so they are written separately
+    groups = {}
+    for row in rows:
+        if "id" in row and row["id"] is None:
+            row = {k: v for k, v in row.items() if k != "id"}
+        groups.setdefault(tuple(row), []).append(row)
+    use_copy = copy and db.bind.dialect.name == "postgresql" and db.bind.dialect.driver == "psycopg2"
+    for columns, group in groups.items():
+        if use_copy:
+            copy_rows(db, table, list(columns), group)
+        else:
+            db.execute(insert(table), group)
+
+def write_error(e: Exception) -> str:
+    # first line of the database message of a failed write
+    message = getattr(e, "pgerror", None) or str(e.orig if isinstance(e, DBAPIError) else e)
+    return message.strip().splitlines()[0]
+
+def resolve_levels(db: Session, valid: list, levels: dict) -> dict:
+    # level of every row: one below its parent from the database, an earlier chunk or this chunk; None in a cycle
+    parents = {row["id"]: row["parent_id"] for _, row in valid if row.get("id") is not None}
+    wanted = {row["parent_id"] for _, row in valid if row["parent_id"] is not None} - levels.keys() - parents.keys()
+    if wanted:
+        levels.update(db.execute(select(models.Activity.id, models.Activity.level).where(models.Activity.id.in_(wanted))).all())
+    resolved = {}
+    for line, row in valid:
+        parent_id, level, visited = row["parent_id"], 1, set()
+        while parent_id is not None and parent_id not in levels and parent_id not in visited:
+            visited.add(parent_id)
+            parent_id, level = parents.get(parent_id), level + 1
+        if parent_id in visited:
+            resolved[line] = None
+        else:
+            resolved[line] = level + (levels.get(parent_id) or 0)
+    return resolved
+
+def import_chunk(db: Session, entity: Entity, chunk: list, report: Report, seen: set, written_ids: set, levels: dict = None):
+    # validate
+    valid = []
+    for line, raw, error in chunk:
+        if error:
+            report.error(line, error)
+            continue
+        try:
+            valid.append((line, entity.schema(**raw).dict()))
+        except ValidationError as e:
+            first = e.errors()[0]
+            report.error(line, f"{'.'.join(str(l) for l in first['loc'])}: {first['msg']}")
+    # resolve foreign keys with one query per referenced table
+    for field, table in entity.references.items():
+        wanted = {row[field] for _, row in valid if row[field] is not None}
+        existing = set(db.execute(select(table.c.id).where(table.c.id.in_(wanted))).scalars()) if wanted else set()
+        if table is entity.table:
+            # self reference, may point to rows of this import
+            existing |= written_ids | {row["id"] for _, row in valid if row.get("id") is not None}
+        kept = []
+        for line, row in valid:
+            if row[field] is not None and row[field] not in existing:
+                report.error(line, f"{field}: {row[field]} not found")
+            else:
+                kept.append((line, row))
+        valid = kept
+    # nesting depth of a tree, rows of earlier chunks keep their levels in levels
+    resolved = {}
+    if entity.max_level:
+        resolved = resolve_levels(db, valid, levels)
+        kept = []
+        for line, row in valid:
+            if resolved[line] is None:
+                report.error(line, f"parent_id: {row['parent_id']} is in a cycle")
+            elif resolved[line] > entity.max_level:
+                report.error(line, f"parent_id: maximum nesting level is {entity.max_level}")
+            else:
+                kept.append((line, row))
+        valid = kept
+    # uniqueness against the database and the rows imported so far
+    if entity.unique:
+        expression, form = entity.unique_form or (entity.table.c[entity.unique], lambda value: value)
+        values = {form(row[entity.unique]) for _, row in valid}
+        taken = set(db.execute(select(expression).where(expression.in_(values))).scalars()) if values else set()
+        kept = []
+        for line, row in valid:
+            value = row[entity.unique]
+            if form(value) in taken or form(value) in seen:
+                report.error(line, f"{entity.unique}: {value} already exists")
+            else:
+                seen.add(form(value))
+                kept.append((line, row))
+        valid = kept
+    if not valid:
+        return
+    # write the chunk at once, on failure find the bad rows one by one
+    try:
+        with db.begin_nested():
+            write_rows(db, entity.table, [row for _, row in valid])
+        written = [row for _, row in valid]
+    except WRITE_ERRORS:
+        # one insert per row, its errors come wrapped by SQLAlchemy
+        written = []
+        for line, row in valid:
+            try:
+                with db.begin_nested():
+                    write_rows(db, entity.table, [row], copy = False)
+                written.append(row)
+            except WRITE_ERRORS as e:
+                report.error(line, write_error(e))
+    # phones and activity links are part of the organization responses, their ETags change
+    if "organization_id" in entity.references:
+        versions.bump_rows(db, models.Organization, {row["organization_id"] for row in written})
+    db.commit()
+    report.result.inserted += len(written)
+    written_ids.update(row["id"] for row in written if row.get("id") is not None)
+    if entity.max_level:
+        # children in later chunks are placed below the written rows
+        written_rows = {id(row) for row in written}
+        levels.update((row["id"], resolved[line]) for line, row in valid if id(row) in written_rows and row.get("id") is not None)
+
+def after_import(db: Session, entity: str, written_ids: set):
+    table = ENTITIES[entity].table
+    # explicit ids were written past the sequence, move it behind them
+    if written_ids and db.bind.dialect.name == "postgresql":
+        db.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), (SELECT max(id) FROM {table.name}))"
+        ))
+    if entity == "activities":
+        activity_closure.rebuild(db)
+        activity_tree.bump(db)
+    db.commit()
+    # in-process indexes of this worker, other workers reload on their own
+    if entity == "buildings":
+        geo_engine.invalidate()
+    if entity == "organizations":
+        name_index.invalidate()
+    if entity in ("buildings", "organizations", "organization_activities"):
+        tile_index.invalidate()
+
+def import_file(entity: str, stream, format: str = "csv", chunk_size: int = CHUNK_SIZE) -> schemas.ImportReport:
+    if entity not in ENTITIES:
+        raise ValueError(f"unknown entity {entity}, expected one of {', '.join(ENTITIES)}")
+    report = Report(entity)
+    seen, written_ids, levels = set(), set(), {}
+    db = SessionLocal()
+    try:
+        for chunk in chunks(read_rows(stream, format), chunk_size):
+            report.result.rows += len(chunk)
+            import_chunk(db, ENTITIES[entity], chunk, report, seen, written_ids, levels)
+        after_import(db, entity, written_ids)
+    finally:
+        db.close()
+    return report.result
+
+## cli
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description = "bulk import into the organizations database")
+    parser.add_argument("entity", choices = list(ENTITIES))
+    parser.add_argument("path", help = "input file, - for stdin")
+    parser.add_argument("--format", choices = ["csv", "ndjson"], default = None, help = "default: by file extension, csv for stdin")
+    parser.add_argument("--chunk-size", type = int, default = CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    format = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    if args.path == "-":
+        report = import_file(args.entity, sys.stdin, format, args.chunk_size)
+    else:
+        with open(args.path, newline = "", encoding = "utf-8") as stream:
+            report = import_file(args.entity, stream, format, args.chunk_size)
+    print(json.dumps(report.dict(), indent = 2, ensure_ascii = False))
+    return 1 if report.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,17 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Table
+import re
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Table, Index, func, literal_column
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+organization_activity = Table(
+    "organization_activity",
+    Base.metadata,
+    Column("organization_id", ForeignKey("organizations.id"), primary_key = True),
+    Column("activity_id", ForeignKey("activities.id"), primary_key = True, index = True),
+)
+
 class Building(Base):
     __tablename__ = "buildings"
 
@@ -11,56 +19,84 @@ class Building(Base):
     address = Column(String, nullable = False)
     latitude = Column(Float, nullable = False)
     longitude = Column(Float, nullable = False)
+    # bumped by every change of the row, the source of its ETag
+    version = Column(Integer, nullable = False, default = 1, server_default = "1")
 
     organizations = relationship("Organization", back_populates="building")
 
+    __table_args__ = (
+        # bounding-box prefilter for geo queries
+        Index("ix_buildings_latitude_longitude", "latitude", "longitude"),
+    )
+
 class Activity(Base):
     __tablename__ = "activities"
 
     id = Column(Integer, primary_key = True, index = True)
     name = Column(String, nullable = False)
-    parent_id = Column(Integer, ForeignKey("activities.id"), nullable = True)
+    parent_id = Column(Integer, ForeignKey("activities.id"), nullable = True, index = True)
     level = Column(Integer, default = 1)
+    # bumped on renames and moves within the tree
+    version = Column(Integer, nullable = False, default = 1, server_default = "1")
 
     parent = relationship("Activity", remote_side = [id], back_populates = "children")
     children = relationship("Activity", back_populates = "parent")
-    organizations = relationship(
-        "Organization", 
-        secondary = Table(
-            "organization_activity",
-            Base.metadata,
-            Column("organization_id", ForeignKey("organizations.id"), primary_key = True),
-            Column("activity_id", ForeignKey("activities.id"), primary_key = True),
-        ), 
-        back_populates = "activities"
-    )
+    organizations = relationship("Organization", secondary = organization_activity, back_populates = "activities")
+
+class ActivityClosure(Base):
+    # every (ancestor, descendant) pair of the activity tree, including (id, id) with depth 0
+    __tablename__ = "activity_closure"
+
+    ancestor_id = Column(Integer, ForeignKey("activities.id", ondelete = "CASCADE"), primary_key = True)
+    descendant_id = Column(Integer, ForeignKey("activities.id", ondelete = "CASCADE"), primary_key = True, index = True)
+    depth = Column(Integer, nullable = False)
 
 class Organization(Base):
     __tablename__ = "organizations"
 
     id = Column(Integer, primary_key = True, index = True)
     name = Column(String, nullable = False)
-    building_id = Column(Integer, ForeignKey("buildings.id"), nullable = False)
+    building_id = Column(Integer, ForeignKey("buildings.id"), nullable = False, index = True)
+    # also bumped when its phones or activities change
+    version = Column(Integer, nullable = False, default = 1, server_default = "1")
 
     building = relationship("Building", back_populates = "organizations")
     phone_numbers = relationship("PhoneNumber", back_populates = "organization")
-    activities = relationship(
-        "Activity", 
-        secondary = Table(
-            "organization_activity",
-            Base.metadata,
-            Column("organization_id", ForeignKey("organizations.id"), primary_key = True),
-            Column("activity_id", ForeignKey("activities.id"), primary_key = True),
-            extend_existing = True
-        ), 
-        back_populates = "organizations"
-    )
+    activities = relationship("Activity", secondary = organization_activity, back_populates = "organizations")
 
 class PhoneNumber(Base):
     __tablename__ = "phone_numbers"
 
     id = Column(Integer, primary_key = True, index = True)
-    number = Column(String, nullable = False)
-    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable = False)
+    number = Column(String, nullable = False, index = True)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable = False, index = True)
+
+    organization = relationship("Organization", back_populates = "phone_numbers")
+
+    __table_args__ = (
+        # one row per number, with or without the leading + of E.164
+        Index("ix_phone_numbers_number_normalized", func.ltrim(number, "+"), unique = True),
+    )
+
+# the indexed expression for queries: E.164 digits without the leading +,
+# the '+' is rendered inline since a bound parameter would not match the index expression
+normalized_number = func.ltrim(PhoneNumber.number, literal_column("'+'"))
+
+# formatting accepted around the digits of a number: spaces, dashes, dots and parentheses
+PHONE_FORMATTING_RE = re.compile(r"[\s\-().]")
+# E.164 digits without the leading +
+E164_DIGITS_RE = re.compile(r"^[1-9]\d{1,14}$")
+
+def normalize_number(number: str):
+    # the value of normalized_number for a given number, None when it is not an E.164 number
+    digits = PHONE_FORMATTING_RE.sub("", number)
+    if digits.startswith("+"):
+        digits = digits[1:]
+    return digits if E164_DIGITS_RE.match(digits) else None
+
+class CacheVersion(Base):
+    # shared version counters of the in-process caches, bumped by writers so every worker can detect staleness
+    __tablename__ = "cache_versions"
 
-    organization = relationship("Organization", back_populates = "phone_numbers")
\ No newline at end of file
+    name = Column(String, primary_key = True)
+    version = Column(Integer, nullable = False, default = 0)
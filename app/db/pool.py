@@ -0,0 +1,115 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from app import metrics
+from app.settings import settings
+
+class PoolStats:
+    """
+    Counters of one connection pool: checkouts, time spent waiting for a connection, overflow connections and timeouts.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.engine = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.overflow_connects = 0
+        self.timeouts = 0
+
+    def waited(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def overflowed(self):
+        with self._lock:
+            self.overflow_connects += 1
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool if self.engine is not None else None
+        with self._lock:
+            return {
+                "pool": self.name,
+                "size": pool.size() if pool is not None else 0,
+                "checked_out": pool.checkedout() if pool is not None else 0,
+                "idle": pool.checkedin() if pool is not None else 0,
+                "overflow": max(pool.overflow(), 0) if pool is not None else 0,
+                "checkouts": self.checkouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "overflow_connects": self.overflow_connects,
+                "timeouts": self.timeouts,
+            }
+
+# stats of every pool created in this process, by name
+POOLS: dict[str, PoolStats] = {}
+
+class InstrumentedPool:
+    # times the wait for a connection, mixed into the queue pool classes below
+    stats: PoolStats = None
+
+    def _do_get(self):
+        if self.stats is None:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.timed_out()
+            raise
+        self.stats.waited(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # dispose() replaces the pool, the stats carry over
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+class InstrumentedQueuePool(InstrumentedPool, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+def pool_options(asynchronous: bool = False) -> dict:
+    # create_engine arguments for an instrumented pool configured from the settings
+    return {
+        "poolclass": InstrumentedAsyncQueuePool if asynchronous else InstrumentedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+def instrument(engine, name: str):
+    # attach the stats of the engine pool under name, and count its statements per request
+    sync_engine = getattr(engine, "sync_engine", engine)
+    metrics.track_statements(sync_engine)
+    stats = POOLS[name] = PoolStats(name)
+    stats.engine = sync_engine
+    if isinstance(sync_engine.pool, InstrumentedPool):
+        sync_engine.pool.stats = stats
+
+    @event.listens_for(sync_engine.pool, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        # a new connection beyond pool_size is an overflow connection
+        if sync_engine.pool.overflow() > 0:
+            stats.overflowed()
+
+    return engine
+
+def pool_stats() -> list[dict]:
+    return [stats.snapshot() for stats in POOLS.values()]
@@ -0,0 +1,97 @@
+"""
+Flat read model of organizations in the shape of schemas.Organization.
+
+One row per organization: on PostgreSQL the phone numbers and activity ids are array_agg'd by correlated subqueries
+of the same statement, elsewhere they are loaded afterwards with one IN query per relation for the whole page.
+Either way a LIMIT counts organizations, and nothing scales with phones x activities as with two joinedloads.
+Rows come out as OrganizationRow, a slotted dataclass that orjson serializes natively.
+"""
+from dataclasses import dataclass
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+from app.db import models
+
+COLUMNS = [models.Organization.id, models.Organization.name, models.Organization.building_id]
+
+## read-only results, fields in the order of schemas.Organization
+
+@dataclass
+class OrganizationRow:
+    __slots__ = ("name", "building_id", "id", "phone_numbers", "activity_ids")
+    name: str
+    building_id: int
+    id: int
+    phone_numbers: list
+    activity_ids: list
+
+    def with_distance(self, distance: float) -> "OrganizationDistanceRow":
+        return OrganizationDistanceRow(self.name, self.building_id, self.id, self.phone_numbers, self.activity_ids, distance)
+
+@dataclass
+class OrganizationDistanceRow(OrganizationRow):
+    __slots__ = ("distance",)
+    distance: float
+
+##
+
+def aggregates() -> list:
+    # array_agg of the relations of the outer organization row, '{}' when it has none
+    empty = literal_column("'{}'")
+    phones = (
+        select(func.coalesce(func.array_agg(aggregate_order_by(models.PhoneNumber.number, models.PhoneNumber.id)), empty))
+        .where(models.PhoneNumber.organization_id == models.Organization.id)
+        .scalar_subquery()
+    )
+    activities = (
+        select(func.coalesce(
+            func.array_agg(aggregate_order_by(models.organization_activity.c.activity_id, models.organization_activity.c.activity_id)),
+            empty
+        ))
+        .where(models.organization_activity.c.organization_id == models.Organization.id)
+        .scalar_subquery()
+    )
+    return [phones.label("phone_numbers"), activities.label("activity_ids")]
+
+def aggregated(db: Session) -> bool:
+    return db.bind.dialect.name == "postgresql"
+
+def organizations_query(db: Session, *columns):
+    """
+    Query of the organization columns plus the given extra columns, ready for filters, ordering and paging.
+    Turn its rows into OrganizationRow with to_rows().
+    """
+    return db.query(*COLUMNS, *(aggregates() if aggregated(db) else []), *columns)
+
+def to_rows(db: Session, rows) -> list[OrganizationRow]:
+    if aggregated(db):
+        return [OrganizationRow(row.name, row.building_id, row.id, row.phone_numbers, row.activity_ids) for row in rows]
+    result = [OrganizationRow(row.name, row.building_id, row.id, [], []) for row in rows]
+    if result:
+        attach_relations(db, result)
+    return result
+
+def attach_relations(db: Session, organizations: list[OrganizationRow]):
+    # phone numbers and activity ids of a page of organizations, one query per relation
+    by_id = {org.id: org for org in organizations}
+    ids = list(by_id)
+    for org_id, number in db.execute(
+        select(models.PhoneNumber.organization_id, models.PhoneNumber.number)
+        .where(models.PhoneNumber.organization_id.in_(ids))
+        .order_by(models.PhoneNumber.id)
+    ):
+        by_id[org_id].phone_numbers.append(number)
+    for org_id, activity_id in db.execute(
+        select(models.organization_activity.c.organization_id, models.organization_activity.c.activity_id)
+        .where(models.organization_activity.c.organization_id.in_(ids))
+        .order_by(models.organization_activity.c.activity_id)
+    ):
+        by_id[org_id].activity_ids.append(activity_id)
+
+def by_ids(db: Session, ids) -> dict[int, OrganizationRow]:
+    # the given organizations by id, missing ids are left out
+    ids = list(ids)
+    if not ids:
+        return {}
+    rows = organizations_query(db).filter(models.Organization.id.in_(ids)).all()
+    return {org.id: org for org in to_rows(db, rows)}
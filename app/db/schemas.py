@@ -62,6 +62,12 @@ class PhoneNumberResponse(PhoneNumberBase):
     class Config:
         from_attributes = True
 
+# phone lookup, organization_id is None for unknown or malformed numbers
+class PhoneLookupResult(BaseModel):
+    number: str
+    organization_id: Optional[int] = None
+    organization_name: Optional[str] = None
+
 # organization
 class OrganizationBase(BaseModel):
     name: str = None
@@ -77,10 +83,82 @@ class OrganizationUpdate(BaseModel):
     activity_ids: Optional[List[int]] = None
     phone_numbers: Optional[List[PhoneNumberBase]] = None
 
+class OrganizationBatchUpdate(OrganizationUpdate):
+    id: int
+
+class OrganizationBatchResult(BaseModel):
+    ids: List[int]
+
 class Organization(OrganizationBase):
     id: int
     phone_numbers: List[str] = None
     activity_ids: List[int] = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class OrganizationSuggestion(BaseModel):
+    id: int
+    name: str
+
+class OrganizationWithDistance(Organization):
+    distance: float
+
+class NearbyQuery(BaseModel):
+    lat: float = Field(..., ge = -90, le = 90)
+    lon: float = Field(..., ge = -180, le = 180)
+    radius: float = Field(..., gt = 0, description = "Radius in meters")
+
+class NearbyBatchResult(NearbyQuery):
+    organizations: List[OrganizationWithDistance] = []
+
+# map tile aggregates, cells at zoom level z + resolution
+class TileCell(BaseModel):
+    x: int
+    y: int
+    count: int
+    latitude: float
+    longitude: float
+
+class Tile(BaseModel):
+    z: int
+    x: int
+    y: int
+    cell_zoom: int
+    cells: List[TileCell] = []
+
+# bulk import rows, ids are optional and assigned by the database when missing
+class BuildingImport(BaseModel):
+    id: Optional[int] = None
+    address: str = Field(..., min_length = 1)
+    latitude: float = Field(..., ge = -90, le = 90)
+    longitude: float = Field(..., ge = -180, le = 180)
+
+class ActivityImport(BaseModel):
+    id: Optional[int] = None
+    name: str = Field(..., min_length = 1, max_length = 100)
+    parent_id: Optional[int] = None
+
+class OrganizationImport(BaseModel):
+    id: Optional[int] = None
+    name: str = Field(..., min_length = 1)
+    building_id: int
+
+class PhoneNumberImport(BaseModel):
+    number: str = Field(..., pattern = r"^\+?[1-9]\d{1,14}$")
+    organization_id: int
+
+class OrganizationActivityImport(BaseModel):
+    organization_id: int
+    activity_id: int
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    entity: str
+    rows: int = 0
+    inserted: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
@@ -1,10 +1,19 @@
+import itertools
+import time
+from fastapi import Request, Response
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.db.models import Building, Activity, Organization, PhoneNumber
+from app.db import activity_closure
+from app.db.pool import instrument, pool_options
+from app.activity_tree import activity_tree
+from app.settings import settings
 
-SQLALCHEMY_DATABASE_URL = "postgresql://postgres:postgres@db:5432/organizations_db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+SQLALCHEMY_DATABASE_URL = settings.database_url
+engine = instrument(create_engine(SQLALCHEMY_DATABASE_URL, **pool_options()), "primary")
 SessionLocal = sessionmaker(autocommit = False, autoflush = False, bind = engine)
 Base = declarative_base()
 
@@ -15,6 +24,78 @@ def get_db():
     finally:
         db.close()
 
+## read replicas
+
+# cookie with the time until which the client reads from the primary, set after its writes
+STICKY_COOKIE = "read_primary_until"
+
+replica_engines = [
+    instrument(create_engine(url, **pool_options()), f"replica_{i}")
+    for i, url in enumerate(settings.database_replica_urls)
+]
+ReplicaSessionLocals = [sessionmaker(autocommit = False, autoflush = False, bind = e) for e in replica_engines]
+_next_replica = itertools.count()
+
+def choose_replica(engines: list) -> int:
+    # index of the replica for the next read, by the configured strategy
+    if settings.db_replica_strategy == "least_connections":
+        return min(range(len(engines)), key = lambda i: engines[i].pool.checkedout())
+    return next(_next_replica) % len(engines)
+
+def stick_to_primary(response: Response):
+    # called after a successful write, the client's next reads see it
+    until = time.time() + settings.db_sticky_seconds
+    response.set_cookie(STICKY_COOKIE, f"{until:.3f}", max_age = max(int(settings.db_sticky_seconds) + 1, 1), httponly = True)
+
+def is_sticky(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def read_sessionmaker(request: Request = None) -> sessionmaker:
+    # primary without replicas or right after a write of this client, a replica otherwise
+    if not ReplicaSessionLocals or (request is not None and is_sticky(request)):
+        return SessionLocal
+    return ReplicaSessionLocals[choose_replica(replica_engines)]
+
+def get_read_db(request: Request):
+    # session for the read-only routes, may lag behind the primary by the replication delay
+    db = read_sessionmaker(request)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+## async stack, created on first use so the async drivers are only needed when it is enabled
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+# pool name -> async sessionmaker
+async_sessionmakers = {}
+
+def get_async_sessionmaker(url: str = None, name: str = "primary") -> async_sessionmaker:
+    if name not in async_sessionmakers:
+        url = make_url(url or SQLALCHEMY_DATABASE_URL)
+        async_engine = instrument(
+            create_async_engine(url.set(drivername = ASYNC_DRIVERS[url.get_backend_name()]), **pool_options(asynchronous = True)),
+            f"{name}_async"
+        )
+        async_sessionmakers[name] = async_sessionmaker(async_engine, class_ = AsyncSession, autoflush = False, expire_on_commit = True)
+    return async_sessionmakers[name]
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+async def get_async_read_db(request: Request):
+    if not settings.database_replica_urls or is_sticky(request):
+        maker = get_async_sessionmaker()
+    else:
+        makers = [get_async_sessionmaker(url, f"replica_{i}") for i, url in enumerate(settings.database_replica_urls)]
+        maker = makers[choose_replica([m.kw["bind"].sync_engine for m in makers])]
+    async with maker() as db:
+        yield db
+
 ##
 
 def init_db():
@@ -35,5 +116,8 @@ def init_db():
     
     # добавляем и сохраняем
     db.add_all([building1, building2, food, meat, dairy, org1])
+    db.flush()
+    activity_closure.rebuild(db)
+    activity_tree.bump(db)
     db.commit()
     db.close()
\ No newline at end of file
@@ -0,0 +1,38 @@
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from app.db import models
+
+## shared cache version counters, bump() runs in the caller's transaction
+
+def current(db: Session, name: str) -> int:
+    return db.execute(select(models.CacheVersion.version).where(models.CacheVersion.name == name)).scalar() or 0
+
+def bump(db: Session, name: str):
+    result = db.execute(
+        update(models.CacheVersion)
+        .where(models.CacheVersion.name == name)
+        .values(version = models.CacheVersion.version + 1)
+        .execution_options(synchronize_session = False)
+    )
+    if result.rowcount == 0:
+        db.add(models.CacheVersion(name = name, version = 1))
+        db.flush()
+
+## per-row versions of organizations, buildings and activities, the source of their ETags
+
+def bump_rows(db: Session, model, ids):
+    # version + 1 for the rows with the given ids (a list or a select of ids), in the caller's transaction
+    if isinstance(ids, (list, set, tuple, frozenset)):
+        ids = [i for i in ids if i is not None]
+        if not ids:
+            return
+    db.execute(
+        update(model)
+        .where(model.id.in_(ids))
+        .values(version = model.version + 1)
+        .execution_options(synchronize_session = False)
+    )
+
+def row_version(db: Session, model, id: int) -> int:
+    # None when the row does not exist
+    return db.execute(select(model.version).where(model.id == id)).scalar()
@@ -0,0 +1,23 @@
+from fastapi import Request, Response, status
+
+def make_etag(kind: str, id: int, version: int) -> str:
+    return f'"{kind}-{id}-{version}"'
+
+def matches(request: Request, etag: str) -> bool:
+    # If-None-Match may list several tags, weak ones compare equal to their strong form
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+def conditional(request: Request, response: Response, etag: str) -> Response:
+    """
+    304 Not Modified when the client already has etag, None otherwise.
+    Sets the ETag header on the response either way; call it before loading the entity.
+    """
+    if matches(request, etag):
+        return Response(status_code = status.HTTP_304_NOT_MODIFIED, headers = {"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
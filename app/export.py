@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+from sqlalchemy import select
+from app.db import models
+from app.db.session import read_sessionmaker
+
+# rows fetched from the server-side cursor at once
+EXPORT_CHUNK_SIZE = 1000
+CSV_COLUMNS = ["id", "name", "building_id", "address", "latitude", "longitude", "phone_numbers", "activity_ids"]
+
+def iter_organizations(chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Every organization as a plain dict, read through a server-side cursor in chunks of chunk_size.
+    Phones and activity ids are loaded per chunk, so memory does not grow with the number of rows.
+    Opens its own session (on a read replica when configured): the response is streamed after the request dependencies are closed.
+    """
+    db = read_sessionmaker()()
+    try:
+        result = db.execute(
+            select(
+                models.Organization.id,
+                models.Organization.name,
+                models.Organization.building_id,
+                models.Building.address,
+                models.Building.latitude,
+                models.Building.longitude
+            )
+            .join(models.Building)
+            .order_by(models.Organization.id)
+            .execution_options(stream_results = True, yield_per = chunk_size)
+        )
+        for chunk in result.partitions():
+            ids = [row.id for row in chunk]
+            phones, activities = {}, {}
+            for org_id, number in db.execute(
+                select(models.PhoneNumber.organization_id, models.PhoneNumber.number)
+                .where(models.PhoneNumber.organization_id.in_(ids))
+                .order_by(models.PhoneNumber.id)
+            ):
+                phones.setdefault(org_id, []).append(number)
+            for org_id, activity_id in db.execute(
+                select(models.organization_activity.c.organization_id, models.organization_activity.c.activity_id)
+                .where(models.organization_activity.c.organization_id.in_(ids))
+                .order_by(models.organization_activity.c.activity_id)
+            ):
+                activities.setdefault(org_id, []).append(activity_id)
+            for row in chunk:
+                yield {
+                    "id": row.id,
+                    "name": row.name,
+                    "building_id": row.building_id,
+                    "address": row.address,
+                    "latitude": row.latitude,
+                    "longitude": row.longitude,
+                    "phone_numbers": phones.get(row.id, []),
+                    "activity_ids": activities.get(row.id, []),
+                }
+    finally:
+        db.close()
+
+def ndjson_lines(chunk_size: int = EXPORT_CHUNK_SIZE):
+    for org in iter_organizations(chunk_size):
+        yield json.dumps(org, ensure_ascii = False, separators = (",", ":")) + "\n"
+
+def csv_lines(chunk_size: int = EXPORT_CHUNK_SIZE):
+    # lists are joined with ";" inside their cell
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for org in iter_organizations(chunk_size):
+        org["phone_numbers"] = ";".join(org["phone_numbers"])
+        org["activity_ids"] = ";".join(str(a) for a in org["activity_ids"])
+        writer.writerow([org[column] for column in CSV_COLUMNS])
+        # hand the text out in ~64 KB pieces
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
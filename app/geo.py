@@ -0,0 +1,31 @@
+import math
+
+EARTH_RADIUS = 6371000  # earth radius in meters
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    # great-circle distance in meters
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+    a = (math.sin(delta_phi/2)**2 +
+        math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda/2)**2)
+    return 2 * EARTH_RADIUS * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def bounding_boxes(lat: float, lon: float, radius: float) -> list[tuple[float, float, float, float]]:
+    """
+    Boxes (min_lat, max_lat, min_lon, max_lon) that fully contain the circle of `radius` meters around the point.
+    A circle crossing the antimeridian is split into two boxes, a circle covering a pole spans all longitudes.
+    """
+    angular = radius / EARTH_RADIUS
+    min_lat = lat - math.degrees(angular)
+    max_lat = lat + math.degrees(angular)
+    # the circle covers a pole - every longitude is a candidate
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(angular) / math.cos(math.radians(lat)))))
+    min_lon, max_lon = lon - delta_lon, lon + delta_lon
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
@@ -0,0 +1,102 @@
+import numpy as np
+from sqlalchemy.orm import Session
+from app import geo
+from app.db import models
+from app.snapshot import Snapshot
+
+# seconds before the arrays are reloaded, picks up buildings written by other workers
+RELOAD_INTERVAL = 60.0
+
+def haversine_many(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    # vectorized great-circle distances in meters from one point to many
+    phi1 = np.radians(lat)
+    phi2 = np.radians(lats)
+    delta_phi = phi2 - phi1
+    delta_lambda = np.radians(lons - lon)
+    a = np.sin(delta_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2) ** 2
+    return 2 * geo.EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+class GeoEngine(Snapshot):
+    """
+    In-process copy of building coordinates in contiguous float64 arrays sorted by latitude.
+    Latitude bands are found with a binary search, the distances of the candidates are computed in one numpy call.
+    The buildings router keeps the arrays in sync, readers always see a consistent snapshot.
+    """
+
+    def __init__(self):
+        super().__init__(RELOAD_INTERVAL)
+        # (ids, latitudes, longitudes), replaced as a whole on every change
+        self._arrays = (np.empty(0, dtype = np.int64), np.empty(0, dtype = np.float64), np.empty(0, dtype = np.float64))
+
+    def load(self, db: Session):
+        rows = db.query(models.Building.id, models.Building.latitude, models.Building.longitude).all()
+        ids = np.fromiter((r[0] for r in rows), dtype = np.int64, count = len(rows))
+        lats = np.fromiter((r[1] for r in rows), dtype = np.float64, count = len(rows))
+        lons = np.fromiter((r[2] for r in rows), dtype = np.float64, count = len(rows))
+        order = np.argsort(lats, kind = "stable")
+        with self._lock:
+            self._arrays = (ids[order], np.ascontiguousarray(lats[order]), np.ascontiguousarray(lons[order]))
+            self._swapped()
+
+    def upsert(self, building_id: int, lat: float, lon: float):
+        if self._loaded_at is None and not self._loading():
+            return
+        with self._lock:
+            self._record(self._upsert, building_id, lat, lon)
+            self._upsert(building_id, lat, lon)
+
+    def remove(self, building_id: int):
+        if self._loaded_at is None and not self._loading():
+            return
+        with self._lock:
+            self._record(self._remove, building_id)
+            self._remove(building_id)
+
+    def _upsert(self, building_id: int, lat: float, lon: float):
+        ids, lats, lons = self._without(building_id)
+        pos = int(np.searchsorted(lats, lat))
+        self._arrays = (np.insert(ids, pos, building_id), np.insert(lats, pos, lat), np.insert(lons, pos, lon))
+
+    def _remove(self, building_id: int):
+        self._arrays = self._without(building_id)
+
+    def _without(self, building_id: int):
+        ids, lats, lons = self._arrays
+        keep = ids != building_id
+        if keep.all():
+            return ids, lats, lons
+        return ids[keep], lats[keep], lons[keep]
+
+    def within(self, lat: float, lon: float, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        # building ids within radius meters of the point and their distances
+        return self._within(self._arrays, lat, lon, radius)
+
+    def within_many(self, points: list[tuple[float, float, float]]) -> list[tuple[np.ndarray, np.ndarray]]:
+        # same as within() for many (lat, lon, radius) points, all answered from one snapshot
+        arrays = self._arrays
+        return [self._within(arrays, lat, lon, radius) for lat, lon, radius in points]
+
+    def within_box(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> np.ndarray:
+        # building ids inside the latitude / longitude rectangle
+        ids, lats, lons = self._arrays
+        start = np.searchsorted(lats, min_lat, side = "left")
+        stop = np.searchsorted(lats, max_lat, side = "right")
+        band_lons = lons[start:stop]
+        return ids[np.flatnonzero((band_lons >= min_lon) & (band_lons <= max_lon)) + start]
+
+    @staticmethod
+    def _within(arrays, lat: float, lon: float, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        ids, lats, lons = arrays
+        candidates = []
+        for min_lat, max_lat, min_lon, max_lon in geo.bounding_boxes(lat, lon, radius):
+            # latitude band by binary search, longitude by a mask over the band
+            start = np.searchsorted(lats, min_lat, side = "left")
+            stop = np.searchsorted(lats, max_lat, side = "right")
+            band_lons = lons[start:stop]
+            candidates.append(np.flatnonzero((band_lons >= min_lon) & (band_lons <= max_lon)) + start)
+        candidates = np.concatenate(candidates)
+        distances = haversine_many(lat, lon, lats[candidates], lons[candidates])
+        inside = distances <= radius
+        return ids[candidates][inside], distances[inside]
+
+geo_engine = GeoEngine()
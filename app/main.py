@@ -1,41 +1,121 @@
 import math
 import re
+import time
+from contextlib import asynccontextmanager
 from cairo import Status
 from fastapi import APIRouter, HTTPException, Query, status
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
 from sqlalchemy import and_, func, or_
 from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
 from app.db import models
 from app.db import schemas
+from app.db import activity_closure
 from . import security
-from app.db.session import get_db, engine, init_db
+from app.geo_engine import geo_engine
+from app.search import name_index
+from app.tiles import tile_index
+from app.db.session import get_db, engine, init_db, SessionLocal, stick_to_primary
+from app.db.pool import pool_stats
+from app.cache import response_cache
+from app import metrics, profiling, query_budget, search_plan
+from app.settings import settings
 from math import radians, sin, cos, sqrt, atan2
-from app.routes import organizations, buildings, activities, phones
+from app.routes import organizations, buildings, activities, phones, imports, profiles, aio
 
-models.Base.metadata.create_all(bind = engine)
+def load_indexes():
+    # first load of the in-process indexes before any request, in async mode it would run on the event loop
+    db = SessionLocal()
+    try:
+        for index in (geo_engine, name_index, tile_index, search_plan.planner_stats):
+            index.ensure_loaded(db)
+    finally:
+        db.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # backfill the activity closure table for activities written without it
+    db = SessionLocal()
+    try:
+        activity_closure.ensure(db)
+    finally:
+        db.close()
+    await run_in_threadpool(load_indexes)
+    yield
 
 app = FastAPI(
     title = "Organizations API",
     description = "API for managing organizations, buildings, activities, and phones",
     version = "1.0.0",
-    dependencies = [Depends(security.get_api_key)]
+    dependencies = [Depends(security.get_api_key)],
+    lifespan = lifespan
 )
 
+# methods that do not change data, every other successful request pins the client's reads to the primary
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    if request.method not in READ_METHODS and response.status_code < 400:
+        stick_to_primary(response)
+    return response
+
+# X-Profile: 1 requests, inside observe() so the profile reports the SQL stats of its request
+if settings.profiling_enabled:
+    app.middleware("http")(profiling.middleware)
+
+@app.middleware("http")
+async def observe(request: Request, call_next):
+    # latency, status code and SQL statements per route, see app.metrics, then the query budget of the route
+    stats = metrics.request_started()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        route = metrics.route_of(request.scope)
+        metrics.request_finished(stats, request.method, route, status_code, time.perf_counter() - started)
+    query_budget.check(stats, request.method, route, query_budget.route_budget(request.scope))
+    #
+    return response
+
 ## root end-points:
 @app.get("/")
 def read_root():
     return {"message": "Greetings, my friend"}
 
 @app.get("/init/")
-def init_data(api_key: str = Depends(security.get_api_key)):
+def init_data(response: Response, api_key: str = Depends(security.get_api_key)):
     try:
         init_db()
+        stick_to_primary(response)
+        geo_engine.invalidate()
+        name_index.invalidate()
+        search_plan.planner_stats.invalidate()
+        tile_index.invalidate()
         return {"message": "the start data was initialized"}
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
-    
-# routes
-app.include_router(buildings.router)
-app.include_router(activities.router)
-app.include_router(organizations.router)
-app.include_router(phones.router)
+
+@app.get("/metrics")
+async def read_metrics():
+    # Prometheus text format, async so it reads the counters on the event loop thread that updates them
+    return Response(content = metrics.render(pool_stats(), response_cache.stats()), media_type = metrics.CONTENT_TYPE)
+
+@app.get("/metrics/pool")
+def read_pool_metrics():
+    # connection pool counters of this worker process
+    return pool_stats()
+
+@app.get("/metrics/cache")
+def read_cache_metrics():
+    # response cache hits, misses and evictions
+    return response_cache.stats()
+
+# routes, DB_MODE=async serves them on the async engine (asyncpg), the default sync mode uses the threadpool
+for router in [buildings.router, activities.router, organizations.router, phones.router, imports.router]:
+    app.include_router(aio.asyncify(router) if settings.db_mode == "async" else router)
+if settings.profiling_enabled:
+    app.include_router(profiles.router)
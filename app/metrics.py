@@ -0,0 +1,185 @@
+"""
+Request and SQL metrics of this worker process in the Prometheus text format, served by GET /metrics.
+
+The middleware in app.main observes every request on the event loop thread, so the counters and histograms below
+are plain ints and lists without locks. SQL statements are counted and timed by engine events into the RequestStats
+of the current request (a context variable, shared with the threadpool that runs the sync endpoints)
+and folded into the per-route histograms when the request is done.
+Statements outside of requests (startup, a streamed export body) are not counted.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# upper bounds of the histogram buckets, seconds and statements
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+# label of requests that matched no route, so unknown paths do not add series
+UNMATCHED = "unmatched"
+
+## metric types
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # label values -> count
+        self.series = {}
+
+    def inc(self, *label_values, value: float = 1):
+        self.series[label_values] = self.series.get(label_values, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.series.items():
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    """
+    Pre-bucketed histogram: an observation increments the one bucket it falls into, render() sums them up
+    into the cumulative le buckets of Prometheus.
+    """
+
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self.labels = labels
+        # label values -> [counts per bucket plus +Inf, sum]
+        self.series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.bounds) + 1), 0]
+        series[0][bisect_left(self.bounds, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + ("+Inf",), counts):
+                cumulative += count
+                labels = format_labels(self.labels + ("le",), label_values + (str(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {round(total, 6)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + "}"
+
+## metrics of the requests
+
+requests_total = Counter("http_requests_total", "Requests by route and status code.", ("method", "route", "status"))
+request_duration = Histogram(
+    "http_request_duration_seconds", "Time until the response headers, by route.", LATENCY_BUCKETS, ("method", "route")
+)
+request_statements = Histogram("db_request_statements", "SQL statements executed per request.", STATEMENT_BUCKETS, ("method", "route"))
+request_sql_duration = Histogram("db_request_sql_seconds", "Time spent in SQL statements per request.", LATENCY_BUCKETS, ("method", "route"))
+in_flight = 0
+
+class RequestStats:
+    __slots__ = ("statements", "sql_seconds", "shapes")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        # statement text -> executions, the parameters are bound separately so equal text means equal shape
+        self.shapes = {}
+
+current_request: ContextVar[RequestStats] = ContextVar("current_request", default = None)
+
+def request_started() -> RequestStats:
+    global in_flight
+    in_flight += 1
+    stats = RequestStats()
+    current_request.set(stats)
+    return stats
+
+def request_finished(stats: RequestStats, method: str, route: str, status: int, seconds: float):
+    global in_flight
+    in_flight -= 1
+    requests_total.inc(method, route, str(status))
+    request_duration.observe(seconds, method, route)
+    request_statements.observe(stats.statements, method, route)
+    request_sql_duration.observe(stats.sql_seconds, method, route)
+
+def route_of(scope: dict) -> str:
+    # path template of the matched route, set into the scope by the router
+    route = scope.get("route")
+    return getattr(route, "path", UNMATCHED)
+
+## SQL statements
+
+def track_statements(engine):
+    # count and time the statements of the engine into the current request
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = current_request.get()
+        if stats is None:
+            return
+        stats.statements += 1
+        # the batches of one executemany (insertmanyvalues) share a shape but are not an N+1 pattern
+        if not getattr(context, "executemany", False):
+            stats.shapes[statement] = stats.shapes.get(statement, 0) + 1
+        started = getattr(context, "_metrics_started", None)
+        if started is not None:
+            stats.sql_seconds += time.perf_counter() - started
+
+    return engine
+
+## exposition
+
+# pool snapshot keys that are counters, the rest are gauges
+POOL_COUNTERS = {"checkouts", "wait_seconds_total", "overflow_connects", "timeouts"}
+# pool snapshot keys that are derived from the others
+POOL_SKIPPED = {"pool", "wait_seconds_avg"}
+# cache stats keys that are gauges, the rest are counters
+CACHE_GAUGES = {"entries", "bytes"}
+
+def render_stats(prefix: str, rows: list[dict], label: str, counters) -> list[str]:
+    # dict snapshots as one metric per key, labelled by the label key of each row
+    metrics = {}
+    for row in rows:
+        for key, value in row.items():
+            if key == label or key in POOL_SKIPPED or isinstance(value, (str, bool)) or value is None:
+                continue
+            counter = counters(key)
+            name = f"{prefix}_{key}" + ("_total" if counter and not key.endswith("_total") else "")
+            metrics.setdefault((name, counter), []).append((row.get(label), value))
+    lines = []
+    for (name, counter), samples in metrics.items():
+        lines.append(f"# TYPE {name} {'counter' if counter else 'gauge'}")
+        for label_value, value in samples:
+            lines.append(f"{name}{format_labels((label,), (label_value,)) if label_value is not None else ''} {value}")
+    return lines
+
+def render(pools: list[dict], cache: dict) -> str:
+    lines = [
+        "# HELP http_requests_in_flight Requests being served.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {in_flight}",
+    ]
+    for metric in (requests_total, request_duration, request_statements, request_sql_duration):
+        lines.extend(metric.render())
+    lines.extend(render_stats("db_pool", pools, "pool", lambda key: key in POOL_COUNTERS))
+    lines.extend(render_stats("response_cache", [cache], "backend", lambda key: key not in CACHE_GAUGES))
+    #
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,8 @@
 from logging.config import fileConfig
-from sqlalchemy import engine_from_config, pool
+from sqlalchemy import create_engine, pool
 from alembic import context
 from app.db.models import Base
-import app.db.session
+from app.settings import settings
 import sys
 from pathlib import Path
 
@@ -14,7 +14,7 @@ fileConfig(config.config_file_name)
 target_metadata = Base.metadata
 
 def run_migrations_offline():
-    url = app.db.session.SQLALCHEMY_DATABASE_URL
+    url = settings.database_url
     context.configure(
         url = url,
         target_metadata = target_metadata,
@@ -25,11 +25,8 @@ def run_migrations_offline():
         context.run_migrations()
 
 def run_migrations_online():
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section),
-        prefix = "sqlalchemy.",
-        poolclass = pool.NullPool,
-    )
+    # DATABASE_URL of the environment, the url in alembic.ini is not used
+    connectable = create_engine(settings.database_url, poolclass = pool.NullPool)
     with connectable.connect() as connection:
         context.configure(
             connection = connection, target_metadata = target_metadata
@@ -17,8 +17,53 @@ depends_on = None
 
 
 def upgrade() -> None:
-    pass
+    # databases created by the old create_all at import already have the tables, they are skipped
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "buildings" not in existing:
+        op.create_table(
+            "buildings",
+            sa.Column("id", sa.Integer(), primary_key = True),
+            sa.Column("address", sa.String(), nullable = False),
+            sa.Column("latitude", sa.Float(), nullable = False),
+            sa.Column("longitude", sa.Float(), nullable = False),
+        )
+        op.create_index("ix_buildings_id", "buildings", ["id"])
+    if "activities" not in existing:
+        op.create_table(
+            "activities",
+            sa.Column("id", sa.Integer(), primary_key = True),
+            sa.Column("name", sa.String(), nullable = False),
+            sa.Column("parent_id", sa.Integer(), sa.ForeignKey("activities.id"), nullable = True),
+            sa.Column("level", sa.Integer(), nullable = True),
+        )
+        op.create_index("ix_activities_id", "activities", ["id"])
+    if "organizations" not in existing:
+        op.create_table(
+            "organizations",
+            sa.Column("id", sa.Integer(), primary_key = True),
+            sa.Column("name", sa.String(), nullable = False),
+            sa.Column("building_id", sa.Integer(), sa.ForeignKey("buildings.id"), nullable = False),
+        )
+        op.create_index("ix_organizations_id", "organizations", ["id"])
+    if "phone_numbers" not in existing:
+        op.create_table(
+            "phone_numbers",
+            sa.Column("id", sa.Integer(), primary_key = True),
+            sa.Column("number", sa.String(), nullable = False),
+            sa.Column("organization_id", sa.Integer(), sa.ForeignKey("organizations.id"), nullable = False),
+        )
+        op.create_index("ix_phone_numbers_id", "phone_numbers", ["id"])
+    if "organization_activity" not in existing:
+        op.create_table(
+            "organization_activity",
+            sa.Column("organization_id", sa.Integer(), sa.ForeignKey("organizations.id"), primary_key = True),
+            sa.Column("activity_id", sa.Integer(), sa.ForeignKey("activities.id"), primary_key = True),
+        )
 
 
 def downgrade() -> None:
-    pass
+    op.drop_table("organization_activity")
+    op.drop_table("phone_numbers")
+    op.drop_table("organizations")
+    op.drop_table("activities")
+    op.drop_table("buildings")
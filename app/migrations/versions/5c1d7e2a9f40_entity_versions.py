@@ -0,0 +1,34 @@
+"""entity version columns
+
+Revision ID: 5c1d7e2a9f40
+Revises: aab38e85d07b
+Create Date: 2026-10-17 14:05:12.531907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1d7e2a9f40'
+down_revision = 'aab38e85d07b'
+branch_labels = None
+depends_on = None
+
+TABLES = ["buildings", "activities", "organizations"]
+
+
+def upgrade() -> None:
+    # the tables may already have the column when they were created by the application
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        if table in inspector.get_table_names() and "version" not in {c["name"] for c in inspector.get_columns(table)}:
+            op.add_column(table, sa.Column("version", sa.Integer(), nullable = False, server_default = "1"))
+
+
+def downgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        if table in inspector.get_table_names() and "version" in {c["name"] for c in inspector.get_columns(table)}:
+            with op.batch_alter_table(table) as batch:
+                batch.drop_column("version")
@@ -0,0 +1,40 @@
+"""activity closure and cache version tables
+
+Revision ID: 8d2f6b1c3e57
+Revises: 5c1d7e2a9f40
+Create Date: 2026-10-17 16:21:47.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2f6b1c3e57'
+down_revision = '5c1d7e2a9f40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # the application backfills the closure table on startup (activity_closure.ensure)
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "activity_closure" not in existing:
+        op.create_table(
+            "activity_closure",
+            sa.Column("ancestor_id", sa.Integer(), sa.ForeignKey("activities.id", ondelete = "CASCADE"), primary_key = True),
+            sa.Column("descendant_id", sa.Integer(), sa.ForeignKey("activities.id", ondelete = "CASCADE"), primary_key = True),
+            sa.Column("depth", sa.Integer(), nullable = False),
+        )
+        op.create_index("ix_activity_closure_descendant_id", "activity_closure", ["descendant_id"])
+    if "cache_versions" not in existing:
+        op.create_table(
+            "cache_versions",
+            sa.Column("name", sa.String(), primary_key = True),
+            sa.Column("version", sa.Integer(), nullable = False),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("cache_versions")
+    op.drop_table("activity_closure")
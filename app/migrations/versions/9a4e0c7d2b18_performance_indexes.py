@@ -0,0 +1,60 @@
+"""foreign key, coordinate and phone number indexes
+
+Revision ID: 9a4e0c7d2b18
+Revises: 8d2f6b1c3e57
+Create Date: 2026-10-17 16:48:03.115620
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4e0c7d2b18'
+down_revision = '8d2f6b1c3e57'
+branch_labels = None
+depends_on = None
+
+# name, table, indexed columns or expression
+INDEXES = [
+    ("ix_organizations_building_id", "organizations", "building_id"),
+    ("ix_phone_numbers_organization_id", "phone_numbers", "organization_id"),
+    ("ix_phone_numbers_number", "phone_numbers", "number"),
+    ("ix_activities_parent_id", "activities", "parent_id"),
+    ("ix_organization_activity_activity_id", "organization_activity", "activity_id"),
+    ("ix_buildings_latitude_longitude", "buildings", "latitude, longitude"),
+]
+# numbers that differ only by the leading + of E.164 are the same number
+NORMALIZED_NUMBER = ("ix_phone_numbers_number_normalized", "phone_numbers", "(ltrim(number, '+'))")
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    duplicates = bind.execute(sa.text(
+        "SELECT ltrim(number, '+') FROM phone_numbers GROUP BY ltrim(number, '+') HAVING count(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(f"phone numbers stored more than once, remove the duplicates before upgrading: {duplicates[:20]}")
+    if bind.dialect.name == "postgresql":
+        # without blocking writes, IF NOT EXISTS skips the ones create_all already made
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+            name, table, expression = NORMALIZED_NUMBER
+            op.execute(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({expression})")
+    else:
+        for name, table, columns in INDEXES:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        name, table, expression = NORMALIZED_NUMBER
+        op.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({expression})")
+
+
+def downgrade() -> None:
+    names = [name for name, _, _ in INDEXES] + [NORMALIZED_NUMBER[0]]
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            for name in names:
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    else:
+        for name in names:
+            op.execute(f"DROP INDEX IF EXISTS {name}")
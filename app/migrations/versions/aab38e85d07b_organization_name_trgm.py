@@ -0,0 +1,35 @@
+"""organization name trigram index
+
+Revision ID: aab38e85d07b
+Revises: 19f4118abb9b
+Create Date: 2026-10-17 10:12:41.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'aab38e85d07b'
+down_revision = '19f4118abb9b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # substring search on organizations.name, other databases use the in-process n-gram index
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_organizations_name_trgm "
+            "ON organizations USING gin (name gin_trgm_ops)"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_organizations_name_trgm")
@@ -0,0 +1,42 @@
+import base64
+import json
+from fastapi import HTTPException, Response, status
+from sqlalchemy import tuple_
+
+# response header with the cursor of the next page, absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values) -> str:
+    # opaque cursor from the sort key values of the last row
+    return base64.urlsafe_b64encode(json.dumps(list(values), separators = (",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "invalid cursor")
+    return values
+
+def set_next_cursor(response: Response, values):
+    if values is not None:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(values)
+
+def keyset(query, columns: list, key, response: Response, cursor: str = None, skip: int = 0, limit: int = 100) -> list:
+    """
+    One page of query ordered by columns (the last one unique, usually the id), starting after cursor.
+    key(row) returns the values of the columns for a row; the cursor of the next page is set on the response.
+    Without a cursor a non-zero skip falls back to offset paging for old clients.
+    """
+    query = query.order_by(*columns)
+    if cursor:
+        query = query.filter(tuple_(*columns) > tuple_(*decode_cursor(cursor, len(columns))))
+    elif skip:
+        query = query.offset(skip)
+    # one extra row tells whether there is a next page
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        set_next_cursor(response, key(rows[-1]))
+    return rows
@@ -0,0 +1,178 @@
+"""
+On-demand profile of a single request, enabled by PROFILING_ENABLED and triggered per request
+with the X-Profile: 1 header next to a valid X-API-KEY.
+
+A sampler thread reads the stacks of all threads every PROFILING_INTERVAL_MS and keeps those running on behalf
+of the profiled request: a frame holds the request's contextvars Context (asyncio handles, threadpool workers)
+or the Profile itself (the greenlets of DB_MODE=async, see app.routes.aio). The samples are written as folded stacks
+(flamegraph.pl, speedscope) plus a json breakdown: exact SQL time from app.metrics and sampled time per category.
+With profiling disabled neither the middleware nor the routes are registered.
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from starlette.concurrency import run_in_threadpool
+from app import metrics, security
+from app.settings import settings
+
+# request header that asks for a profile
+HEADER = "X-Profile"
+# (category, path fragment of the frame file, function names or None for any), the innermost matching frame wins
+CATEGORIES = [
+    ("sql", "sqlalchemy/engine/", {"do_execute", "do_executemany", "do_execute_no_params", "_exec_insertmany_context"}),
+    ("sql", "sqlalchemy/engine/cursor", None),
+    ("orm", "sqlalchemy/orm/loading", None),
+    ("serialization", "fastapi/routing", {"serialize_response"}),
+    ("serialization", "fastapi/encoders", None),
+    ("serialization", "app/responses", None),
+    ("serialization", "starlette/responses", {"render"}),
+    ("validation", "fastapi/dependencies/", None),
+    ("validation", "pydantic", None),
+]
+
+class Profile:
+    def __init__(self, interval: float):
+        self.id = uuid.uuid4().hex
+        self.interval = interval
+        # folded stack -> samples
+        self.stacks = Counter()
+        self.categories = Counter()
+        self.samples = 0
+        # sampling rounds and their seconds, the real period is longer than the interval under GIL contention
+        self.ticks = 0
+        self.seconds = 0.0
+
+    def attributed(self, frame) -> bool:
+        # the stack runs on behalf of this request
+        while frame is not None:
+            for value in frame.f_locals.values():
+                if value is self:
+                    return True
+                context = value if isinstance(value, contextvars.Context) else getattr(value, "_context", None)
+                if isinstance(context, contextvars.Context) and context.get(current_profile) is self:
+                    return True
+            frame = frame.f_back
+        return False
+
+    def add(self, frame):
+        names, category = [], None
+        while frame is not None:
+            code = frame.f_code
+            filename = code.co_filename.replace("\\", "/")
+            if category is None:
+                category = categorize(filename, code.co_name)
+            names.append(f"{code.co_name} ({short_path(filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(names))] += 1
+        self.categories[category or "app"] += 1
+        self.samples += 1
+
+current_profile: contextvars.ContextVar[Profile] = contextvars.ContextVar("current_profile", default = None)
+
+def categorize(filename: str, function: str) -> str:
+    for category, fragment, functions in CATEGORIES:
+        if fragment in filename and (functions is None or function in functions):
+            return category
+    return None
+
+def short_path(filename: str) -> str:
+    # path below site-packages or the project, ';' separates the frames of a folded stack
+    for marker in ("site-packages/", "/app/"):
+        if marker in filename:
+            filename = ("app/" if marker == "/app/" else "") + filename.rsplit(marker, 1)[1]
+            break
+    return filename.replace(";", ":")
+
+class Sampler(threading.Thread):
+    def __init__(self, profile: Profile):
+        super().__init__(name = f"profile-{profile.id}", daemon = True)
+        self.profile = profile
+        self.stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        started = time.perf_counter()
+        while not self.stopped.wait(self.profile.interval):
+            self.profile.ticks += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own and self.profile.attributed(frame):
+                    self.profile.add(frame)
+        self.profile.seconds = time.perf_counter() - started
+
+def requested(request) -> bool:
+    # the middleware sees the request before the api key dependency, so it checks the key itself
+    return request.headers.get(HEADER) == "1" and security.valid_api_key(request.headers.get("X-API-KEY"))
+
+def start() -> tuple[Profile, Sampler]:
+    profile = Profile(settings.profiling_interval_ms / 1000)
+    current_profile.set(profile)
+    sampler = Sampler(profile)
+    sampler.start()
+    return profile, sampler
+
+def breakdown(profile: Profile, request, status_code: int, wall_seconds: float, stats) -> dict:
+    period = profile.seconds / profile.ticks if profile.ticks else profile.interval
+    sampled = {category: round(n * period * 1000, 2) for category, n in profile.categories.most_common()}
+    return {
+        "id": profile.id,
+        "method": request.method,
+        "path": request.url.path,
+        "query": request.url.query,
+        "status": status_code,
+        "wall_ms": round(wall_seconds * 1000, 2),
+        "interval_ms": settings.profiling_interval_ms,
+        "samples": profile.samples,
+        # exact, from the engine events
+        "sql": {"statements": stats.statements, "ms": round(stats.sql_seconds * 1000, 2)} if stats is not None else None,
+        # estimated from the samples
+        "sampled_ms": sampled,
+    }
+
+def finish(sampler: Sampler, profile: Profile, request, status_code: int, wall_seconds: float, stats) -> dict:
+    # waits for the last sampling round and writes the files, run in the threadpool off the event loop
+    sampler.join()
+    summary = breakdown(profile, request, status_code, wall_seconds, stats)
+    save(profile, summary)
+    return summary
+
+def save(profile: Profile, summary: dict):
+    os.makedirs(settings.profiling_dir, exist_ok = True)
+    with open(profile_path(profile.id, "folded"), "w", encoding = "utf-8") as f:
+        f.writelines(f"{stack} {n}\n" for stack, n in profile.stacks.most_common())
+    with open(profile_path(profile.id, "json"), "w", encoding = "utf-8") as f:
+        json.dump(summary, f, indent = 2)
+
+def profile_path(profile_id: str, extension: str) -> str:
+    return os.path.join(settings.profiling_dir, f"{profile_id}.{extension}")
+
+def server_timing(summary: dict) -> str:
+    # Server-Timing header, shown by the browser dev tools
+    # sql-execute is measured by the engine events, the sampled sql also covers fetching the rows
+    parts = [f"total;dur={summary['wall_ms']}"]
+    if summary["sql"]:
+        parts.append(f"sql-execute;dur={summary['sql']['ms']}")
+    parts.extend(f"{category};dur={ms};desc=sampled" for category, ms in summary["sampled_ms"].items())
+    return ", ".join(parts)
+
+async def middleware(request, call_next):
+    # registered by app.main when profiling is enabled, inside the metrics middleware whose stats it reports
+    if not requested(request):
+        return await call_next(request)
+    profile, sampler = start()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        sampler.stopped.set()
+    summary = await run_in_threadpool(
+        finish, sampler, profile, request, response.status_code, time.perf_counter() - started, metrics.current_request.get()
+    )
+    response.headers["X-Profile-Id"] = profile.id
+    response.headers["Server-Timing"] = server_timing(summary)
+    #
+    return response
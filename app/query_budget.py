@@ -0,0 +1,60 @@
+"""
+Per-request checks of the SQL statements counted by app.metrics.
+
+An N+1 pattern is one statement shape executed n_plus_one_threshold times or more in a request, typically a query
+inside a loop or lazy loads while serializing. A route declares the most statements it may run with @budget(n),
+and raises the repetition threshold with @budget(n, repeated = m) where a bounded loop of queries is intended.
+Violations are logged as warnings; with QUERY_BUDGET_STRICT=1 the request fails with QueryBudgetExceeded,
+which the test client re-raises.
+"""
+import logging
+from app.metrics import RequestStats
+from app.settings import settings
+
+logger = logging.getLogger("app.queries")
+# characters of a statement shown in the report
+SHAPE_PREVIEW = 200
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+def budget(max_statements: int = None, repeated: int = None):
+    """
+    Declare the SQL statement budget of a route, applied below the router decorator:
+
+        @router.get("/{id}")
+        @budget(3)
+        def get_item(...):
+    """
+    def decorate(endpoint):
+        endpoint.query_budget = (max_statements, repeated)
+        return endpoint
+    return decorate
+
+def route_budget(scope: dict) -> tuple:
+    # (max statements, repetition threshold) of the matched route, None for what it does not declare
+    endpoint = getattr(scope.get("route"), "endpoint", None)
+    return getattr(endpoint, "query_budget", (None, None))
+
+def repeated_shapes(stats: RequestStats, threshold: int) -> list[tuple[str, int]]:
+    # statement shapes executed at least threshold times, most frequent first
+    return sorted(((shape, n) for shape, n in stats.shapes.items() if n >= threshold), key = lambda item: -item[1])
+
+def violations(stats: RequestStats, max_statements: int = None, threshold: int = None) -> list[str]:
+    threshold = threshold or settings.n_plus_one_threshold
+    problems = []
+    if max_statements is not None and stats.statements > max_statements:
+        problems.append(f"{stats.statements} statements, budget {max_statements}")
+    for shape, n in repeated_shapes(stats, threshold):
+        problems.append(f"N+1: {n} x {' '.join(shape.split())[:SHAPE_PREVIEW]}")
+    return problems
+
+def check(stats: RequestStats, method: str, route: str, route_budget: tuple = (None, None)):
+    # called by the middleware when the request is done
+    problems = violations(stats, *route_budget)
+    if not problems:
+        return
+    message = f"{method} {route}: " + "; ".join(problems)
+    if settings.query_budget_strict:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
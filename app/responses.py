@@ -0,0 +1,22 @@
+import orjson
+from fastapi import Response
+from app.settings import settings
+
+class FastJSONResponse(Response):
+    # orjson encoding, dataclasses (the read model rows) are serialized natively
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option = orjson.OPT_NON_STR_KEYS)
+
+def fast(content, response: Response = None):
+    """
+    Response for content that is already in the shape of the route's response_model, e.g. read model rows.
+    Returning a Response skips FastAPI's validation and jsonable_encoder pass; with FAST_RESPONSES=0
+    the content is returned as is and goes through the response_model again.
+    Headers set on the route's injected response (next page cursor, ETag) are carried over.
+    """
+    if not settings.fast_responses:
+        return content
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"} if response is not None else None
+    return FastJSONResponse(content, headers = headers)
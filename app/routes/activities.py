@@ -1,10 +1,13 @@
 from cairo import Status
 from fastapi import APIRouter, HTTPException, status
-from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
-from app import security
-from app.db.session import get_db
-from app.db import models, schemas
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app import cache, etag, pagination, security
+from app.query_budget import budget
+from app.activity_tree import activity_tree
+from app.db.session import get_db, get_read_db
+from app.db import activity_closure, models, schemas, versions
 
 router = APIRouter(
     prefix = "/activities",
@@ -14,14 +17,20 @@ router = APIRouter(
 ## activities end-points
 
 @router.get("/", response_model = list[schemas.ActivityResponse])
+@budget(1)
 def get_activities(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(security.get_api_key)
 ):
     try:
-        activities = db.query(models.Activity).offset(skip).limit(limit).all()
+        activities = pagination.keyset(
+            db.query(models.Activity), [models.Activity.id], lambda a: [a.id],
+            response, cursor = cursor, skip = skip, limit = limit
+        )
         if not activities:
             raise HTTPException(status_code = 404, detail = f"no one activities was not found")
         #
@@ -30,11 +39,20 @@ def get_activities(
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.get("/{id}", response_model = schemas.ActivityResponse)
+@budget(2)
 def get_activity(
     id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(security.get_api_key)
 ):
+    version = versions.row_version(db, models.Activity, id)
+    if version is None:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"activity {id} not found")
+    not_modified = etag.conditional(request, response, etag.make_etag("activity", id, version))
+    if not_modified is not None:
+        return not_modified
     try:
         db_activity = db.query(models.Activity).filter(models.Activity.id == id).first()
         if db_activity is None:
@@ -45,52 +63,58 @@ def get_activity(
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.get("/{id}/tree", response_model = schemas.ActivityTreeResponse)
+@budget(2)
 def get_activity_tree(
     id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(security.get_api_key)
 ):
+    # served from the in-memory snapshot of the taxonomy, its version covers every change of the subtree
+    tree = activity_tree.get(db)
+    if id not in tree:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"activity {id} not found")
+    not_modified = etag.conditional(request, response, etag.make_etag("activity-tree", id, tree.version))
+    if not_modified is not None:
+        return not_modified
     try:
-        # prevent circular reference
-        db_activity = db.query(models.Activity).filter(models.Activity.id == id).first()
-        if db_activity is None:
-            raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"activity {id} not found")
-        if db_activity.parent_id == db_activity.id:
-            db_activity.parent_id = None
-            db.commit()
-            db.refresh(db_activity)
-        #
-        db_activity = db.query(models.Activity).options(joinedload(models.Activity.children)).filter(models.Activity.id == id).first()
-        #
-        return db_activity
+        return tree.as_tree(id)
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.post("/", response_model = schemas.ActivityResponse, status_code = status.HTTP_201_CREATED)
+@budget(9)
 def create_activity(
     activity: schemas.ActivityCreate,
     db: Session = Depends(get_db),
     api_key: str = Depends(security.get_api_key)
 ):
     # validate parent exists and level < 3
+    parent = None
     if activity.parent_id:
-        parent = db.query(schemas.Activity).filter(schemas.Activity.id == activity.parent_id).first()
+        parent = db.query(models.Activity).filter(models.Activity.id == activity.parent_id).first()
         if not parent:
             raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "parent activity not found")
         if parent.level >= 3:
             raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "maximum nesting level is 3")
     # create the new activity
     try:
-        db_activity = models.Activity(**activity.dict())
+        db_activity = models.Activity(**activity.dict(), level = parent.level + 1 if parent else 1)
         db.add(db_activity)
+        db.flush()
+        activity_closure.add_node(db, db_activity.id, db_activity.parent_id)
+        activity_tree.bump(db)
         db.commit()
         db.refresh(db_activity)
+        activity_tree.reload(db)
         #
         return db_activity
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.put("/{id}", response_model = schemas.ActivityResponse)
+@budget(14)
 def update_activity(
     id: int,
     activity: schemas.ActivityUpdate,
@@ -98,32 +122,44 @@ def update_activity(
     api_key: str = Depends(security.get_api_key)
 ):
     # checking for the activity
-    db_activity = db.query(schemas.Activity).filter(schemas.Activity.id == id).first()
+    db_activity = db.query(models.Activity).filter(models.Activity.id == id).first()
     if db_activity is None:
         raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"activity {id} not found")
+    update_data = activity.dict(exclude_unset = True)
+    parent_changed = "parent_id" in update_data and update_data["parent_id"] != db_activity.parent_id
     # validate parent changes
-    if activity.parent_id and activity.parent_id != db_activity.parent_id:
-        new_parent = db.query(schemas.Activity).filter(schemas.Activity.id == activity.parent_id).first()
+    if parent_changed and activity.parent_id is not None:
+        new_parent = db.query(models.Activity).filter(models.Activity.id == activity.parent_id).first()
         if not new_parent:
             raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"new parent activity not found")
-        if new_parent.level >= 3:
-            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"cannot move to parent with level 3 or higher")
+        if new_parent.level + activity_closure.subtree_height(db, id) >= 3:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"maximum nesting level is 3")
+        in_subtree = db.query(models.ActivityClosure).filter(
+            models.ActivityClosure.ancestor_id == id,
+            models.ActivityClosure.descendant_id == activity.parent_id
+        ).first()
+        if in_subtree:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"activity cannot be moved under itself or its descendants")
     # update activity information
     try:
-        db_activity = db.query(models.Activity).filter(models.Activity.id == id).first()
-        if not db_activity:
-            raise HTTPException(status_code = 404, detail = f"activity {id} not found")
-        update_data = activity.dict(exclude_unset = True)
         for key, value in update_data.items():
             setattr(db_activity, key, value)
+        db.flush()
+        if parent_changed:
+            activity_closure.move_node(db, id, db_activity.parent_id)
+        # a move changes the levels of the whole subtree
+        versions.bump_rows(db, models.Activity, activity_closure.subtree_ids(id) if parent_changed else [id])
+        activity_tree.bump(db)
         db.commit()
         db.refresh(db_activity)
+        activity_tree.reload(db)
         #
         return db_activity
     except Exception as e:
             raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.delete("/{id}", status_code = status.HTTP_204_NO_CONTENT)
+@budget(16)
 def delete_activity(
     id: int,
     db: Session = Depends(get_db),
@@ -133,8 +169,20 @@ def delete_activity(
         db_activity = db.query(models.Activity).filter(models.Activity.id == id).first()
         if not db_activity:
             raise HTTPException(status_code = Status.HTTP_404_NOT_FOUND, detail = f"activity with ID {id} not found")
+        # children of the deleted activity become top-level activities
+        org_ids = db.execute(
+            select(models.organization_activity.c.organization_id).where(models.organization_activity.c.activity_id == id)
+        ).scalars().all()
+        descendants = activity_closure.remove_node(db, id)
         db.delete(db_activity)
+        db.flush()
+        activity_closure.update_levels(db, descendants)
+        versions.bump_rows(db, models.Activity, descendants)
+        versions.bump_rows(db, models.Organization, org_ids)
+        activity_tree.bump(db)
         db.commit()
+        activity_tree.reload(db)
+        cache.invalidate("organization", *org_ids)
         #
         return None
     except Exception as e:
@@ -0,0 +1,76 @@
+import inspect
+from fastapi import APIRouter, Depends, Response
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import profiling
+from app.db.session import get_async_db, get_async_read_db, get_db, get_read_db
+
+## async versions of the routers
+
+# sync session dependency -> its async counterpart
+ASYNC_DEPENDENCIES = {get_db: get_async_db, get_read_db: get_async_read_db}
+
+def db_parameter(endpoint) -> tuple:
+    # name and dependency of the endpoint parameter that takes the session, (None, None) if it has none
+    for parameter in inspect.signature(endpoint).parameters.values():
+        dependency = getattr(parameter.default, "dependency", None)
+        if dependency in ASYNC_DEPENDENCIES:
+            return parameter.name, dependency
+    return None, None
+
+def asyncify_endpoint(endpoint, db_name: str, dependency, response_model):
+    """
+    Async twin of a sync endpoint: the same function runs inside AsyncSession.run_sync,
+    so its queries go through the async driver on the event loop instead of occupying a threadpool thread.
+    The result is validated inside run_sync as well, lazy loads cannot happen after leaving it.
+    """
+    adapter = TypeAdapter(response_model) if response_model not in (None, inspect.Parameter.empty) else None
+
+    def call(session, kwargs):
+        # a local of the greenlet's root frame, where the profiler looks for the request it samples
+        profile = profiling.current_profile.get()
+        result = endpoint(**kwargs, **{db_name: session})
+        if adapter is None or isinstance(result, Response):
+            return result
+        return adapter.validate_python(result, from_attributes = True)
+
+    async def wrapper(**kwargs):
+        db = kwargs.pop(db_name)
+        return await db.run_sync(call, kwargs)
+
+    signature = inspect.signature(endpoint)
+    wrapper.__signature__ = signature.replace(parameters = [
+        parameter.replace(default = Depends(ASYNC_DEPENDENCIES[dependency]), annotation = AsyncSession) if parameter.name == db_name else parameter
+        for parameter in signature.parameters.values()
+    ])
+    wrapper.__name__ = endpoint.__name__
+    wrapper.__doc__ = endpoint.__doc__
+    # attributes set by decorators, like the query budget
+    wrapper.__dict__.update(endpoint.__dict__)
+    return wrapper
+
+def asyncify(router: APIRouter) -> APIRouter:
+    # copy of the router whose session-using endpoints run on the async engine, the others are kept as they are
+    async_router = APIRouter()
+    for route in router.routes:
+        db_name, dependency = db_parameter(route.endpoint) if isinstance(route, APIRoute) else (None, None)
+        if db_name is None or inspect.iscoroutinefunction(route.endpoint):
+            async_router.routes.append(route)
+            continue
+        async_router.add_api_route(
+            route.path,
+            asyncify_endpoint(route.endpoint, db_name, dependency, route.response_model),
+            response_model = route.response_model,
+            status_code = route.status_code,
+            tags = route.tags,
+            dependencies = route.dependencies,
+            summary = route.summary,
+            description = route.description,
+            responses = route.responses,
+            methods = route.methods,
+            name = route.name,
+            response_class = route.response_class,
+            include_in_schema = route.include_in_schema,
+        )
+    return async_router
@@ -1,10 +1,13 @@
 from cairo import Status
 from fastapi import APIRouter, HTTPException, status
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
-from app import security
-from app.db.session import get_db
-from app.db import models, schemas
+from app import cache, etag, pagination, security
+from app.query_budget import budget
+from app.geo_engine import geo_engine
+from app.tiles import tile_index
+from app.db.session import get_db, get_read_db
+from app.db import models, schemas, versions
 
 router = APIRouter(
     prefix = "/buildings",
@@ -14,14 +17,20 @@ router = APIRouter(
 ## building end-points:
 
 @router.get("/", response_model = list[schemas.Building])
+@budget(1)
 def get_buildings(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(security.get_api_key)
 ):
     try:
-        db_buildings = db.query(models.Building).offset(skip).limit(limit).all()
+        db_buildings = pagination.keyset(
+            db.query(models.Building), [models.Building.id], lambda b: [b.id],
+            response, cursor = cursor, skip = skip, limit = limit
+        )
         if not db_buildings:
             raise HTTPException(status_code = 404, detail = f"no one building was not found")
         #
@@ -30,21 +39,37 @@ def get_buildings(
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.get("/{id}", response_model = schemas.Building)  # Changed to single Building
+@budget(2)
 def get_building(
     id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(security.get_api_key)
 ):
+    version = versions.row_version(db, models.Building, id)
+    if version is None:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"building {id} not found")
+    tag = etag.make_etag("building", id, version)
+    not_modified = etag.conditional(request, response, tag)
+    if not_modified is not None:
+        return not_modified
+    body = cache.get_response("building", id, version)
+    if body is not None:
+        return cache.json_response(body, tag)
     try:
         db_building = db.query(models.Building).filter(models.Building.id == id).first()
         if not db_building:
             raise HTTPException(status_code = 404, detail = f"building {id} not found")
-        #
-        return db_building
+        body = schemas.Building.from_orm(db_building).json().encode()
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+    cache.put_response("building", id, version, body)
+    #
+    return cache.json_response(body, tag)
 
 @router.post("/", response_model = schemas.Building)
+@budget(2)
 def create_building(
     building: schemas.BuildingCreate,
     db: Session = Depends(get_db),
@@ -55,12 +80,15 @@ def create_building(
         db.add(db_building)
         db.commit()
         db.refresh(db_building)
+        geo_engine.upsert(db_building.id, db_building.latitude, db_building.longitude)
+        tile_index.upsert_building(db, db_building.id, db_building.latitude, db_building.longitude)
         #
         return db_building
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.put("/{id}", response_model = schemas.Building)
+@budget(5)
 def update_building(
     id: int,
     building: schemas.BuildingUpdate,
@@ -74,14 +102,19 @@ def update_building(
         update_data = building.dict(exclude_unset = True)
         for key, value in update_data.items():
             setattr(db_building, key, value)
+        versions.bump_rows(db, models.Building, [id])
         db.commit()
         db.refresh(db_building)
+        geo_engine.upsert(db_building.id, db_building.latitude, db_building.longitude)
+        tile_index.upsert_building(db, db_building.id, db_building.latitude, db_building.longitude)
+        cache.invalidate("building", id)
         #
         return db_building
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.delete("/{id}", status_code = status.HTTP_204_NO_CONTENT)
+@budget(4)
 def delete_building(
     id: int,
     db: Session = Depends(get_db),
@@ -93,6 +126,9 @@ def delete_building(
             raise HTTPException(status_code = Status.HTTP_404_NOT_FOUND, detail=f"Building with ID {id} not found")
         db.delete(db_building)
         db.commit()
+        geo_engine.remove(id)
+        tile_index.remove_building(id)
+        cache.invalidate("building", id)
         #
         return None
     except Exception as e:
@@ -0,0 +1,44 @@
+import codecs
+import tempfile
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi import Depends
+from starlette.concurrency import run_in_threadpool
+from app import security
+from app.db import bulk, schemas
+
+router = APIRouter(
+    prefix = "/import",
+    tags = ["Import"]
+)
+
+# request bodies up to this size stay in memory, larger ones are spooled to disk
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+## bulk import end-points
+
+@router.post("/{entity}", response_model = schemas.ImportReport)
+async def import_entities(
+    entity: str,
+    request: Request,
+    format: str = Query(None, pattern = "^(csv|ndjson)$", description = "csv or ndjson, default: by Content-Type"),
+    chunk_size: int = Query(bulk.CHUNK_SIZE, ge = 1, le = 100000),
+    api_key: str = Depends(security.get_api_key)
+):
+    """
+    Bulk import of buildings, activities, organizations, phones or organization_activities.
+    The request body is the CSV (with a header row) or NDJSON file itself.
+    Invalid rows are listed in the report and skipped, valid ones are committed chunk by chunk.
+    """
+    if entity not in bulk.ENTITIES:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"unknown entity {entity}, expected one of {', '.join(bulk.ENTITIES)}")
+    if format is None:
+        format = "ndjson" if "ndjson" in request.headers.get("content-type", "") else "csv"
+    with tempfile.SpooledTemporaryFile(max_size = SPOOL_MAX_SIZE) as body:
+        async for data in request.stream():
+            body.write(data)
+        body.seek(0)
+        stream = codecs.getreader("utf-8")(body)
+        try:
+            return await run_in_threadpool(bulk.import_file, entity, stream, format, chunk_size)
+        except Exception as e:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
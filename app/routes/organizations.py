@@ -1,88 +1,378 @@
+import bisect
+import heapq
 import math
 import re
+import time
+import orjson
 from cairo import Status
 from fastapi import APIRouter, HTTPException, Query, status
-from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
-from app import security
-from app.db.session import get_db
-from app.db import models, schemas
+from fastapi import Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, delete, func, insert, or_, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from app import cache, etag, export, geo, pagination, responses, search, search_plan, security
+from app.query_budget import budget
+from app.activity_tree import activity_tree
+from app.geo_engine import geo_engine
+from app.search import name_index
+from app.tiles import tile_index
+from app.db.session import get_db, get_read_db
+from app.db import models, read_model, schemas, versions
 
 router = APIRouter(
     prefix = "/organizations",
     tags = ["Organizations"]
 )
 
+# knn search: first radius in meters, growth factor and the radius that covers the whole earth
+NEAREST_START_RADIUS = 1000.0
+NEAREST_GROWTH = 4
+NEAREST_MAX_RADIUS = math.pi * geo.EARTH_RADIUS
+# candidate queries of the growing radius at most, the query budget allows them to repeat
+NEAREST_MAX_STEPS = 1 + math.ceil(math.log(NEAREST_MAX_RADIUS / NEAREST_START_RADIUS, NEAREST_GROWTH))
+# upper bound of query points in one /nearby/batch request
+NEARBY_BATCH_MAX_POINTS = 1000
+# latency budget of one autocomplete lookup in milliseconds
+AUTOCOMPLETE_BUDGET_MS = 50
+# upper bound of organizations in one batch create/update request
+BATCH_MAX_ITEMS = 1000
+# cells per tile side at most, as a power of two
+TILE_MAX_RESOLUTION = 8
+# basic international (E.164) phone number format
+PHONE_RE = re.compile(r'^\+?[1-9]\d{1,14}$')
+
+def within_boxes(boxes: list[tuple[float, float, float, float]]):
+    # sql condition: building inside any of the (min_lat, max_lat, min_lon, max_lon) boxes
+    return or_(*[
+        and_(
+            models.Building.latitude.between(min_lat, max_lat),
+            models.Building.longitude.between(min_lon, max_lon)
+        ) for min_lat, max_lat, min_lon, max_lon in boxes
+    ])
+
 ## organizations end-points
 
 @router.get("/", response_model = list[schemas.Organization])
+@budget(3)
 def get_organizations(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(security.get_api_key)
 ):
     try:
-        # eager load relationships with pagination
-        organizations = (
-            db.query(models.Organization)
-            .options(
-                joinedload(models.Organization.phone_numbers),
-                joinedload(models.Organization.activities)
-            )
-            .offset(skip)
-            .limit(limit)
-            .all()
+        # one flat row per organization with its phones and activities, paged by id
+        organizations = pagination.keyset(
+            read_model.organizations_query(db),
+            [models.Organization.id], lambda org: [org.id],
+            response, cursor = cursor, skip = skip, limit = limit
         )
         if not organizations:
             raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = "No organizations found")
-        # convert each organization to response model
-        result = []
-        for org in organizations:
-            org_response = schemas.Organization(
-                id = org.id,
-                name = org.name,
-                building_id = org.building_id,
-                activity_ids = [a.id for a in org.activities],
-                phone_numbers = [p.number for p in org.phone_numbers],
+        #
+        return responses.fast(read_model.to_rows(db, organizations), response)
+    except Exception as e:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+@router.get("/export", response_class = StreamingResponse)
+def export_organizations(
+    format: str = Query("ndjson", pattern = "^(ndjson|csv)$", description = "ndjson or csv"),
+    api_key: str = Depends(security.get_api_key)
+):
+    """
+    Stream the whole organization directory with building coordinates, phone numbers and activity ids.
+    Rows come from a server-side cursor, so memory stays flat regardless of the number of organizations.
+    """
+    if format == "csv":
+        return StreamingResponse(
+            export.csv_lines(),
+            media_type = "text/csv",
+            headers = {"Content-Disposition": "attachment; filename=organizations.csv"}
+        )
+    return StreamingResponse(export.ndjson_lines(), media_type = "application/x-ndjson")
+
+def validate_batch(
+    db: Session,
+    building_ids: set,
+    activity_ids: set,
+    numbers: list[str],
+    replaced_org_ids: set = frozenset()
+):
+    # one query per referenced table for a whole batch of organizations
+    if building_ids:
+        found = set(db.execute(select(models.Building.id).where(models.Building.id.in_(building_ids))).scalars())
+        if building_ids - found:
+            raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"buildings {sorted(building_ids - found)} not found")
+    if activity_ids:
+        found = set(db.execute(select(models.Activity.id).where(models.Activity.id.in_(activity_ids))).scalars())
+        if activity_ids - found:
+            raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"activities {sorted(activity_ids - found)} not found")
+    invalid = [number for number in numbers if not PHONE_RE.match(number)]
+    if invalid:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"phone numbers {invalid} must be in E.164 format (e.g., +1234567890)")
+    # compared in the form of the normalized unique index, with or without the leading +
+    normalized = {models.normalize_number(number) for number in numbers}
+    if len(normalized) != len(numbers):
+        raise HTTPException(status_code = status.HTTP_409_CONFLICT, detail = "phone numbers are repeated in the batch")
+    if numbers:
+        # numbers of organizations whose phones are replaced by this batch are free to reuse
+        taken = db.execute(
+            select(models.PhoneNumber.number)
+            .where(models.normalized_number.in_(normalized), models.PhoneNumber.organization_id.not_in(replaced_org_ids))
+        ).scalars().all()
+        if taken:
+            raise HTTPException(status_code = status.HTTP_409_CONFLICT, detail = f"phone numbers {sorted(taken)} already exist in the database")
+
+def insert_relations(db: Session, org_ids: list[int], items: list):
+    # set-based inserts of the phones and activity links of the items, None means "leave as is"
+    phones, links = [], []
+    for org_id, item in zip(org_ids, items):
+        if item.phone_numbers is not None:
+            phones.extend({"number": phone.number, "organization_id": org_id} for phone in item.phone_numbers)
+        if item.activity_ids is not None:
+            links.extend({"organization_id": org_id, "activity_id": activity_id} for activity_id in dict.fromkeys(item.activity_ids))
+    if phones:
+        db.execute(insert(models.PhoneNumber), phones)
+    if links:
+        db.execute(insert(models.organization_activity), links)
+
+@router.post("/batch", response_model = schemas.OrganizationBatchResult, status_code = status.HTTP_201_CREATED)
+@budget(BATCH_MAX_ITEMS + 5, repeated = BATCH_MAX_ITEMS + 1)
+def create_organizations_batch(
+    organizations: list[schemas.OrganizationCreate],
+    db: Session = Depends(get_db),
+    api_key: str = Depends(security.get_api_key)
+):
+    """
+    Create many organizations with their phones and activities in one transaction.
+    Returns the new ids in input order.
+    """
+    if len(organizations) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"at most {BATCH_MAX_ITEMS} organizations per request")
+    for i, organization in enumerate(organizations):
+        if not organization.name or organization.building_id is None:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"organization {i}: name and building_id are required")
+    validate_batch(
+        db,
+        building_ids = {o.building_id for o in organizations},
+        activity_ids = {a for o in organizations for a in o.activity_ids or []},
+        numbers = [p.number for o in organizations for p in o.phone_numbers or []]
+    )
+    if not organizations:
+        return schemas.OrganizationBatchResult(ids = [])
+    try:
+        # ids in input order: one INSERT .. RETURNING per row on SQLite, batched on PostgreSQL, hence the repeated budget
+        org_ids = db.execute(
+            insert(models.Organization).returning(models.Organization.id, sort_by_parameter_order = True),
+            [{"name": o.name, "building_id": o.building_id} for o in organizations]
+        ).scalars().all()
+        insert_relations(db, org_ids, organizations)
+        db.commit()
+        for org_id, organization in zip(org_ids, organizations):
+            name_index.add(org_id, organization.name)
+            tile_index.add_organization(organization.building_id, organization.activity_ids or ())
+        #
+        return schemas.OrganizationBatchResult(ids = org_ids)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+@router.put("/batch", response_model = schemas.OrganizationBatchResult)
+@budget(12)
+def update_organizations_batch(
+    organizations: list[schemas.OrganizationBatchUpdate],
+    db: Session = Depends(get_db),
+    api_key: str = Depends(security.get_api_key)
+):
+    """
+    Update many organizations in one transaction.
+    Given phone_numbers / activity_ids replace the current ones, omitted fields are left unchanged.
+    """
+    if len(organizations) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"at most {BATCH_MAX_ITEMS} organizations per request")
+    org_ids = [o.id for o in organizations]
+    if len(set(org_ids)) != len(org_ids):
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "organization ids are repeated in the batch")
+    found = set(db.execute(select(models.Organization.id).where(models.Organization.id.in_(org_ids))).scalars())
+    if set(org_ids) - found:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"organizations {sorted(set(org_ids) - found)} not found")
+    phones_replaced = {o.id for o in organizations if o.phone_numbers is not None}
+    validate_batch(
+        db,
+        building_ids = {o.building_id for o in organizations if o.building_id is not None},
+        activity_ids = {a for o in organizations for a in o.activity_ids or []},
+        numbers = [p.number for o in organizations for p in o.phone_numbers or []],
+        replaced_org_ids = phones_replaced
+    )
+    try:
+        # plain columns, one executemany per set of changed fields
+        changes = {}
+        for o in organizations:
+            values = {key: value for key, value in (("name", o.name), ("building_id", o.building_id)) if value is not None}
+            if values:
+                changes.setdefault(tuple(values), []).append({"id": o.id, **values})
+        for rows in changes.values():
+            db.execute(update(models.Organization), rows)
+        # replaced relations
+        if phones_replaced:
+            db.execute(delete(models.PhoneNumber).where(models.PhoneNumber.organization_id.in_(phones_replaced)))
+        activities_replaced = {o.id for o in organizations if o.activity_ids is not None}
+        if activities_replaced:
+            db.execute(delete(models.organization_activity).where(models.organization_activity.c.organization_id.in_(activities_replaced)))
+        insert_relations(db, org_ids, organizations)
+        versions.bump_rows(db, models.Organization, org_ids)
+        db.commit()
+        for o in organizations:
+            if o.name is not None:
+                name_index.add(o.id, o.name)
+        # the previous buildings and activities are not read, the tile aggregates are rebuilt on the next tile request
+        if any(o.building_id is not None or o.activity_ids is not None for o in organizations):
+            tile_index.invalidate()
+        cache.invalidate("organization", *org_ids)
+        #
+        return schemas.OrganizationBatchResult(ids = org_ids)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+@router.get("/search", response_model = list[schemas.Organization])
+@budget(11)
+def search_organizations(
+    response: Response,
+    lat: float = Query(None, ge = -90, le = 90, description = "Latitude of the radius center"),
+    lon: float = Query(None, ge = -180, le = 180, description = "Longitude of the radius center"),
+    radius: float = Query(None, gt = 0, description = "Radius in meters"),
+    min_lat: float = Query(None, ge = -90, le = 90, description = "Rectangle: minimum latitude"),
+    min_lon: float = Query(None, ge = -180, le = 180, description = "Rectangle: minimum longitude"),
+    max_lat: float = Query(None, ge = -90, le = 90, description = "Rectangle: maximum latitude"),
+    max_lon: float = Query(None, ge = -180, le = 180, description = "Rectangle: maximum longitude"),
+    activity_id: int = Query(None, description = "Activity, with its descendants unless include_descendants=false"),
+    include_descendants: bool = True,
+    name: str = Query(None, min_length = 1, max_length = 100, description = "Substring of the organization name"),
+    skip: int = 0,
+    limit: int = Query(100, ge = 1, le = 1000),
+    cursor: str = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Organizations matching every given filter: radius (lat, lon, radius) or rectangle, activity subtree, name substring.
+    The most selective filter drives the query, the plan is in the X-Search-Plan header.
+    Results are ordered by id, X-Total-Count has the number of matches, the next page is in the X-Next-Cursor header.
+    """
+    try:
+        radius_given = [v is not None for v in (lat, lon, radius)]
+        rectangle_given = [v is not None for v in (min_lat, min_lon, max_lat, max_lon)]
+        if any(radius_given) and not all(radius_given):
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "lat, lon and radius go together")
+        if any(rectangle_given) and not all(rectangle_given):
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "min_lat, min_lon, max_lat and max_lon go together")
+        if all(radius_given) and all(rectangle_given):
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "either a radius or a rectangle")
+        if all(rectangle_given) and (min_lat > max_lat or min_lon > max_lon):
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "min values must be <= max values")
+        filters = []
+        if all(radius_given) or all(rectangle_given):
+            geo_engine.ensure_loaded(db)
+            if all(radius_given):
+                building_ids, _ = geo_engine.within(lat, lon, radius)
+            else:
+                building_ids = geo_engine.within_box(min_lat, max_lat, min_lon, max_lon)
+            filters.append(search_plan.GeoFilter(building_ids.tolist()))
+        if activity_id is not None:
+            tree = activity_tree.get(db)
+            if activity_id not in tree:
+                raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"activity {activity_id} not found")
+            filters.append(search_plan.ActivityFilter(tree.subtree_ids(activity_id) if include_descendants else [activity_id]))
+        if name is not None:
+            filters.append(search_plan.name_filter(db, name))
+        if not filters:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "give at least one of radius, rectangle, activity_id or name")
+        result = search_plan.run(db, filters)
+        # keyset paging over the sorted ids
+        ids = result.ids
+        if cursor:
+            ids = ids[bisect.bisect_right(ids, pagination.decode_cursor(cursor, 1)[0]):]
+        elif skip:
+            ids = ids[skip:]
+        page = ids[:limit]
+        if len(ids) > limit:
+            pagination.set_next_cursor(response, [page[-1]])
+        response.headers[search_plan.TOTAL_HEADER] = str(len(result.ids))
+        response.headers[search_plan.PLAN_HEADER] = result.plan
+        organizations = read_model.by_ids(db, page)
+        #
+        return responses.fast([organizations[org_id] for org_id in page if org_id in organizations], response)
+    except Exception as e:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+@router.get("/tiles/{z}/{x}/{y}", response_model = schemas.Tile)
+@budget(5)
+def get_organization_tile(
+    z: int,
+    x: int,
+    y: int,
+    resolution: int = Query(3, ge = 0, le = TILE_MAX_RESOLUTION, description = "The tile is divided into 2^resolution x 2^resolution cells"),
+    activity_id: int = Query(None, description = "Only organizations of the activity and its descendants"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Organization counts and centroids per cell of a Web Mercator tile, for clustering maps at low zoom levels.
+    Answered from precomputed aggregates, the cost grows with the cells and not with the organizations.
+    """
+    try:
+        if z < 0 or not (0 <= x < 1 << z and 0 <= y < 1 << z):
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"tile {z}/{x}/{y} does not exist")
+        if z + resolution > tile_index.max_zoom:
+            raise HTTPException(
+                status_code = status.HTTP_400_BAD_REQUEST,
+                detail = f"cells are aggregated up to zoom {tile_index.max_zoom}, use /organizations/search/within-rectangle for deeper views"
             )
-            result.append(org_response)
+        if activity_id is not None and activity_id not in activity_tree.get(db):
+            raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"activity {activity_id} not found")
+        tile_index.ensure_loaded(db)
+        cells = tile_index.cells(z, x, y, resolution, activity_id or 0)
         #
-        return result
+        return responses.fast({"z": z, "x": x, "y": y, "cell_zoom": z + resolution, "cells": cells})
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.get("/{id}", response_model = schemas.Organization)
+@budget(4)
 def get_organizations(
     id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(security.get_api_key)
-):    
+):
+    # conditional GET answered from the version alone
+    version = versions.row_version(db, models.Organization, id)
+    if version is None:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"organization {id} not found")
+    tag = etag.make_etag("organization", id, version)
+    not_modified = etag.conditional(request, response, tag)
+    if not_modified is not None:
+        return not_modified
+    # serialized response of this version
+    body = cache.get_response("organization", id, version)
+    if body is not None:
+        return cache.json_response(body, tag)
     try:
-        # eager load relationships
-        db_organizations = (
-            db.query(models.Organization)
-            .options(
-                joinedload(models.Organization.phone_numbers),
-                joinedload(models.Organization.activities)
-            )
-            .filter(models.Organization.id == id)
-            .first()
-        )
-        if not db_organizations:
+        db_organization = read_model.by_ids(db, [id]).get(id)
+        if not db_organization:
             raise HTTPException(status_code = 404, detail = f"no one organizations was not found")
-        # convert to dict and add activity_ids
-        org_dict = {
-            **db_organizations.__dict__,
-            "activity_ids": [activity.id for activity in db_organizations.activities],
-            "phone_numbers": [phone_number.number for phone_number in db_organizations.phone_numbers]
-        }
-        #
-        return schemas.Organization(**org_dict)
+        body = orjson.dumps(db_organization)
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+    cache.put_response("organization", id, version, body)
+    #
+    return cache.json_response(body, tag)
 
 @router.post("/", response_model = schemas.Organization, status_code = status.HTTP_201_CREATED)
+@budget(3)
 def create_organization(
     organization: schemas.OrganizationBase,
     db: Session = Depends(get_db),
@@ -99,61 +389,50 @@ def create_organization(
         db.add(db_organization)
         db.commit()
         db.refresh(db_organization)
+        name_index.add(db_organization.id, db_organization.name)
+        tile_index.add_organization(db_organization.building_id)
         #
-        return db_organization
+        return {"id": db_organization.id, "name": db_organization.name, "building_id": db_organization.building_id, "phone_numbers": [], "activity_ids": []}
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.put("/{id}", response_model = schemas.Organization)
+@budget(9)
 def update_organization(
     id: int,
     organization: schemas.OrganizationBase,
     db: Session = Depends(get_db),
     api_key: str = Depends(security.get_api_key)
 ):
-    # get the organization with all relationships
-    db_organization = (
-        db.query(models.Organization)
-        .options(
-            joinedload(models.Organization.building),
-            joinedload(models.Organization.phone_numbers),
-            joinedload(models.Organization.activities)
-        )
-        .filter(models.Organization.id == id)
-        .first()
-    )
+    db_organization = db.query(models.Organization).filter(models.Organization.id == id).first()
     if not db_organization:
         raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"Organization {id} not found")
     # update basic fields if provided
     if organization.name is not None:
         db_organization.name = organization.name
+    moved_from = db_organization.building_id
     if organization.building_id is not None:
         # verify building exists
         building = db.query(models.Building).get(organization.building_id)
         if not building:
             raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"Building {organization.building_id} not found")
         db_organization.building_id = organization.building_id
+    versions.bump_rows(db, models.Organization, [id])
+    moved = moved_from != db_organization.building_id
+    activity_ids = [a.id for a in db_organization.activities] if moved else []
     #
     db.commit()
     db.refresh(db_organization)
+    name_index.add(db_organization.id, db_organization.name)
+    if moved:
+        tile_index.remove_organization(moved_from, activity_ids)
+        tile_index.add_organization(db_organization.building_id, activity_ids)
+    cache.invalidate("organization", id)
     #
-    result = schemas.Organization(
-        id              = db_organization.id,
-        name            = db_organization.name,
-        building_id     = db_organization.building_id,
-        phone_numbers   = [
-            schemas.PhoneNumberResponse(
-                id              = phone.id,
-                number          = phone.number,
-                organization_id = phone.organization_id
-            ) for phone in db_organization.phone_numbers
-        ],
-        activity_ids    = [a.id for a in db_organization.activities]
-    )
-    #
-    return result
+    return read_model.by_ids(db, [id])[id]
 
 @router.delete("/{id}", status_code = status.HTTP_204_NO_CONTENT)
+@budget(6)
 def delete_organization(
     id: int,
     db: Session = Depends(get_db),
@@ -163,14 +442,19 @@ def delete_organization(
         db_organizations = db.query(models.Organization).filter(models.Organization.id == id).first()
         if not db_organizations:
             raise HTTPException(status_code = Status.HTTP_404_NOT_FOUND, detail = f"activity with ID {id} not found")
+        building_id, activity_ids = db_organizations.building_id, [a.id for a in db_organizations.activities]
         db.delete(db_organizations)
         db.commit()
+        name_index.remove(id)
+        tile_index.remove_organization(building_id, activity_ids)
+        cache.invalidate("organization", id)
         #
         return None
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.post("/{organization_id}/phones/", response_model = schemas.PhoneNumberResponse)
+@budget(5)
 def add_phone_to_organization(
     organization_id: int,
     phone: schemas.PhoneNumberCreate,
@@ -178,14 +462,14 @@ def add_phone_to_organization(
     api_key: str = Depends(security.get_api_key)
 ):
     # validate phone number format (basic international format)
-    if not re.match(r'^\+?[1-9]\d{1,14}$', phone.number):
+    if not PHONE_RE.match(phone.number):
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST,detail = "phone number must be in E.164 format (e.g., +1234567890)")
     # check if organization exists
     db_org = db.query(models.Organization).get(organization_id)
     if not db_org:
         raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail=f"organization {organization_id} not found")
-    # check if phone number already exists for this organization
-    db_phone_number = db.query(models.PhoneNumber).filter(models.PhoneNumber.number == phone.number).first()
+    # check if phone number already exists, with or without the leading +, on the normalized unique index
+    db_phone_number = db.query(models.PhoneNumber).filter(models.normalized_number == models.normalize_number(phone.number)).first()
     if db_phone_number:
         raise HTTPException(status_code = status.HTTP_409_CONFLICT, detail = f"phone number {phone.number} already exists in the database")
     # create and save new phone number
@@ -195,15 +479,22 @@ def add_phone_to_organization(
     )
     try:
         db.add(db_phone)
+        versions.bump_rows(db, models.Organization, [organization_id])
         db.commit()
         db.refresh(db_phone)
+        cache.invalidate("organization", organization_id)
         #
         return db_phone
+    except IntegrityError:
+        # the same number written with or without the leading +, caught by the normalized unique index
+        db.rollback()
+        raise HTTPException(status_code = status.HTTP_409_CONFLICT, detail = f"phone number {phone.number} already exists in the database")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code = status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error saving phone number: {str(e)}")
 
 @router.delete("/phones/")
+@budget(4)
 def remove_phone_from_organization(
     phone: schemas.PhoneNumberDelete,
     db: Session = Depends(get_db),
@@ -214,8 +505,8 @@ def remove_phone_from_organization(
         raise HTTPException(status_code = 404, detail = f"phone number or organization_id not entered")
     # looking for the phone number existence
     db_phone_number = None
-    if phone.number:
-        db_phone_number = db.query(models.PhoneNumber).filter(models.PhoneNumber.number == phone.number).first()
+    if phone.number and models.normalize_number(phone.number) is not None:
+        db_phone_number = db.query(models.PhoneNumber).filter(models.normalized_number == models.normalize_number(phone.number)).first()
     if phone.organization_id:
         db_phone_number = db.query(models.PhoneNumber).filter(models.PhoneNumber.organization_id == phone.organization_id).first()
     if not db_phone_number:
@@ -223,7 +514,9 @@ def remove_phone_from_organization(
     # deleting the phone number from the database
     try:
         db.delete(db_phone_number)
+        versions.bump_rows(db, models.Organization, [db_phone_number.organization_id])
         db.commit()
+        cache.invalidate("organization", db_phone_number.organization_id)
         #
         return {"message": f"Phone number {db_phone_number.number} was deleted"}
     except Exception as e:
@@ -231,6 +524,7 @@ def remove_phone_from_organization(
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.post("/{organization_id}/activities/{activity_id}")
+@budget(5)
 def add_activity_to_organization(
     organization_id: int,
     activity_id: int,
@@ -250,8 +544,13 @@ def add_activity_to_organization(
     # add the activity in to the organization
     try:
         if db_activity not in db_organization.activities:
+            linked = [a.id for a in db_organization.activities]
+            building_id = db_organization.building_id
             db_organization.activities.append(db_activity)
+            versions.bump_rows(db, models.Organization, [organization_id])
             db.commit()
+            tile_index.relink_organization(building_id, linked, linked + [activity_id])
+            cache.invalidate("organization", organization_id)
         #
         return {"message": f"activity {activity_id} added to organization {organization_id}"}
     except Exception as e:
@@ -259,6 +558,7 @@ def add_activity_to_organization(
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.delete("/{organization_id}/activities/{activity_id}")
+@budget(5)
 def remove_activity(
     organization_id: int,
     activity_id: int,
@@ -275,8 +575,13 @@ def remove_activity(
     # delete the activity from the organization
     try:
         if db_activity in db_organization.activities:
+            linked = [a.id for a in db_organization.activities]
+            building_id = db_organization.building_id
             db_organization.activities.remove(db_activity)
+            versions.bump_rows(db, models.Organization, [organization_id])
             db.commit()
+            tile_index.relink_organization(building_id, linked, [a for a in linked if a != activity_id])
+            cache.invalidate("organization", organization_id)
             #
             return {"message": f"activity {activity_id} removed from organization {organization_id}"}
         else:
@@ -289,41 +594,38 @@ def remove_activity(
 ## --- Special Endpoints --- ##
 
 @router.get("/by-building/{id}", response_model = list[schemas.Organization])
-def get_organizations_by_building_id(id: int, db: Session = Depends(get_db)):
+@budget(4)
+def get_organizations_by_building_id(id: int, db: Session = Depends(get_read_db)):
     # get organizations in a specific building
     try:
         db_building = db.query(models.Building).filter(models.Building.id == id).first()
         if not db_building:
             raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"building {id} not found")
-        db_organizations = db.query(models.Organization).filter(models.Organization.building_id == id).all()
-        if db_organizations is None:
-            raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"organization {id} not found")
+        db_organizations = read_model.organizations_query(db).filter(models.Organization.building_id == id).all()
         #
-        return db_organizations
+        return responses.fast(read_model.to_rows(db, db_organizations))
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.get("/by-activity/{id}", response_model = list[schemas.Organization])
-def get_organizations_by_activity_id(id: int, db: Session = Depends(get_db)):
+@budget(4)
+def get_organizations_by_activity_id(id: int, db: Session = Depends(get_read_db)):
     try:
         db_activity = db.query(models.Activity).filter(models.Activity.id == id).first()
         if not db_activity:
             raise HTTPException(status_code = 404, detail = f"activity {id} not found")
-        db_organizations = (db.query(models.Organization)
-            .join(models.Organization.activities)
-            .filter(models.Activity.id == id)
-            .all())
-        if db_organizations is None:
-            raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"no organizations found containing activity {id}")
+        linked = select(models.organization_activity.c.organization_id).where(models.organization_activity.c.activity_id == id)
+        db_organizations = read_model.organizations_query(db).filter(models.Organization.id.in_(linked)).all()
         #
-        return db_organizations
+        return responses.fast(read_model.to_rows(db, db_organizations))
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.get("/by-activity-tree/{activity_id}", response_model = list[schemas.Organization])
+@budget(5)
 def get_organizations_by_activity_tree(
     activity_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get all organizations related to an activity and its children (up to 3 levels deep).
@@ -332,41 +634,31 @@ def get_organizations_by_activity_tree(
     - Meat products
     - Dairy products
     - etc. (up to 3 levels deep)
+    The subtree comes from the in-memory activity tree, so only the organizations are queried.
     """
-    def get_child_activity_ids(parent_id: int, current_level: int = 1) -> list[int]:
-        if current_level > 3:  # limit to 3 levels of nesting
-            return []
-        child_activities = db.query(models.Activity).filter(models.Activity.parent_id == parent_id).all()
-        child_ids = [a.id for a in child_activities]        
-        for child_id in child_ids:
-            child_ids.extend(get_child_activity_ids(child_id, current_level + 1))
-        return child_ids
     try:
-        # check if main activity exists
-        main_activity = db.query(models.Activity).filter(models.Activity.id == activity_id).first()
-        if not main_activity:
+        # check if main activity exists, its subtree comes from the in-memory activity tree
+        tree = activity_tree.get(db)
+        if activity_id not in tree:
             raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = "activity not found")
-        # get all relevant activity IDs (main + children up to 3 levels)
-        all_activity_ids = [activity_id] + get_child_activity_ids(activity_id)
-        # get organizations for all these activities
-        organizations = (
-            db.query(models.Organization)
-            .join(models.Organization.activities) # use the relationship property
-            .filter(models.Activity.id.in_(all_activity_ids)) # filter by activity IDs
-            .distinct()
-            .all()
+        # organizations linked to the activity or any of its descendants
+        linked = (
+            select(models.organization_activity.c.organization_id)
+            .where(models.organization_activity.c.activity_id.in_(tree.subtree_ids(activity_id)))
         )
+        organizations = read_model.organizations_query(db).filter(models.Organization.id.in_(linked)).all()
         #
-        return organizations
+        return responses.fast(read_model.to_rows(db, organizations))
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.get("/nearby/", response_model = list[schemas.Organization])
+@budget(4)
 def get_organizations_nearby(
     lat: float = Query(..., example = 40.5, description = "Latitude of center point"),
     lon: float = Query(..., example = 74.0, description = "Longitude of center point"),
     radius: float = Query(..., example = 500.0, description = "Radius in meters"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     try:
         # input validation
@@ -374,42 +666,112 @@ def get_organizations_nearby(
             raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "radius must be positive")
         if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
             raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "Invalid coordinates")
-        # haversine distance calculation
-        def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-            R = 6371000  # earth radius in meters
-            phi1, phi2 = math.radians(lat1), math.radians(lat2)
-            delta_phi = math.radians(lat2 - lat1)
-            delta_lambda = math.radians(lon2 - lon1)
-            a = (math.sin(delta_phi/2)**2 + 
-                math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda/2)**2)
-            return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        # get all organizations with related data
+        # buildings inside the radius from the in-process geo engine, then their organizations only
+        geo_engine.ensure_loaded(db)
+        building_ids, _ = geo_engine.within(lat, lon, radius)
         organizations = (
-            db.query(models.Organization)
-            .join(models.Building)
-            .options(
-                joinedload(models.Organization.building),
-                joinedload(models.Organization.activities)
-            )
+            read_model.organizations_query(db)
+            .filter(models.Organization.building_id.in_(building_ids.tolist()))
             .all()
         )
-        # filter organizations within radius
-        nearby_orgs = [
-            org for org in organizations
-            if calculate_distance(lat, lon, org.building.latitude, org.building.longitude) <= radius
-        ]
         #
-        return nearby_orgs
+        return responses.fast(read_model.to_rows(db, organizations))
+    except Exception as e:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+@router.post("/nearby/batch", response_model = list[schemas.NearbyBatchResult])
+@budget(4)
+def get_organizations_nearby_batch(
+    points: list[schemas.NearbyQuery],
+    db: Session = Depends(get_read_db)
+):
+    """
+    Resolve many (lat, lon, radius) queries in one request.
+    Distances for every point are computed in the geo engine, organizations of all matched buildings are loaded with one query.
+    """
+    try:
+        if len(points) > NEARBY_BATCH_MAX_POINTS:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"at most {NEARBY_BATCH_MAX_POINTS} points per request")
+        geo_engine.ensure_loaded(db)
+        matches = geo_engine.within_many([(p.lat, p.lon, p.radius) for p in points])
+        # one query for the organizations of every matched building
+        building_ids = set()
+        for ids, _ in matches:
+            building_ids.update(ids.tolist())
+        organizations_by_building = {}
+        if building_ids:
+            for org in read_model.to_rows(db, (
+                read_model.organizations_query(db)
+                .filter(models.Organization.building_id.in_(building_ids))
+                .all()
+            )):
+                organizations_by_building.setdefault(org.building_id, []).append(org)
+        # results per point, closest first
+        result = []
+        for point, (ids, distances) in zip(points, matches):
+            order = distances.argsort(kind = "stable")
+            organizations = [
+                org.with_distance(distance)
+                for building_id, distance in zip(ids[order].tolist(), distances[order].tolist())
+                for org in organizations_by_building.get(building_id, [])
+            ]
+            result.append({**point.dict(), "organizations": organizations})
+        #
+        return responses.fast(result)
+    except Exception as e:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+@router.get("/nearest/", response_model = list[schemas.OrganizationWithDistance])
+@budget(NEAREST_MAX_STEPS + 3, repeated = NEAREST_MAX_STEPS + 1)
+def get_organizations_nearest(
+    lat: float = Query(..., example = 40.5, description = "Latitude of center point"),
+    lon: float = Query(..., example = 74.0, description = "Longitude of center point"),
+    k: int = Query(20, ge = 1, le = 1000, description = "Number of closest organizations to return"),
+    max_distance: float = Query(None, gt = 0, description = "Optional search limit in meters"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get the k organizations closest to the point, sorted by distance.
+    The search radius starts small and grows until k organizations are found inside it,
+    so only the buildings around the point are ever read.
+    """
+    try:
+        if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "Invalid coordinates")
+        limit = min(max_distance or NEAREST_MAX_RADIUS, NEAREST_MAX_RADIUS)
+        radius = min(NEAREST_START_RADIUS, limit)
+        while True:
+            candidates = (
+                db.query(models.Organization.id, models.Building.latitude, models.Building.longitude)
+                .join(models.Building)
+                .filter(within_boxes(geo.bounding_boxes(lat, lon, radius)))
+                .all()
+            )
+            # bounded heap of the k closest candidates inside the current radius
+            nearest = heapq.nsmallest(k, (
+                (distance, org_id) for org_id, distance in (
+                    (org_id, geo.haversine(lat, lon, org_lat, org_lon)) for org_id, org_lat, org_lon in candidates
+                ) if distance <= radius
+            ))
+            # the circle of this radius is fully covered, so nothing outside can be closer
+            if len(nearest) >= k or radius >= limit:
+                break
+            radius = min(radius * NEAREST_GROWTH, limit)
+        # load the full data for the selected organizations only
+        organizations = read_model.by_ids(db, [org_id for _, org_id in nearest])
+        #
+        return responses.fast([organizations[org_id].with_distance(distance) for distance, org_id in nearest if org_id in organizations])
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.get("/search/within-rectangle", response_model = list[schemas.Organization])
+@budget(3)
 def get_organizations_in_rectangle(
     min_lat: float = Query(..., example = 40.7128, description = "Minimum latitude"),
     min_lon: float = Query(..., example = -74.0060, description = "Minimum longitude"), 
     max_lat: float = Query(..., example = 40.8138, description = "Maximum latitude"),
     max_lon: float = Query(..., example = -73.9060, description = "Maximum longitude"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     try:
         # coordinate validation
@@ -421,44 +783,101 @@ def get_organizations_in_rectangle(
             raise HTTPException(400, "min values must be <= max values")
         # query with explicit joins
         result = (
-            db.query(models.Organization)
+            read_model.organizations_query(db)
             .join(models.Building)
             .filter(
                 models.Building.latitude.between(min_lat, max_lat),
                 models.Building.longitude.between(min_lon, max_lon)
             )
-            .options(
-                joinedload(models.Organization.building),
-                joinedload(models.Organization.activities)
-            )
             .all()
         )
         #
-        return result
+        return responses.fast(read_model.to_rows(db, result))
     except Exception as e:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
 
 @router.get("/search/by-name", response_model = list[schemas.Organization])
+@budget(4)
 def search_organizations_by_name(
+    response: Response,
     name_query: str = Query(..., min_length = 1, max_length = 100, description = "search string for organization name"),
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: str = None,
+    db: Session = Depends(get_read_db)
 ):
+    """
+    Substring search over organization names, most similar names first.
+    PostgreSQL uses the pg_trgm GIN index, other databases the in-process n-gram index.
+    Pages are keyed by (similarity, name, id), the next one is in the X-Next-Cursor header.
+    """
     try:
-        organizations = (
-            db.query(models.Organization)
-            .filter(models.Organization.name.ilike(f"%{name_query}%"))
-            .order_by(models.Organization.name)
-            .offset(skip)
-            .limit(limit)
-            .options(
-                joinedload(models.Organization.building),
-                joinedload(models.Organization.activities)
+        last = pagination.decode_cursor(cursor, 3) if cursor else None
+        if db.bind.dialect.name == "postgresql":
+            similarity = func.similarity(models.Organization.name, name_query)
+            query = (
+                read_model.organizations_query(db, similarity.label("similarity"))
+                .filter(models.Organization.name.ilike(search.like_pattern(name_query), escape = "\\"))
+                .order_by(similarity.desc(), models.Organization.name, models.Organization.id)
             )
-            .all()
-        )
+            if last:
+                query = query.filter(or_(
+                    similarity < last[0],
+                    and_(similarity == last[0], tuple_(models.Organization.name, models.Organization.id) > tuple_(last[1], last[2]))
+                ))
+            elif skip:
+                query = query.offset(skip)
+            rows = query.limit(limit + 1).all()
+            ranked = [(row.similarity, row.name, row.id) for row in rows]
+            found = {org.id: org for org in read_model.to_rows(db, rows)}
+        else:
+            name_index.ensure_loaded(db)
+            ranked = name_index.search(name_query)
+            if last:
+                last_key = (-last[0], last[1], last[2])
+                ranked = [m for m in ranked if (-m[0], m[1], m[2]) > last_key]
+            elif skip:
+                ranked = ranked[skip:]
+            ranked = ranked[:limit + 1]
+            found = read_model.by_ids(db, [org_id for _, _, org_id in ranked])
+        if len(ranked) > limit:
+            ranked = ranked[:limit]
+            pagination.set_next_cursor(response, ranked[-1])
+        #
+        return responses.fast([found[org_id] for _, _, org_id in ranked if org_id in found], response)
+    except Exception as e:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+@router.get("/search/autocomplete", response_model = list[schemas.OrganizationSuggestion])
+@budget(2)
+def autocomplete_organizations(
+    prefix: str = Query(..., min_length = 1, max_length = 100, description = "beginning of the organization name"),
+    limit: int = Query(10, ge = 1, le = 50),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Organization names starting with prefix, for search-as-you-type.
+    The lookup is cut off after AUTOCOMPLETE_BUDGET_MS, returning what was found so far (possibly nothing).
+    """
+    try:
+        if db.bind.dialect.name == "postgresql":
+            try:
+                db.execute(text(f"SET LOCAL statement_timeout = {int(AUTOCOMPLETE_BUDGET_MS)}"))
+                rows = (
+                    db.query(models.Organization.id, models.Organization.name)
+                    .filter(models.Organization.name.ilike(search.like_pattern(prefix, prefix = True), escape = "\\"))
+                    .order_by(models.Organization.name, models.Organization.id)
+                    .limit(limit)
+                    .all()
+                )
+            except OperationalError:
+                # statement_timeout hit, the budget is spent
+                rows = []
+            db.rollback()
+        else:
+            name_index.ensure_loaded(db)
+            rows = name_index.prefix(prefix, limit, deadline = time.monotonic() + AUTOCOMPLETE_BUDGET_MS / 1000)
         #
-        return organizations
+        return [schemas.OrganizationSuggestion(id = org_id, name = name) for org_id, name in rows]
     except Exception as e:
-            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
\ No newline at end of file
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
@@ -1,9 +1,11 @@
 from cairo import Status
-from fastapi import APIRouter, HTTPException, status
-from fastapi import Depends, HTTPException
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi import Depends, HTTPException, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app import security
-from app.db.session import get_db
+from app import pagination, responses, security
+from app.query_budget import budget
+from app.db.session import get_db, get_read_db
 from app.db import models, schemas
 
 router = APIRouter(
@@ -11,19 +13,81 @@ router = APIRouter(
     tags = ["Phones"]
 )
 
+# upper bound of numbers in one POST /phones/lookup request
+LOOKUP_MAX_NUMBERS = 10000
+
+def lookup(db: Session, numbers: list[str]) -> list[dict]:
+    # all numbers in one query on the normalized unique index, results in input order
+    normalized = [models.normalize_number(number) for number in numbers]
+    keys = {n for n in normalized if n is not None}
+    found = {}
+    if keys:
+        rows = db.execute(
+            select(models.normalized_number, models.Organization.id, models.Organization.name)
+            .join(models.Organization, models.Organization.id == models.PhoneNumber.organization_id)
+            .where(models.normalized_number.in_(keys))
+        ).all()
+        found = {key: (org_id, name) for key, org_id, name in rows}
+    results = []
+    for number, key in zip(numbers, normalized):
+        org_id, name = found.get(key, (None, None))
+        results.append({"number": number, "organization_id": org_id, "organization_name": name})
+    #
+    return results
+
 ## phones
 
 @router.get("/", response_model = list[schemas.PhoneNumberResponse])
+@budget(1)
 def get_phones_numbers(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(security.get_api_key)
 ):
     try:
-        phones_numbers = db.query(models.PhoneNumber).offset(skip).limit(limit).all()
+        phones_numbers = pagination.keyset(
+            db.query(models.PhoneNumber), [models.PhoneNumber.id], lambda p: [p.id],
+            response, cursor = cursor, skip = skip, limit = limit
+        )
         if not phones_numbers:
             raise HTTPException(status_code = 404, detail = f"no one phones numbers was not found")
         return phones_numbers
     except Exception as e:
-        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
\ No newline at end of file
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+@router.get("/lookup", response_model = schemas.PhoneLookupResult)
+@budget(1)
+def lookup_phone(
+    number: str = Query(..., min_length = 1, max_length = 32, example = "+74951234567", description = "Phone number, with or without + and formatting"),
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(security.get_api_key)
+):
+    """
+    The organization of a phone number, for routing an incoming call.
+    """
+    if models.normalize_number(number) is None:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"phone number {number} is not in E.164 format (e.g., +1234567890)")
+    result = lookup(db, [number])[0]
+    if result["organization_id"] is None:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"phone number {number} not found")
+    #
+    return result
+
+@router.post("/lookup", response_model = list[schemas.PhoneLookupResult])
+@budget(1)
+def lookup_phones(
+    numbers: list[str],
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(security.get_api_key)
+):
+    """
+    Organizations of many phone numbers in one indexed query, in input order.
+    Unknown and malformed numbers resolve to a null organization_id.
+    """
+    if len(numbers) > LOOKUP_MAX_NUMBERS:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"at most {LOOKUP_MAX_NUMBERS} numbers per request")
+    #
+    return responses.fast(lookup(db, numbers))
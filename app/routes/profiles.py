@@ -0,0 +1,39 @@
+import json
+import os
+from fastapi import APIRouter, HTTPException, Path, status
+from fastapi import Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from app import profiling, security
+
+# included by app.main only with PROFILING_ENABLED
+router = APIRouter(
+    prefix = "/profiles",
+    tags = ["Profiling"]
+)
+
+# profile ids are uuid4 hex, nothing else may reach the file path
+PROFILE_ID = Path(..., pattern = "^[0-9a-f]{32}$")
+
+## profiles of the X-Profile: 1 requests
+
+@router.get("/{profile_id}")
+def get_profile(profile_id: str = PROFILE_ID, api_key: str = Depends(security.get_api_key)):
+    """
+    Breakdown of a profiled request: wall time, exact SQL statements and time, sampled time per category.
+    """
+    path = profiling.profile_path(profile_id, "json")
+    if not os.path.exists(path):
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"profile {profile_id} not found")
+    with open(path, encoding = "utf-8") as f:
+        return json.load(f)
+
+@router.get("/{profile_id}/folded", response_class = PlainTextResponse)
+def get_profile_stacks(profile_id: str = PROFILE_ID, api_key: str = Depends(security.get_api_key)):
+    """
+    Sampled stacks in the folded format of flamegraph.pl, also opened by speedscope.
+    """
+    path = profiling.profile_path(profile_id, "folded")
+    if not os.path.exists(path):
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"profile {profile_id} not found")
+    with open(path, encoding = "utf-8") as f:
+        return f.read()
@@ -0,0 +1,141 @@
+import bisect
+import time
+from sqlalchemy.orm import Session
+from app.db import models
+from app.snapshot import Snapshot
+
+# seconds before the in-process index is reloaded, picks up organizations written by other workers
+RELOAD_INTERVAL = 60.0
+
+def like_pattern(value: str, prefix: bool = False) -> str:
+    # escape the LIKE wildcards of user input, use with escape = "\\"
+    value = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{value}%" if prefix else f"%{value}%"
+
+def trigrams(value: str) -> set[str]:
+    # all 3-character substrings of the lowercased value
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+def word_trigrams(value: str) -> set[str]:
+    # trigrams of every padded word, the same way pg_trgm computes them for similarity()
+    result = set()
+    for word in value.lower().split():
+        word = f"  {word} "
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+def similarity(a: str, b: str) -> float:
+    # shared / total trigrams, mirrors pg_trgm similarity()
+    ta, tb = word_trigrams(a), word_trigrams(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+class NgramIndex(Snapshot):
+    """
+    In-process trigram inverted index over organization names, the substring search backend without pg_trgm (SQLite, tests).
+    A query only verifies the organizations that contain every trigram of the search string.
+    """
+
+    def __init__(self):
+        super().__init__(RELOAD_INTERVAL)
+        self._names = {}
+        self._postings = {}
+        # sorted (lowercased name, id) pairs for prefix lookups
+        self._sorted = []
+
+    def load(self, db: Session):
+        rows = db.query(models.Organization.id, models.Organization.name).all()
+        # built aside, the current index keeps answering until the swap
+        fresh = NgramIndex()
+        for org_id, name in rows:
+            fresh._add(org_id, name)
+        fresh._sorted.sort()
+        with self._lock:
+            self._names, self._postings, self._sorted = fresh._names, fresh._postings, fresh._sorted
+            self._swapped()
+
+    def add(self, org_id: int, name: str):
+        if self._loaded_at is None and not self._loading():
+            return
+        with self._lock:
+            self._record(self._put, org_id, name)
+            self._put(org_id, name)
+
+    def remove(self, org_id: int):
+        if self._loaded_at is None and not self._loading():
+            return
+        with self._lock:
+            self._record(self._remove, org_id)
+            self._remove(org_id)
+
+    def _put(self, org_id: int, name: str):
+        self._remove(org_id)
+        self._add(org_id, name, keep_sorted = True)
+
+    def _add(self, org_id: int, name: str, keep_sorted: bool = False):
+        self._names[org_id] = name
+        for gram in trigrams(name):
+            self._postings.setdefault(gram, set()).add(org_id)
+        if keep_sorted:
+            bisect.insort(self._sorted, (name.lower(), org_id))
+        else:
+            self._sorted.append((name.lower(), org_id))
+
+    def _remove(self, org_id: int):
+        name = self._names.pop(org_id, None)
+        if name is None:
+            return
+        for gram in trigrams(name):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(org_id)
+                if not postings:
+                    del self._postings[gram]
+        pos = bisect.bisect_left(self._sorted, (name.lower(), org_id))
+        if pos < len(self._sorted) and self._sorted[pos] == (name.lower(), org_id):
+            del self._sorted[pos]
+
+    def _matches(self, query: str) -> list[tuple[int, str]]:
+        # (id, name) of the organizations whose name contains query, called under the lock
+        needle = query.lower()
+        grams = trigrams(needle)
+        if grams:
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key = len)
+            candidates = set.intersection(*postings)
+        else:
+            # shorter than a trigram, every name is a candidate
+            candidates = self._names.keys()
+        return [(org_id, self._names[org_id]) for org_id in candidates if needle in self._names[org_id].lower()]
+
+    def containing(self, query: str) -> set[int]:
+        # ids of the organizations whose name contains query, unranked
+        with self._lock:
+            return {org_id for org_id, _ in self._matches(query)}
+
+    def search(self, query: str) -> list[tuple[float, str, int]]:
+        # (similarity, name, id) of the organizations whose name contains query, most similar first
+        with self._lock:
+            matches = self._matches(query)
+        ranked = [(similarity(query, name), name, org_id) for org_id, name in matches]
+        ranked.sort(key = lambda m: (-m[0], m[1], m[2]))
+        return ranked
+
+    def prefix(self, query: str, limit: int, deadline: float = None) -> list[tuple[int, str]]:
+        # (id, name) of up to limit organizations whose name starts with query, stops early at the monotonic deadline
+        needle = query.lower()
+        result = []
+        with self._lock:
+            pos = bisect.bisect_left(self._sorted, (needle,))
+            while pos < len(self._sorted) and len(result) < limit:
+                name, org_id = self._sorted[pos]
+                if not name.startswith(needle):
+                    break
+                result.append((org_id, self._names[org_id]))
+                pos += 1
+                if deadline is not None and time.monotonic() > deadline:
+                    break
+        return result
+
+name_index = NgramIndex()
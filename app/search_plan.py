@@ -0,0 +1,192 @@
+"""
+Plan of the combined organization search (GET /organizations/search): geo area, activity subtree and name substring.
+
+Every filter estimates how many organizations it matches, from the in-process indexes (geo engine, n-gram index)
+or from cached counts. The most selective one drives a single indexed query for (id, building_id) candidates,
+the others verify them: in SQL where that is a cheap per-row check, otherwise in memory against the exact id sets
+of the in-process indexes. Total count and paging are computed over the verified ids.
+"""
+from sqlalchemy import bindparam, exists, func, select
+from sqlalchemy.orm import Session
+from app import search
+from app.db import models
+from app.snapshot import Snapshot
+
+# response headers: matches of all pages, and the chosen plan
+TOTAL_HEADER = "X-Total-Count"
+PLAN_HEADER = "X-Search-Plan"
+# seconds before the cached counts are reloaded, they only steer the plan
+RELOAD_INTERVAL = 60.0
+# matches counted at most when estimating the name filter on PostgreSQL
+NAME_PROBE_ROWS = 10000
+
+def literal_in(column, values):
+    # IN list rendered inline, not bound one parameter per value, so large candidate sets stay under the parameter limits
+    return column.in_(bindparam(None, sorted(values), expanding = True, literal_execute = True))
+
+class PlannerStats(Snapshot):
+    """
+    Organization and building counts and organizations per activity, for the estimates.
+    """
+
+    def __init__(self):
+        super().__init__(RELOAD_INTERVAL)
+        self.organizations = 0
+        self.buildings = 0
+        self.links_by_activity = {}
+
+    def load(self, db: Session):
+        organizations = db.execute(select(func.count()).select_from(models.Organization)).scalar()
+        buildings = db.execute(select(func.count()).select_from(models.Building)).scalar()
+        links = dict(db.execute(
+            select(models.organization_activity.c.activity_id, func.count())
+            .group_by(models.organization_activity.c.activity_id)
+        ).all())
+        with self._lock:
+            self.organizations, self.buildings, self.links_by_activity = organizations, buildings, links
+            self._swapped()
+
+planner_stats = PlannerStats()
+
+## filters
+
+class GeoFilter:
+    """
+    Buildings inside the radius or rectangle, exact from the geo engine.
+    """
+    name = "geo"
+
+    def __init__(self, building_ids):
+        self.building_ids = set(building_ids)
+
+    def empty(self) -> bool:
+        return not self.building_ids
+
+    def estimate(self, db: Session) -> int:
+        per_building = planner_stats.organizations / planner_stats.buildings if planner_stats.buildings else 0
+        return round(len(self.building_ids) * per_building)
+
+    def drive(self):
+        return literal_in(models.Organization.building_id, self.building_ids)
+
+    def verify_sql(self):
+        return None
+
+    def accepts(self, org_id: int, building_id: int) -> bool:
+        return building_id in self.building_ids
+
+class ActivityFilter:
+    """
+    Organizations linked to any activity of the subtree, estimated from the cached link counts.
+    """
+    name = "activity"
+
+    def __init__(self, activity_ids):
+        self.activity_ids = activity_ids
+
+    def empty(self) -> bool:
+        return False
+
+    def estimate(self, db: Session) -> int:
+        return sum(planner_stats.links_by_activity.get(activity_id, 0) for activity_id in self.activity_ids)
+
+    def drive(self):
+        return models.Organization.id.in_(
+            select(models.organization_activity.c.organization_id)
+            .where(models.organization_activity.c.activity_id.in_(self.activity_ids))
+        )
+
+    def verify_sql(self):
+        # correlated, checked per candidate on the (organization_id, activity_id) primary key
+        return exists().where(
+            models.organization_activity.c.organization_id == models.Organization.id,
+            models.organization_activity.c.activity_id.in_(self.activity_ids)
+        )
+
+    def accepts(self, org_id: int, building_id: int) -> bool:
+        return True
+
+class NameIndexFilter:
+    """
+    Organizations whose name contains the substring, exact from the in-process n-gram index.
+    """
+    name = "name"
+
+    def __init__(self, org_ids):
+        self.org_ids = set(org_ids)
+
+    def empty(self) -> bool:
+        return not self.org_ids
+
+    def estimate(self, db: Session) -> int:
+        return len(self.org_ids)
+
+    def drive(self):
+        return literal_in(models.Organization.id, self.org_ids)
+
+    def verify_sql(self):
+        return None
+
+    def accepts(self, org_id: int, building_id: int) -> bool:
+        return org_id in self.org_ids
+
+class NameTrigramFilter:
+    """
+    Name substring on PostgreSQL, served by the pg_trgm GIN index, estimated with a bounded count.
+    """
+    name = "name"
+
+    def __init__(self, query: str):
+        self.clause = models.Organization.name.ilike(search.like_pattern(query), escape = "\\")
+
+    def empty(self) -> bool:
+        return False
+
+    def estimate(self, db: Session) -> int:
+        probe = select(models.Organization.id).where(self.clause).limit(NAME_PROBE_ROWS).subquery()
+        return db.execute(select(func.count()).select_from(probe)).scalar()
+
+    def drive(self):
+        return self.clause
+
+    def verify_sql(self):
+        return self.clause
+
+    def accepts(self, org_id: int, building_id: int) -> bool:
+        return True
+
+def name_filter(db: Session, query: str):
+    if db.bind.dialect.name == "postgresql":
+        return NameTrigramFilter(query)
+    search.name_index.ensure_loaded(db)
+    return NameIndexFilter(search.name_index.containing(query))
+
+## planning
+
+class SearchResult:
+    def __init__(self, ids: list[int], plan: str):
+        # matching organization ids in ascending order
+        self.ids = ids
+        self.plan = plan
+
+def run(db: Session, filters: list) -> SearchResult:
+    planner_stats.ensure_loaded(db)
+    estimates = sorted(((f.estimate(db), i, f) for i, f in enumerate(filters)), key = lambda item: item[:2])
+    plan = "driver=" + estimates[0][2].name + "; " + ", ".join(f"{f.name}={n}" for n, _, f in estimates)
+    driver = estimates[0][2]
+    others = [f for _, _, f in estimates[1:]]
+    # only an empty candidate set of an in-process index is certain, the estimates just order the filters
+    if any(f.empty() for f in filters):
+        return SearchResult([], plan)
+    # the exact ids of an in-process index need no query when nothing else filters them
+    if not others and isinstance(driver, NameIndexFilter):
+        return SearchResult(sorted(driver.org_ids), plan)
+    query = select(models.Organization.id, models.Organization.building_id).where(driver.drive())
+    for f in others:
+        clause = f.verify_sql()
+        if clause is not None:
+            query = query.where(clause)
+    rows = db.execute(query.order_by(models.Organization.id)).all()
+    ids = [org_id for org_id, building_id in rows if all(f.accepts(org_id, building_id) for f in others)]
+    #
+    return SearchResult(ids, plan)
@@ -1,9 +1,13 @@
 # from pydantic import BaseSettings
 from fastapi import HTTPException, Header
 
+API_KEY: str = "x"
+
+def valid_api_key(api_key: str) -> bool:
+    return api_key == API_KEY
+
 async def get_api_key(api_key: str = Header(..., alias = "X-API-KEY")):
-    API_KEY: str = "x"
-    if api_key != API_KEY:
+    if not valid_api_key(api_key):
         raise HTTPException(
             status_code = 403,
             detail = "Invalid API Key"
@@ -0,0 +1,57 @@
+import os
+import tempfile
+from dotenv import load_dotenv
+
+# values from a local .env, the real environment (docker compose) takes precedence
+load_dotenv()
+
+def env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+def env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+def env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+class Settings:
+    """
+    Application settings from the environment, read once at import.
+    """
+
+    def __init__(self):
+        self.database_url = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/organizations_db")
+        # comma separated urls of read replicas, read-only routes use the primary when empty
+        self.database_replica_urls = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+        # replica choice per request: round_robin or least_connections
+        self.db_replica_strategy = os.getenv("DB_REPLICA_STRATEGY", "round_robin")
+        # seconds a client reads from the primary after its last write, covers the replication lag
+        self.db_sticky_seconds = env_float("DB_STICKY_SECONDS", 5.0)
+        # sync (threadpool) or async (asyncpg) database stack
+        self.db_mode = os.getenv("DB_MODE", "sync")
+        # read-only list routes return orjson responses of the read model rows without response_model validation
+        self.fast_responses = env_bool("FAST_RESPONSES", True)
+        # connection pool of every engine, per worker process
+        self.db_pool_size = env_int("DB_POOL_SIZE", 5)
+        self.db_max_overflow = env_int("DB_MAX_OVERFLOW", 10)
+        self.db_pool_timeout = env_float("DB_POOL_TIMEOUT", 30.0)
+        self.db_pool_recycle = env_int("DB_POOL_RECYCLE", 1800)
+        self.db_pool_pre_ping = env_bool("DB_POOL_PRE_PING", True)
+        # response cache of the hot single-entity reads: local (per worker) or redis (shared)
+        self.response_cache_backend = os.getenv("RESPONSE_CACHE_BACKEND", "local")
+        self.response_cache_url = os.getenv("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+        self.response_cache_ttl = env_float("RESPONSE_CACHE_TTL", 60.0)
+        self.response_cache_max_entries = env_int("RESPONSE_CACHE_MAX_ENTRIES", 10000)
+        self.response_cache_max_bytes = env_int("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+        # statements per request: a shape executed this many times is reported as an N+1 pattern
+        self.n_plus_one_threshold = env_int("N_PLUS_ONE_THRESHOLD", 5)
+        # raise on a query budget violation or an N+1 pattern instead of logging a warning, for tests
+        self.query_budget_strict = env_bool("QUERY_BUDGET_STRICT", False)
+        # X-Profile: 1 requests are profiled only when enabled, otherwise the profiling middleware is not installed
+        self.profiling_enabled = env_bool("PROFILING_ENABLED", False)
+        self.profiling_interval_ms = env_float("PROFILING_INTERVAL_MS", 1.0)
+        self.profiling_dir = os.getenv("PROFILING_DIR", os.path.join(tempfile.gettempdir(), "profiles"))
+        # deepest zoom level of the precomputed tile aggregates, deeper views use /organizations/search/within-rectangle
+        self.tiles_max_zoom = env_int("TILES_MAX_ZOOM", 12)
+
+settings = Settings()
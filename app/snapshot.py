@@ -0,0 +1,91 @@
+"""
+Reloading of the in-process snapshots: geo engine, n-gram index, tile index and planner counts.
+
+The first load, and the first one after invalidate(), runs on the request that needs it, there is nothing to serve before.
+A snapshot older than its reload interval keeps being served while a background thread builds the next one
+in a session of its own and swaps it in. A lock makes it single-flight: one load per snapshot at a time,
+concurrent requests serve the old snapshot or, on the first load, wait for it.
+"""
+import logging
+import threading
+import time
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+class Snapshot:
+    """
+    Base of the snapshots. Subclasses implement load(db): read, build the new data, then swap it in under self._lock
+    and call self._swapped(). Their incremental writes call self._record() under the lock.
+    """
+
+    def __init__(self, reload_interval: float):
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        # held by the load in progress
+        self._load_lock = threading.Lock()
+        self._loaded_at = None
+        self._generation = 0
+        # set when the writes made during the last load were not applied to it, it is rebuilt again
+        self._dirty = False
+        # writes made while a load is running, (function, args) re-applied on the new data
+        self._writes = None
+
+    def stale(self, db: Session) -> bool:
+        return self._dirty or time.monotonic() - self._loaded_at > self.reload_interval
+
+    def ensure_loaded(self, db: Session):
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self._load(db)
+        elif self.stale(db) and self._load_lock.acquire(blocking = False):
+            threading.Thread(target = self._reload, name = f"reload-{type(self).__name__}", daemon = True).start()
+
+    def invalidate(self):
+        self._generation += 1
+        self._loaded_at = None
+
+    def _load(self, db: Session):
+        generation = self._generation
+        with self._lock:
+            self._writes = []
+        try:
+            self.load(db)
+        finally:
+            with self._lock:
+                self._writes = None
+        if self._generation != generation:
+            # invalidated while loading, the data read may predate the bulk write
+            self._loaded_at = None
+
+    def _reload(self):
+        # background thread, the primary is read: a replica could miss writes already applied to the snapshot
+        from app.db.session import SessionLocal
+        try:
+            with SessionLocal() as db:
+                self._load(db)
+        except Exception:
+            # the old snapshot stays, the next request retries
+            logger.exception("reload of %s failed", type(self).__name__)
+        finally:
+            self._load_lock.release()
+
+    def _loading(self) -> bool:
+        return self._writes is not None
+
+    def _record(self, function = None, *args):
+        # called under the lock by the writes, kept for _swapped() while a load is running
+        if self._writes is not None:
+            self._writes.append((function, args))
+
+    def _swapped(self, replay: bool = True):
+        # called under the lock by load() right after the swap: the writes made meanwhile are applied again,
+        # those committed before the load read are already in the data, they must be idempotent.
+        # Without replay they are left to another background load started by the next request.
+        if replay:
+            for function, args in self._writes:
+                function(*args)
+        self._dirty = not replay and bool(self._writes)
+        self._writes = []
+        self._loaded_at = time.monotonic()
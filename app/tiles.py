@@ -0,0 +1,279 @@
+"""
+Precomputed organization counts per map tile, served by GET /organizations/tiles/{z}/{x}/{y}.
+
+For every zoom level up to TILES_MAX_ZOOM the organizations are aggregated into the Web Mercator tiles of their buildings:
+a count and the sums of the building coordinates, so a cell answers with its count and centroid. Next to the totals
+each cell is aggregated per activity for the organizations linked to the activity or any of its descendants
+(closure ancestors, an organization counts once per ancestor), so a subtree filter is a single key.
+A level is a sorted int64 key array plus value arrays: the cells of a tile are a binary search and a slice,
+the cost of a request grows with its cells, not with the organizations under it.
+
+Writes of the routers are applied as small per-cell deltas next to the arrays and merged into them once enough
+have accumulated. Bulk writes invalidate the index, a new activity tree version (a move or delete) rebuilds it,
+and it is reloaded every RELOAD_INTERVAL to pick up the writes of other workers. A rebuild runs in the background
+(app.snapshot) while the old aggregates answer; the deltas are not idempotent, so the writes made during a rebuild
+are not replayed on the new aggregates, they mark them for another rebuild instead.
+"""
+import math
+import numpy as np
+from sqlalchemy import distinct, func, select
+from sqlalchemy.orm import Session
+from app.activity_tree import activity_tree
+from app.db import models
+from app.settings import settings
+from app.snapshot import Snapshot
+
+# seconds before the aggregates are reloaded, picks up writes of other workers
+RELOAD_INTERVAL = 60.0
+# delta cells kept next to the arrays before they are merged into them
+MERGE_THRESHOLD = 4096
+# Web Mercator covers latitudes up to this bound, the buildings beyond are counted in the edge tiles
+MAX_LATITUDE = 85.0511287798
+
+def tile_xy(lats, lons, zoom: int):
+    # Web Mercator tile coordinates of the points at the zoom level, scalars or numpy arrays
+    n = 1 << zoom
+    lat = np.radians(np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE))
+    x = np.floor((np.asarray(lons, dtype = np.float64) + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat)) / math.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+class Level:
+    """
+    Aggregates of one zoom level, keys in ascending order, replaced as a whole on a merge.
+    """
+    __slots__ = ("keys", "counts", "lat_sums", "lon_sums")
+
+    def __init__(self, keys: np.ndarray, counts: np.ndarray, lat_sums: np.ndarray, lon_sums: np.ndarray):
+        self.keys = keys
+        self.counts = counts
+        self.lat_sums = lat_sums
+        self.lon_sums = lon_sums
+
+def aggregate(keys: np.ndarray, counts: np.ndarray, lat_sums: np.ndarray, lon_sums: np.ndarray) -> Level:
+    # sum up the values of equal keys, cells that dropped to zero are left out
+    keys, inverse = np.unique(keys, return_inverse = True)
+    counts = np.bincount(inverse, weights = counts, minlength = len(keys))
+    lat_sums = np.bincount(inverse, weights = lat_sums, minlength = len(keys))
+    lon_sums = np.bincount(inverse, weights = lon_sums, minlength = len(keys))
+    keep = counts > 0
+    return Level(keys[keep], np.rint(counts[keep]).astype(np.int64), lat_sums[keep], lon_sums[keep])
+
+class TileIndex(Snapshot):
+    """
+    Per-worker tile aggregates for zoom levels 0 to TILES_MAX_ZOOM.
+    A key packs (activity id or 0 for all organizations, x, y) of a cell at its level.
+    The organizations and buildings routers report their writes after the commit.
+    """
+
+    def __init__(self, max_zoom: int):
+        super().__init__(RELOAD_INTERVAL)
+        self.max_zoom = max_zoom
+        self._tree = None
+        self._levels = []
+        # per level: key -> [count, latitude sum, longitude sum] written since the arrays were built
+        self._deltas = []
+        self._pending = 0
+        # building id -> (x, y at max_zoom, latitude, longitude)
+        self._buildings = {}
+
+    def key(self, activity_id: int, x, y):
+        return (activity_id << (2 * self.max_zoom)) | (x << self.max_zoom) | y
+
+    def load(self, db: Session):
+        tree = activity_tree.get(db)
+        buildings = db.execute(select(models.Building.id, models.Building.latitude, models.Building.longitude)).all()
+        totals = db.execute(
+            select(models.Organization.building_id, func.count())
+            .where(models.Organization.building_id.is_not(None))
+            .group_by(models.Organization.building_id)
+        ).all()
+        # organizations linked to each activity subtree, per building
+        per_activity = db.execute(
+            select(models.Organization.building_id, models.ActivityClosure.ancestor_id, func.count(distinct(models.Organization.id)))
+            .join(models.organization_activity, models.organization_activity.c.organization_id == models.Organization.id)
+            .join(models.ActivityClosure, models.ActivityClosure.descendant_id == models.organization_activity.c.activity_id)
+            .where(models.Organization.building_id.is_not(None))
+            .group_by(models.Organization.building_id, models.ActivityClosure.ancestor_id)
+        ).all()
+        ids = np.fromiter((r[0] for r in buildings), dtype = np.int64, count = len(buildings))
+        lats = np.fromiter((r[1] for r in buildings), dtype = np.float64, count = len(buildings))
+        lons = np.fromiter((r[2] for r in buildings), dtype = np.float64, count = len(buildings))
+        xs, ys = tile_xy(lats, lons, self.max_zoom)
+        rows = [(building_id, 0, n) for building_id, n in totals] + [tuple(r) for r in per_activity]
+        row_buildings = np.fromiter((r[0] for r in rows), dtype = np.int64, count = len(rows))
+        row_activities = np.fromiter((r[1] for r in rows), dtype = np.int64, count = len(rows))
+        row_counts = np.fromiter((r[2] for r in rows), dtype = np.float64, count = len(rows))
+        # rows of buildings written after the buildings were read are left to the next reload
+        order = np.argsort(ids)
+        pos = np.minimum(np.searchsorted(ids[order], row_buildings), max(len(ids) - 1, 0))
+        found = ids[order][pos] == row_buildings if len(ids) else np.zeros(len(rows), dtype = bool)
+        pos, row_activities, row_counts = order[pos[found]], row_activities[found], row_counts[found]
+        # the deepest level from the rows, every level above from the cells of the one below
+        levels = [aggregate(self.key(row_activities, xs[pos], ys[pos]), row_counts, row_counts * lats[pos], row_counts * lons[pos])]
+        mask = (1 << self.max_zoom) - 1
+        for _ in range(self.max_zoom):
+            below = levels[0]
+            keys = self.key(below.keys >> (2 * self.max_zoom), ((below.keys >> self.max_zoom) & mask) >> 1, (below.keys & mask) >> 1)
+            levels.insert(0, aggregate(keys, below.counts, below.lat_sums, below.lon_sums))
+        coordinates = {int(i): (int(x), int(y), float(lat), float(lon)) for i, x, y, lat, lon in zip(ids, xs, ys, lats, lons)}
+        with self._lock:
+            self._levels = levels
+            self._deltas = [{} for _ in levels]
+            self._pending = 0
+            self._buildings = coordinates
+            self._tree = tree
+            self._swapped(replay = False)
+
+    def stale(self, db: Session) -> bool:
+        # a new tree version changes the ancestors of the links, the aggregates are rebuilt
+        return super().stale(db) or activity_tree.get(db).version != self._tree.version
+
+    ## incremental updates
+
+    def ancestors(self, activity_ids) -> set:
+        # the linked activities and all of their ancestors, each counts the organization once
+        parents = self._tree.parents
+        result = set()
+        for activity_id in activity_ids:
+            while activity_id is not None and activity_id not in result and activity_id in parents:
+                result.add(activity_id)
+                activity_id = parents[activity_id]
+        return result
+
+    def add_organization(self, building_id: int, activity_ids = (), sign: int = 1):
+        if building_id is None:
+            return
+        with self._lock:
+            self._record()
+            if self._loaded_at is not None:
+                self._add(building_id, [0, *self.ancestors(activity_ids)], sign)
+
+    def remove_organization(self, building_id: int, activity_ids = ()):
+        self.add_organization(building_id, activity_ids, sign = -1)
+
+    def relink_organization(self, building_id: int, old_activity_ids, new_activity_ids):
+        # the activities of an organization changed, only the ancestors that came or went are updated
+        if building_id is None:
+            return
+        with self._lock:
+            self._record()
+            if self._loaded_at is None:
+                return
+            old, new = self.ancestors(old_activity_ids), self.ancestors(new_activity_ids)
+            self._add(building_id, new - old, 1)
+            self._add(building_id, old - new, -1)
+
+    def upsert_building(self, db: Session, building_id: int, lat: float, lon: float):
+        # a moved building takes its organizations along, read with their activities in one query
+        if self._loaded_at is None:
+            with self._lock:
+                self._record()
+            return
+        x, y = tile_xy(lat, lon, self.max_zoom)
+        moved = self._buildings.get(building_id)
+        if moved is not None and moved[2:] == (lat, lon):
+            return
+        links = {}
+        if moved is not None:
+            rows = db.execute(
+                select(models.Organization.id, models.organization_activity.c.activity_id)
+                .outerjoin(models.organization_activity, models.organization_activity.c.organization_id == models.Organization.id)
+                .where(models.Organization.building_id == building_id)
+            ).all()
+            for org_id, activity_id in rows:
+                links.setdefault(org_id, []).append(activity_id)
+        with self._lock:
+            self._record()
+            for activity_ids in links.values():
+                self._add(building_id, [0, *self.ancestors(a for a in activity_ids if a is not None)], -1)
+            self._buildings[building_id] = (int(x), int(y), float(lat), float(lon))
+            for activity_ids in links.values():
+                self._add(building_id, [0, *self.ancestors(a for a in activity_ids if a is not None)], 1)
+
+    def remove_building(self, building_id: int):
+        with self._lock:
+            self._record()
+            self._buildings.pop(building_id, None)
+
+    def _add(self, building_id: int, activity_ids, sign: int):
+        # called under the lock: one delta per activity key in the cell of the building on every level
+        coordinates = self._buildings.get(building_id)
+        if coordinates is None or not activity_ids:
+            return
+        x, y, lat, lon = coordinates
+        for zoom, deltas in enumerate(self._deltas):
+            shift = self.max_zoom - zoom
+            for activity_id in activity_ids:
+                key = self.key(activity_id, x >> shift, y >> shift)
+                delta = deltas.get(key)
+                if delta is None:
+                    delta = deltas[key] = [0, 0.0, 0.0]
+                    self._pending += 1
+                delta[0] += sign
+                delta[1] += sign * lat
+                delta[2] += sign * lon
+        if self._pending > MERGE_THRESHOLD:
+            self._merge()
+
+    def _merge(self):
+        # called under the lock: fold the deltas into new level arrays
+        for zoom, deltas in enumerate(self._deltas):
+            if not deltas:
+                continue
+            level = self._levels[zoom]
+            delta_keys = np.fromiter(deltas, dtype = np.int64, count = len(deltas))
+            values = np.array(list(deltas.values()), dtype = np.float64).reshape(-1, 3)
+            self._levels[zoom] = aggregate(
+                np.concatenate([level.keys, delta_keys]),
+                np.concatenate([level.counts, values[:, 0]]),
+                np.concatenate([level.lat_sums, values[:, 1]]),
+                np.concatenate([level.lon_sums, values[:, 2]])
+            )
+        self._deltas = [{} for _ in self._levels]
+        self._pending = 0
+
+    ## reads
+
+    def cells(self, z: int, x: int, y: int, resolution: int, activity_id: int = 0) -> list[dict]:
+        """
+        Non-empty cells of the tile divided into 2^resolution x 2^resolution, at zoom z + resolution,
+        with the count and centroid of their organizations.
+        """
+        zoom = z + resolution
+        mask = (1 << self.max_zoom) - 1
+        x0, x1 = x << resolution, (x + 1) << resolution
+        y0, y1 = y << resolution, (y + 1) << resolution
+        start, stop = self.key(activity_id, x0, 0), self.key(activity_id, x1, 0)
+        with self._lock:
+            level = self._levels[zoom]
+            deltas = [(key, list(delta)) for key, delta in self._deltas[zoom].items() if start <= key < stop]
+        # the cells of the tile's columns by binary search, rows outside of the tile by a mask
+        lo, hi = np.searchsorted(level.keys, [start, stop])
+        keys = level.keys[lo:hi]
+        ys = keys & mask
+        inside = np.flatnonzero((ys >= y0) & (ys < y1)) + lo
+        cells = {
+            int(key): [int(count), float(lat_sum), float(lon_sum)]
+            for key, count, lat_sum, lon_sum in zip(level.keys[inside], level.counts[inside], level.lat_sums[inside], level.lon_sums[inside])
+        }
+        for key, (count, lat_sum, lon_sum) in deltas:
+            if not y0 <= key & mask < y1:
+                continue
+            cell = cells.setdefault(key, [0, 0.0, 0.0])
+            cell[0] += count
+            cell[1] += lat_sum
+            cell[2] += lon_sum
+        #
+        return [
+            {
+                "x": (key >> self.max_zoom) & mask,
+                "y": key & mask,
+                "count": count,
+                "latitude": lat_sum / count,
+                "longitude": lon_sum / count,
+            }
+            for key, (count, lat_sum, lon_sum) in sorted(cells.items()) if count > 0
+        ]
+
+tile_index = TileIndex(settings.tiles_max_zoom)
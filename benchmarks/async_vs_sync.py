@@ -0,0 +1,83 @@
+"""
+Compare the sync (threadpool) and async (asyncpg) database stacks under concurrent load.
+
+    DATABASE_URL=... python -m benchmarks.async_vs_sync --requests 2000 --concurrency 200
+
+Each mode runs in its own process with DB_MODE set, requests go through httpx's in-process ASGI transport
+(needs httpx), so the numbers measure the app and the database, not the network.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PATHS = [
+    "/buildings/?limit=50",
+    "/organizations/?limit=50",
+    "/activities/1/tree",
+    "/organizations/nearby/?lat=55.75&lon=37.61&radius=2000",
+    "/organizations/search/by-name?name_query=ООО&limit=20",
+]
+
+async def run(requests: int, concurrency: int) -> dict:
+    import httpx
+    from app.main import app
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(PATHS[i % len(PATHS)])
+
+    async def worker(client):
+        nonlocal errors
+        while not queue.empty():
+            path = queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 500:
+                errors += 1
+
+    transport = httpx.ASGITransport(app = app)
+    async with httpx.AsyncClient(transport = transport, base_url = "http://bench", headers = {"X-API-KEY": "x"}) as client:
+        await client.get(PATHS[0])
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "mode": os.getenv("DB_MODE", "sync"),
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "sync vs async database stack benchmark")
+    parser.add_argument("--requests", type = int, default = 2000)
+    parser.add_argument("--concurrency", type = int, default = 200)
+    parser.add_argument("--mode", choices = ["sync", "async"], help = "run a single mode in this process")
+    args = parser.parse_args()
+    if args.mode:
+        print(json.dumps(asyncio.run(run(args.requests, args.concurrency))))
+        return
+    results = []
+    for mode in ("sync", "async"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.async_vs_sync", "--mode", mode, "--requests", str(args.requests), "--concurrency", str(args.concurrency)],
+            env = {**os.environ, "DB_MODE": mode}, capture_output = True, text = True, check = True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(f"{'mode':<6} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for r in results:
+        print(f"{r['mode']:<6} {r['throughput_rps']:>9} {r['p50_ms']:>9} {r['p99_ms']:>9} {r['errors']:>7}")
+
+if __name__ == "__main__":
+    main()
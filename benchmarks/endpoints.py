@@ -0,0 +1,328 @@
+"""
+Latency, throughput and SQL query count of every route, against a database filled by benchmarks.generate.
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.endpoints --save benchmarks/baselines/sqlite-50k.json
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.endpoints --baseline benchmarks/baselines/sqlite-50k.json
+
+Read routes run --requests requests with --concurrency workers, write routes run sequentially and delete
+what they create, so the database stays as generated. Requests go through httpx's in-process ASGI transport.
+With --baseline the exit code is 1 when an endpoint got slower than the tolerance allows (p95),
+runs more queries per request than in the baseline, had errors or is missing from the baseline.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+from sqlalchemy import event, func, select
+from app.db import models
+from app.db.pool import POOLS
+from app.db.session import SessionLocal
+from app.tiles import tile_xy
+
+## query counting
+
+class QueryCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines = set()
+        self.count = 0
+
+    def attach(self):
+        # every engine created so far, the async ones appear on their first use
+        for stats in POOLS.values():
+            if stats.engine is not None and id(stats.engine) not in self._engines:
+                self._engines.add(id(stats.engine))
+                event.listen(stats.engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        with self._lock:
+            self.count += 1
+
+## cases
+
+class Context:
+    """
+    Ids and coordinates sampled from the generated database, plus what the write cases created.
+    """
+
+    def __init__(self, seed: int):
+        self.rnd = random.Random(seed)
+        db = SessionLocal()
+        try:
+            self.organization_ids = db.execute(select(models.Organization.id).order_by(func.random()).limit(1000)).scalars().all()
+            self.buildings = db.execute(
+                select(models.Building.id, models.Building.latitude, models.Building.longitude).order_by(func.random()).limit(1000)
+            ).all()
+            activities = db.execute(select(models.Activity.id, models.Activity.level)).all()
+            self.numbers = db.execute(select(models.PhoneNumber.number).order_by(func.random()).limit(1000)).scalars().all()
+            self.max_organization_id = db.execute(select(func.max(models.Organization.id))).scalar() or 0
+        finally:
+            db.close()
+        if not self.organization_ids or not self.buildings:
+            raise SystemExit("the database is empty, fill it with python -m benchmarks.generate first")
+        self.roots = [a for a, level in activities if level == 1]
+        self.leaves = [a for a, level in activities if level == 3] or [a for a, _ in activities]
+        self.token = self.rnd.randint(0, 10 ** 6)
+        # created by the write cases, deleted at the end
+        self.new_buildings, self.new_activities, self.new_organizations, self.new_phones = [], [], [], []
+        self.imported = 0
+
+    def organization(self) -> int:
+        return self.rnd.choice(self.organization_ids)
+
+    def point(self) -> tuple[float, float]:
+        _, lat, lon = self.rnd.choice(self.buildings)
+        return lat, lon
+
+class Case:
+    def __init__(self, name: str, request, write: bool = False, max_requests: int = None, created: str = None):
+        self.name = name
+        # request(ctx, i) -> (method, url, keyword arguments of httpx request)
+        self.request = request
+        self.write = write
+        self.max_requests = max_requests
+        # Context list the created ids are appended to
+        self.created = created
+
+def get(url):
+    return "GET", url, {}
+
+def nearby_batch(ctx, i):
+    points = [dict(zip(("lat", "lon"), ctx.point()), radius = 1000) for _ in range(10)]
+    return "POST", "/organizations/nearby/batch", {"json": points}
+
+def import_organizations(ctx, i):
+    # explicit ids past the generated ones, so the imported rows can be deleted afterwards
+    rows = []
+    for _ in range(10):
+        ctx.imported += 1
+        org_id = ctx.max_organization_id + 10 ** 6 + ctx.token * 1000 + ctx.imported
+        rows.append(json.dumps({"id": org_id, "name": f"Импорт {org_id}", "building_id": ctx.new_buildings[0]}))
+        ctx.new_organizations.append(org_id)
+    return "POST", "/import/organizations?format=ndjson", {"content": "\n".join(rows).encode()}
+
+def lookup_batch(ctx, i):
+    # a call-center sync: known numbers, some written without the +, and unknown ones
+    numbers = [n.lstrip("+") if k % 2 else n for k, n in enumerate(ctx.numbers)] + [f"+1555{k:07d}" for k in range(100)]
+    return "POST", "/phones/lookup", {"json": numbers}
+
+def words(ctx):
+    return ctx.rnd.choice(["Рога", "Вектор", "Альфа", "Север", "Гранит", "Лидер"])
+
+def tile(ctx):
+    # the tile of a building at a low zoom level, as a clustering map asks for it
+    zoom = ctx.rnd.randint(2, 9)
+    x, y = tile_xy(*ctx.point(), zoom)
+    return zoom, int(x), int(y)
+
+CASES = [
+    # reads
+    Case("GET /buildings/", lambda ctx, i: get("/buildings/?limit=100")),
+    Case("GET /buildings/{id}", lambda ctx, i: get(f"/buildings/{ctx.rnd.choice(ctx.buildings)[0]}")),
+    Case("GET /activities/", lambda ctx, i: get("/activities/?limit=100")),
+    Case("GET /activities/{id}", lambda ctx, i: get(f"/activities/{ctx.rnd.choice(ctx.leaves)}")),
+    Case("GET /activities/{id}/tree", lambda ctx, i: get(f"/activities/{ctx.rnd.choice(ctx.roots)}/tree")),
+    Case("GET /phones/", lambda ctx, i: get("/phones/?limit=100")),
+    Case("GET /phones/lookup", lambda ctx, i: get(f"/phones/lookup?number={ctx.rnd.choice(ctx.numbers).lstrip('+')}")),
+    Case("POST /phones/lookup", lookup_batch),
+    Case("GET /organizations/", lambda ctx, i: get("/organizations/?limit=100")),
+    Case("GET /organizations/{id}", lambda ctx, i: get(f"/organizations/{ctx.organization()}")),
+    Case("GET /organizations/by-building/{id}", lambda ctx, i: get(f"/organizations/by-building/{ctx.rnd.choice(ctx.buildings)[0]}")),
+    Case("GET /organizations/by-activity/{id}", lambda ctx, i: get(f"/organizations/by-activity/{ctx.rnd.choice(ctx.leaves)}")),
+    Case("GET /organizations/by-activity-tree/{id}", lambda ctx, i: get(f"/organizations/by-activity-tree/{ctx.rnd.choice(ctx.roots)}")),
+    Case("GET /organizations/nearby/", lambda ctx, i: get("/organizations/nearby/?lat={}&lon={}&radius=1000".format(*ctx.point()))),
+    Case("POST /organizations/nearby/batch", nearby_batch),
+    Case("GET /organizations/nearest/", lambda ctx, i: get("/organizations/nearest/?lat={}&lon={}&k=20".format(*ctx.point()))),
+    Case("GET /organizations/search/within-rectangle", lambda ctx, i: get(
+        "/organizations/search/within-rectangle?min_lat={0}&min_lon={1}&max_lat={2}&max_lon={3}".format(
+            *(lambda lat, lon: (lat - 0.01, lon - 0.02, lat + 0.01, lon + 0.02))(*ctx.point())
+        )
+    )),
+    Case("GET /organizations/search/by-name", lambda ctx, i: get(f"/organizations/search/by-name?name_query={words(ctx)}&limit=20")),
+    Case("GET /organizations/search/autocomplete", lambda ctx, i: get(f"/organizations/search/autocomplete?prefix=ООО {words(ctx)[:2]}")),
+    Case("GET /organizations/search", lambda ctx, i: get("/organizations/search?lat={}&lon={}&radius=5000&activity_id={}&name={}&limit=20".format(
+        *ctx.point(), ctx.rnd.choice(ctx.roots), words(ctx)
+    ))),
+    Case("GET /organizations/tiles/{z}/{x}/{y}", lambda ctx, i: get("/organizations/tiles/{}/{}/{}?resolution=3".format(*tile(ctx)))),
+    Case("GET /organizations/export", lambda ctx, i: get("/organizations/export?format=ndjson"), max_requests = 2),
+    # writes, in dependency order
+    Case("POST /buildings/", lambda ctx, i: ("POST", "/buildings/", {"json": {"address": f"bench {i}", "latitude": 55.75, "longitude": 37.61}}),
+         write = True, created = "new_buildings"),
+    Case("PUT /buildings/{id}", lambda ctx, i: ("PUT", f"/buildings/{ctx.new_buildings[i % len(ctx.new_buildings)]}", {"json": {"address": f"bench {i}*"}}),
+         write = True),
+    Case("POST /activities/", lambda ctx, i: ("POST", "/activities/", {"json": {"name": f"bench {i}", "parent_id": ctx.rnd.choice(ctx.roots)}}),
+         write = True, created = "new_activities"),
+    Case("PUT /activities/{id}", lambda ctx, i: (
+        "PUT", f"/activities/{ctx.new_activities[i % len(ctx.new_activities)]}", {"json": {"name": f"bench {i}*", "parent_id": ctx.roots[0]}}
+    ), write = True),
+    Case("POST /organizations/", lambda ctx, i: ("POST", "/organizations/", {"json": {"name": f"bench {i}", "building_id": ctx.new_buildings[0]}}),
+         write = True, created = "new_organizations"),
+    Case("PUT /organizations/{id}", lambda ctx, i: (
+        "PUT", f"/organizations/{ctx.new_organizations[i % len(ctx.new_organizations)]}", {"json": {"name": f"bench {i}*"}}
+    ), write = True),
+    Case("POST /organizations/{id}/phones/", lambda ctx, i: (
+        "POST", f"/organizations/{ctx.new_organizations[i % len(ctx.new_organizations)]}/phones/",
+        {"json": {"number": f"+75{ctx.token:06d}{i:04d}"}}
+    ), write = True, created = "new_phones"),
+    Case("DELETE /organizations/phones/", lambda ctx, i: ("DELETE", "/organizations/phones/", {"json": {"number": ctx.new_phones.pop()}}),
+         write = True),
+    Case("POST /organizations/{id}/activities/{activity_id}", lambda ctx, i: (
+        "POST", f"/organizations/{ctx.new_organizations[i % len(ctx.new_organizations)]}/activities/{ctx.new_activities[0]}", {}
+    ), write = True),
+    Case("DELETE /organizations/{id}/activities/{activity_id}", lambda ctx, i: (
+        "DELETE", f"/organizations/{ctx.new_organizations[i % len(ctx.new_organizations)]}/activities/{ctx.new_activities[0]}", {}
+    ), write = True),
+    Case("POST /organizations/batch", lambda ctx, i: (
+        "POST", "/organizations/batch", {"json": [{"name": f"bench batch {i}.{j}", "building_id": ctx.new_buildings[0]} for j in range(10)]}
+    ), write = True, created = "new_organizations"),
+    Case("PUT /organizations/batch", lambda ctx, i: (
+        "PUT", "/organizations/batch", {"json": [{"id": org_id, "name": f"bench batch {i}*"} for org_id in ctx.new_organizations[-10:]]}
+    ), write = True),
+    Case("POST /import/{entity}", import_organizations, write = True),
+    # clean up
+    Case("DELETE /organizations/{id}", lambda ctx, i: ("DELETE", f"/organizations/{ctx.new_organizations.pop()}", {}), write = True),
+    Case("DELETE /activities/{id}", lambda ctx, i: ("DELETE", f"/activities/{ctx.new_activities.pop()}", {}), write = True),
+    Case("DELETE /buildings/{id}", lambda ctx, i: ("DELETE", f"/buildings/{ctx.new_buildings.pop()}", {}), write = True),
+]
+
+# how many requests the write cases make, the deletes remove everything created before
+def write_requests(case: Case, ctx: Context, requests: int) -> int:
+    remaining = {
+        "DELETE /organizations/phones/": len(ctx.new_phones),
+        "DELETE /organizations/{id}": len(ctx.new_organizations),
+        "DELETE /activities/{id}": len(ctx.new_activities),
+        "DELETE /buildings/{id}": len(ctx.new_buildings),
+    }
+    return remaining.get(case.name, min(requests, 50))
+
+## running
+
+def created_id(case: Case, response) -> list:
+    body = response.json()
+    if case.name == "POST /organizations/batch":
+        return body["ids"]
+    if case.name == "POST /organizations/{id}/phones/":
+        return [body["number"]]
+    return [body["id"]]
+
+async def run_case(client, case: Case, ctx: Context, counter: QueryCounter, requests: int, concurrency: int) -> dict:
+    if case.write:
+        requests, concurrency = write_requests(case, ctx, requests), 1
+    else:
+        requests = min(requests, case.max_requests or requests)
+        # warm up the in-process indexes and caches the route relies on
+        method, url, kwargs = case.request(ctx, 0)
+        await client.request(method, url, **kwargs)
+    counter.attach()
+    latencies, errors = [], 0
+    queries_before = counter.count
+    next_index = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in next_index:
+            method, url, kwargs = case.request(ctx, i)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            elif case.created:
+                getattr(ctx, case.created).extend(created_id(case, response))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    if not latencies:
+        return {"endpoint": case.name, "requests": 0}
+    latencies.sort()
+    return {
+        "endpoint": case.name,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "queries_per_request": round((counter.count - queries_before) / len(latencies), 2),
+    }
+
+def percentile(values: list[float], q: float) -> float:
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+async def run(requests: int, concurrency: int, only: str = None, seed: int = 1) -> list[dict]:
+    import httpx
+    from app.main import app
+    ctx = Context(seed)
+    counter = QueryCounter()
+    results = []
+    transport = httpx.ASGITransport(app = app)
+    async with httpx.AsyncClient(transport = transport, base_url = "http://bench", headers = {"X-API-KEY": "x"}, timeout = None) as client:
+        for case in CASES:
+            # writes always run, later cases need what they create
+            if only and only not in case.name and not case.write:
+                continue
+            results.append(await run_case(client, case, ctx, counter, requests, concurrency))
+    return results
+
+## baselines
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float, min_delta_ms: float = 5) -> list[str]:
+    # regressions: failed requests, an endpoint without a baseline entry (save a new baseline),
+    # p95 slower than the tolerance allows (and by more than min_delta_ms, fast routes are noisy) or more queries per request
+    previous = {r["endpoint"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        if r.get("errors"):
+            regressions.append(f"{r['endpoint']}: {r['errors']} of {r['requests']} requests failed")
+        b = previous.get(r["endpoint"])
+        if b is None:
+            regressions.append(f"{r['endpoint']}: not in the baseline")
+            continue
+        if not r.get("requests") or not b.get("requests"):
+            continue
+        if r["p95_ms"] > b["p95_ms"] * (1 + tolerance) and r["p95_ms"] - b["p95_ms"] > min_delta_ms:
+            regressions.append(f"{r['endpoint']}: p95 {b['p95_ms']} -> {r['p95_ms']} ms")
+        if r["queries_per_request"] > b["queries_per_request"]:
+            regressions.append(f"{r['endpoint']}: queries per request {b['queries_per_request']} -> {r['queries_per_request']}")
+    return regressions
+
+def print_table(results: list[dict]):
+    print(f"{'endpoint':<54} {'req':>5} {'err':>4} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+    for r in results:
+        if r.get("requests"):
+            print(
+                f"{r['endpoint']:<54} {r['requests']:>5} {r['errors']:>4} {r['throughput_rps']:>8} "
+                f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['queries_per_request']:>8}"
+            )
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description = "per-endpoint benchmark against a generated database")
+    parser.add_argument("--requests", type = int, default = 200, help = "per read endpoint, write endpoints make at most 50")
+    parser.add_argument("--concurrency", type = int, default = 10)
+    parser.add_argument("--only", help = "substring of the read endpoints to run")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--save", help = "write the results to this json file")
+    parser.add_argument("--baseline", help = "compare with the results saved in this json file")
+    parser.add_argument("--tolerance", type = float, default = 0.25, help = "allowed p95 slowdown against the baseline")
+    parser.add_argument("--min-delta-ms", type = float, default = 5, help = "p95 slowdowns below this are noise")
+    args = parser.parse_args(argv)
+    results = asyncio.run(run(args.requests, args.concurrency, args.only, args.seed))
+    print_table(results)
+    if args.save:
+        with open(args.save, "w", encoding = "utf-8") as f:
+            json.dump(results, f, indent = 2, ensure_ascii = False)
+    if args.baseline:
+        with open(args.baseline, encoding = "utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Synthetic organizations database for benchmarks.
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.generate --organizations 1000000
+    DATABASE_URL=postgresql://... python -m benchmarks.generate --organizations 5000000 --seed 7
+
+Buildings are clustered around city centers (gaussian spread), activities form a full 3-level tree,
+organizations get 1-3 activities and 0..2*phones phone numbers. The schema is migrated to head first,
+the database must not contain organizations yet. Rows are generated and written chunk by chunk
+(COPY on PostgreSQL), so memory stays flat for millions of organizations.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import func, select
+from app.db import bulk, models
+from app.db.session import SessionLocal
+
+# (name, latitude, longitude, spread in degrees, weight), the share of buildings is proportional to the weight
+CITIES = [
+    ("Москва", 55.7558, 37.6173, 0.12, 12),
+    ("Санкт-Петербург", 59.9343, 30.3351, 0.10, 6),
+    ("Новосибирск", 55.0084, 82.9357, 0.08, 2),
+    ("Екатеринбург", 56.8389, 60.6057, 0.07, 2),
+    ("Казань", 55.7961, 49.1064, 0.06, 2),
+    ("Нижний Новгород", 56.2965, 43.9361, 0.06, 1),
+    ("Самара", 53.1959, 50.1002, 0.05, 1),
+    ("Владивосток", 43.1155, 131.8855, 0.05, 1),
+    ("Калининград", 54.7104, 20.4522, 0.04, 1),
+]
+STREETS = ["Ленина", "Мира", "Гагарина", "Победы", "Садовая", "Советская", "Лесная", "Школьная", "Набережная", "Центральная"]
+NAME_PREFIXES = ["ООО", "ИП", "АО", "ЗАО", "ПАО"]
+NAME_WORDS = ["Рога", "Копыта", "Вектор", "Альфа", "Север", "Восток", "Урожай", "Гранит", "Меридиан", "Садко", "Фортуна", "Лидер"]
+# write chunk of the generator
+CHUNK_SIZE = 10000
+
+def building_rows(count: int, rnd: random.Random):
+    weights = [city[4] for city in CITIES]
+    for building_id in range(1, count + 1):
+        name, lat, lon, spread, _ = rnd.choices(CITIES, weights)[0]
+        yield {
+            "id": building_id,
+            "address": f"{name}, ул. {rnd.choice(STREETS)}, {rnd.randint(1, 200)}",
+            "latitude": round(min(max(rnd.gauss(lat, spread), -90), 90), 6),
+            "longitude": round(min(max(rnd.gauss(lon, spread * 1.8), -180), 180), 6),
+            "version": 1,
+        }
+
+def activity_rows(roots: int, fanout: int) -> list[dict]:
+    # full tree of three levels: roots, roots * fanout, roots * fanout^2
+    rows, next_id = [], 1
+    for r in range(roots):
+        root_id = next_id
+        rows.append({"id": root_id, "name": f"Деятельность {r + 1}", "parent_id": None, "level": 1, "version": 1})
+        next_id += 1
+        for c in range(fanout):
+            child_id = next_id
+            rows.append({"id": child_id, "name": f"Деятельность {r + 1}.{c + 1}", "parent_id": root_id, "level": 2, "version": 1})
+            next_id += 1
+            for g in range(fanout):
+                rows.append({"id": next_id, "name": f"Деятельность {r + 1}.{c + 1}.{g + 1}", "parent_id": child_id, "level": 3, "version": 1})
+                next_id += 1
+    return rows
+
+def organization_rows(count: int, buildings: int, activity_ids: list[int], phones: int, rnd: random.Random):
+    # (organization, its phones, its activity links) per organization, phone numbers are unique by construction
+    phone_id = 0
+    for org_id in range(1, count + 1):
+        org = {
+            "id": org_id,
+            "name": f"{rnd.choice(NAME_PREFIXES)} {rnd.choice(NAME_WORDS)} {rnd.choice(NAME_WORDS)} {org_id}",
+            "building_id": rnd.randint(1, buildings),
+            "version": 1,
+        }
+        org_phones = []
+        for _ in range(rnd.randint(0, 2 * phones)):
+            phone_id += 1
+            org_phones.append({"id": phone_id, "number": f"+79{phone_id:09d}", "organization_id": org_id})
+        links = [{"organization_id": org_id, "activity_id": a} for a in rnd.sample(activity_ids, rnd.randint(1, 3))]
+        yield org, org_phones, links
+
+def migrate():
+    command.upgrade(Config(str(Path(__file__).resolve().parent.parent / "alembic.ini")), "head")
+
+def generate(organizations: int, buildings: int, roots: int, fanout: int, phones: int, seed: int) -> dict:
+    rnd = random.Random(seed)
+    db = SessionLocal()
+    counts = {"buildings": 0, "activities": 0, "organizations": 0, "phones": 0, "organization_activities": 0}
+    try:
+        if db.execute(select(func.count()).select_from(models.Organization)).scalar():
+            raise SystemExit("the database already contains organizations, generate into an empty one")
+        for chunk in bulk.chunks(building_rows(buildings, rnd), CHUNK_SIZE):
+            bulk.write_rows(db, models.Building.__table__, chunk)
+            db.commit()
+            counts["buildings"] += len(chunk)
+        activities = activity_rows(roots, fanout)
+        bulk.write_rows(db, models.Activity.__table__, activities)
+        db.commit()
+        counts["activities"] = len(activities)
+        activity_ids = [a["id"] for a in activities]
+        for chunk in bulk.chunks(organization_rows(organizations, buildings, activity_ids, phones, rnd), CHUNK_SIZE):
+            bulk.write_rows(db, models.Organization.__table__, [org for org, _, _ in chunk])
+            phone_rows = [phone for _, org_phones, _ in chunk for phone in org_phones]
+            link_rows = [link for _, _, links in chunk for link in links]
+            if phone_rows:
+                bulk.write_rows(db, models.PhoneNumber.__table__, phone_rows)
+            bulk.write_rows(db, models.organization_activity, link_rows)
+            db.commit()
+            counts["organizations"] += len(chunk)
+            counts["phones"] += len(phone_rows)
+            counts["organization_activities"] += len(link_rows)
+        # sequences behind the explicit ids, activity closure table and cache versions
+        for entity in ("buildings", "activities", "organizations", "phones"):
+            bulk.after_import(db, entity, {1})
+    finally:
+        db.close()
+    return counts
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description = "fill the database with synthetic organizations")
+    parser.add_argument("--organizations", type = int, default = 100000)
+    parser.add_argument("--buildings", type = int, default = None, help = "default: organizations / 5")
+    parser.add_argument("--activity-roots", type = int, default = 10)
+    parser.add_argument("--activity-fanout", type = int, default = 5, help = "children per activity on levels 1 and 2")
+    parser.add_argument("--phones", type = int, default = 2, help = "average phone numbers per organization")
+    parser.add_argument("--seed", type = int, default = 1)
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    migrate()
+    counts = generate(
+        args.organizations, args.buildings or max(args.organizations // 5, 1),
+        args.activity_roots, args.activity_fanout, args.phones, args.seed
+    )
+    print(json.dumps({**counts, "seconds": round(time.perf_counter() - started, 1)}, ensure_ascii = False))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Serialization cost of organization lists: response_model validation + json (the default FastAPI path)
+against orjson over the read model rows (the fast path).
+
+    python -m benchmarks.serialization --organizations 10000 --repeat 5
+
+No database is needed, the rows are generated in memory.
+"""
+import argparse
+import dataclasses
+import json
+import random
+import statistics
+import time
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from app.db import schemas
+from app.db.read_model import OrganizationRow
+from app.responses import FastJSONResponse
+
+def make_rows(count: int, seed: int = 1) -> list[OrganizationRow]:
+    rnd = random.Random(seed)
+    return [
+        OrganizationRow(
+            f"Организация {i}",
+            rnd.randint(1, count // 10 + 1),
+            i,
+            [f"+7{rnd.randint(9000000000, 9999999999)}" for _ in range(rnd.randint(0, 3))],
+            sorted(rnd.sample(range(1, 50), rnd.randint(0, 4))),
+        )
+        for i in range(1, count + 1)
+    ]
+
+def default_path(adapter: TypeAdapter, rows) -> bytes:
+    # what FastAPI does with a plain return value: dataclasses to dicts, validation against response_model,
+    # serialization of the validated models and json.dumps in JSONResponse
+    validated = adapter.validate_python([dataclasses.asdict(row) for row in rows])
+    return JSONResponse(adapter.dump_python(validated, mode = "json")).body
+
+def fast_path(rows) -> bytes:
+    return FastJSONResponse(rows).body
+
+def measure(fn, repeat: int) -> float:
+    # median seconds of repeat runs
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description = "serialization cost per organization list")
+    parser.add_argument("--organizations", type = int, default = 10000)
+    parser.add_argument("--repeat", type = int, default = 5)
+    args = parser.parse_args(argv)
+    rows = make_rows(args.organizations)
+    adapter = TypeAdapter(list[schemas.Organization])
+    assert json.loads(default_path(adapter, rows)) == json.loads(fast_path(rows))
+    before = measure(lambda: default_path(adapter, rows), args.repeat)
+    after = measure(lambda: fast_path(rows), args.repeat)
+    print(json.dumps({
+        "organizations": args.organizations,
+        "response_model_ms": round(before * 1000, 2),
+        "orjson_rows_ms": round(after * 1000, 2),
+        "speedup": round(before / after, 1),
+    }))
+
+if __name__ == "__main__":
+    main()
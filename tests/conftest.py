@@ -0,0 +1,75 @@
+import os
+import tempfile
+
+# the settings and engines are created at import, the test database and strict budgets come first
+TEST_DIR = tempfile.mkdtemp(prefix = "organizations-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ["QUERY_BUDGET_STRICT"] = "1"
+os.environ["DB_MODE"] = "sync"
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from app import cache, search_plan
+from app.activity_tree import activity_tree
+from app.db import models
+from app.db.session import SessionLocal, engine
+from app.geo_engine import geo_engine
+from app.main import app
+from app.search import name_index
+from app.tiles import tile_index
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope = "session", autouse = True)
+def migrated():
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "app", "migrations"))
+    command.upgrade(config, "head")
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def client(migrated, monkeypatch):
+    # empty tables, ids start at 1 again, so the in-process snapshots and caches are reset as well
+    with engine.begin() as connection:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    for index in (geo_engine, name_index, tile_index, search_plan.planner_stats):
+        index.invalidate()
+    session = SessionLocal()
+    try:
+        activity_tree.reload(session)
+    finally:
+        session.close()
+    monkeypatch.setattr(cache, "response_cache", cache.make_cache())
+    # the query budgets raise QueryBudgetExceeded through the client
+    return TestClient(app, headers = {"X-API-KEY": "x"})
+
+## data helpers
+
+def create_building(client, latitude: float = 55.75, longitude: float = 37.61, address: str = "ул. Ленина, 1") -> int:
+    response = client.post("/buildings/", json = {"address": address, "latitude": latitude, "longitude": longitude})
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+def create_activity(client, name: str, parent_id: int = None) -> int:
+    response = client.post("/activities/", json = {"name": name, "parent_id": parent_id})
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+def create_organizations(client, *organizations: dict) -> list[int]:
+    response = client.post("/organizations/batch", json = list(organizations))
+    assert response.status_code == 201, response.text
+    return response.json()["ids"]
+
+def closure_rows(db) -> set:
+    return set(db.execute(select(models.ActivityClosure.ancestor_id, models.ActivityClosure.descendant_id, models.ActivityClosure.depth)).all())
@@ -0,0 +1,63 @@
+from conftest import closure_rows, create_activity, create_building, create_organizations
+
+def test_create_builds_closure_and_tree(client, db):
+    food = create_activity(client, "Еда")
+    meat = create_activity(client, "Мясная продукция", food)
+    sausages = create_activity(client, "Колбасы", meat)
+    assert closure_rows(db) == {
+        (food, food, 0), (meat, meat, 0), (sausages, sausages, 0),
+        (food, meat, 1), (meat, sausages, 1), (food, sausages, 2),
+    }
+    assert client.get(f"/activities/{sausages}").json()["level"] == 3
+    # a fourth level is refused
+    assert client.post("/activities/", json = {"name": "Сервелат", "parent_id": sausages}).status_code == 400
+    tree = client.get(f"/activities/{food}/tree").json()
+    assert tree["level"] == 1
+    assert [child["id"] for child in tree["children"]] == [meat]
+    assert [child["id"] for child in tree["children"][0]["children"]] == [sausages]
+
+def test_move_updates_closure_levels_and_tree(client, db):
+    food = create_activity(client, "Еда")
+    meat = create_activity(client, "Мясная продукция", food)
+    sausages = create_activity(client, "Колбасы", meat)
+    shops = create_activity(client, "Магазины")
+    etag = client.get(f"/activities/{shops}/tree").headers["ETag"]
+    response = client.put(f"/activities/{meat}", json = {"name": "Мясная продукция", "parent_id": shops})
+    assert response.status_code == 200, response.text
+    assert response.json()["level"] == 2
+    assert {(a, d) for a, d, _ in closure_rows(db) if d in (meat, sausages)} == {
+        (meat, meat), (sausages, sausages), (meat, sausages), (shops, meat), (shops, sausages),
+    }
+    assert client.get(f"/activities/{sausages}").json()["level"] == 3
+    response = client.get(f"/activities/{shops}/tree", headers = {"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [child["id"] for child in response.json()["children"]] == [meat]
+    assert client.get(f"/activities/{food}/tree").json()["children"] == []
+    # under its own descendant, or deeper than three levels
+    assert client.put(f"/activities/{meat}", json = {"name": "Мясная продукция", "parent_id": sausages}).status_code == 400
+    assert client.put(f"/activities/{shops}", json = {"name": "Магазины", "parent_id": food}).status_code == 400
+
+def test_delete_detaches_children_and_links(client, db):
+    food = create_activity(client, "Еда")
+    meat = create_activity(client, "Мясная продукция", food)
+    sausages = create_activity(client, "Колбасы", meat)
+    dairy = create_activity(client, "Молочная продукция", food)
+    building = create_building(client)
+    org_ids = create_organizations(
+        client,
+        {"name": "Мясокомбинат", "building_id": building, "activity_ids": [meat, dairy]},
+        {"name": "Колбасный цех", "building_id": building, "activity_ids": [meat]},
+    )
+    etag = client.get(f"/organizations/{org_ids[0]}").headers["ETag"]
+    assert client.delete(f"/activities/{meat}").status_code == 204
+    assert client.get(f"/activities/{meat}").status_code == 404
+    # the child becomes a root
+    assert client.get(f"/activities/{sausages}").json()["parent_id"] is None
+    assert client.get(f"/activities/{sausages}").json()["level"] == 1
+    assert closure_rows(db) == {(food, food, 0), (dairy, dairy, 0), (food, dairy, 1), (sausages, sausages, 0)}
+    assert [child["id"] for child in client.get(f"/activities/{food}/tree").json()["children"]] == [dairy]
+    # the links are gone and the organizations have a new version
+    response = client.get(f"/organizations/{org_ids[0]}", headers = {"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["activity_ids"] == [dairy]
+    assert client.get(f"/organizations/{org_ids[1]}").json()["activity_ids"] == []
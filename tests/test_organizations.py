@@ -0,0 +1,86 @@
+from app.pagination import NEXT_CURSOR_HEADER
+from conftest import create_activity, create_building, create_organizations
+
+def test_batch_create(client):
+    building = create_building(client)
+    food = create_activity(client, "Еда")
+    org_ids = create_organizations(
+        client,
+        {"name": "Первая", "building_id": building, "phone_numbers": [{"number": "+79000000001"}], "activity_ids": [food, food]},
+        {"name": "Вторая", "building_id": building},
+    )
+    first = client.get(f"/organizations/{org_ids[0]}").json()
+    assert first["phone_numbers"] == ["+79000000001"]
+    assert first["activity_ids"] == [food]
+    assert client.get(f"/organizations/{org_ids[1]}").json()["phone_numbers"] == []
+
+def test_batch_create_conflicts(client):
+    building = create_building(client)
+    create_organizations(client, {"name": "Первая", "building_id": building, "phone_numbers": [{"number": "+79000000001"}]})
+    batch = lambda *numbers: [{"name": "Новая", "building_id": building, "phone_numbers": [{"number": n} for n in numbers]}]
+    # taken, with or without the leading +
+    assert client.post("/organizations/batch", json = batch("+79000000001")).status_code == 409
+    assert client.post("/organizations/batch", json = batch("79000000001")).status_code == 409
+    # repeated inside the batch
+    assert client.post("/organizations/batch", json = batch("+79000000002", "79000000002")).status_code == 409
+    assert client.post("/organizations/batch", json = batch("abc")).status_code == 400
+    assert client.post("/organizations/batch", json = [{"name": "Новая", "building_id": 999}]).status_code == 404
+    assert client.post("/organizations/batch", json = [{"name": "Новая", "building_id": building, "activity_ids": [999]}]).status_code == 404
+    assert len(client.get("/organizations/").json()) == 1
+
+def test_batch_update_conflicts(client):
+    building = create_building(client)
+    other = create_building(client, 59.93, 30.31)
+    first, second = create_organizations(
+        client,
+        {"name": "Первая", "building_id": building, "phone_numbers": [{"number": "+79000000001"}]},
+        {"name": "Вторая", "building_id": building, "phone_numbers": [{"number": "+79000000002"}]},
+    )
+    # the number of another organization whose phones are not replaced
+    response = client.put("/organizations/batch", json = [{"id": first, "phone_numbers": [{"number": "79000000002"}]}])
+    assert response.status_code == 409
+    assert client.put("/organizations/batch", json = [{"id": first, "name": "x"}, {"id": first, "name": "y"}]).status_code == 400
+    assert client.put("/organizations/batch", json = [{"id": 999, "name": "x"}]).status_code == 404
+    # numbers move between organizations replaced in the same batch
+    response = client.put("/organizations/batch", json = [
+        {"id": first, "name": "Первая 2", "phone_numbers": [{"number": "+79000000002"}]},
+        {"id": second, "building_id": other, "phone_numbers": [{"number": "+79000000001"}]},
+    ])
+    assert response.status_code == 200, response.text
+    assert client.get(f"/organizations/{first}").json() == {
+        "id": first, "name": "Первая 2", "building_id": building, "phone_numbers": ["+79000000002"], "activity_ids": []
+    }
+    assert client.get(f"/organizations/{second}").json()["building_id"] == other
+
+def test_etag_changes_with_a_new_phone(client):
+    building = create_building(client)
+    [org_id] = create_organizations(client, {"name": "Первая", "building_id": building})
+    response = client.get(f"/organizations/{org_id}")
+    etag = response.headers["ETag"]
+    assert client.get(f"/organizations/{org_id}", headers = {"If-None-Match": etag}).status_code == 304
+    assert client.post(f"/organizations/{org_id}/phones/", json = {"number": "+79000000001"}).status_code == 200
+    response = client.get(f"/organizations/{org_id}", headers = {"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["phone_numbers"] == ["+79000000001"]
+    assert client.get(f"/organizations/{org_id}", headers = {"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+def test_keyset_cursors(client):
+    building = create_building(client)
+    org_ids = create_organizations(client, *({"name": f"Кафе {i}", "building_id": building} for i in range(5)))
+    seen, params = [], {"limit": 2}
+    while True:
+        response = client.get("/organizations/", params = params)
+        assert response.status_code == 200, response.text
+        seen += [org["id"] for org in response.json()]
+        if NEXT_CURSOR_HEADER not in response.headers:
+            break
+        params = {"limit": 2, "cursor": response.headers[NEXT_CURSOR_HEADER]}
+    assert seen == org_ids
+    # ranked name search pages by (similarity, name, id)
+    response = client.get("/organizations/search/by-name", params = {"name_query": "Кафе", "limit": 3})
+    page = [org["id"] for org in response.json()]
+    response = client.get("/organizations/search/by-name", params = {"name_query": "Кафе", "limit": 3, "cursor": response.headers[NEXT_CURSOR_HEADER]})
+    assert sorted(page + [org["id"] for org in response.json()]) == org_ids
+    assert NEXT_CURSOR_HEADER not in response.headers
+    assert client.get("/organizations/", params = {"cursor": "garbage"}).status_code == 400
@@ -0,0 +1,25 @@
+from conftest import create_building, create_organizations
+
+def test_lookup_with_and_without_plus(client):
+    building = create_building(client)
+    [org_id] = create_organizations(client, {"name": "Первая", "building_id": building, "phone_numbers": [{"number": "+74951234567"}]})
+    for number in ("+74951234567", "74951234567", "+7 (495) 123-45-67"):
+        response = client.get("/phones/lookup", params = {"number": number})
+        assert response.status_code == 200, response.text
+        assert response.json()["organization_id"] == org_id
+    assert client.get("/phones/lookup", params = {"number": "+74950000000"}).status_code == 404
+    assert client.get("/phones/lookup", params = {"number": "abc"}).status_code == 400
+    response = client.post("/phones/lookup", json = ["74951234567", "abc", "+74950000000", "+74951234567"])
+    assert [r["organization_id"] for r in response.json()] == [org_id, None, None, org_id]
+    assert [r["number"] for r in response.json()] == ["74951234567", "abc", "+74950000000", "+74951234567"]
+
+def test_duplicates_with_and_without_plus(client):
+    building = create_building(client)
+    first, second = create_organizations(client, {"name": "Первая", "building_id": building}, {"name": "Вторая", "building_id": building})
+    assert client.post(f"/organizations/{first}/phones/", json = {"number": "+74951234567"}).status_code == 200
+    assert client.post(f"/organizations/{second}/phones/", json = {"number": "74951234567"}).status_code == 409
+    assert client.post(f"/organizations/{second}/phones/", json = {"number": "+74951234567"}).status_code == 409
+    # removed by the other spelling
+    assert client.request("DELETE", "/organizations/phones/", json = {"number": "74951234567"}).status_code == 200
+    assert client.post(f"/organizations/{second}/phones/", json = {"number": "74951234567"}).status_code == 200
+    assert client.get("/phones/lookup", params = {"number": "+74951234567"}).json()["organization_id"] == second
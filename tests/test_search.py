@@ -0,0 +1,71 @@
+from app.pagination import NEXT_CURSOR_HEADER
+from app.search_plan import PLAN_HEADER, TOTAL_HEADER
+from conftest import create_activity, create_building, create_organizations
+
+def driver(response) -> str:
+    return response.headers[PLAN_HEADER].split(";")[0].removeprefix("driver=")
+
+def ids(response) -> list[int]:
+    assert response.status_code == 200, response.text
+    return [org["id"] for org in response.json()]
+
+def test_each_driver(client):
+    food = create_activity(client, "Еда")
+    dairy = create_activity(client, "Молочная продукция", food)
+    cars = create_activity(client, "Автомобили")
+    center = create_building(client, 55.75, 37.61)
+    far = create_building(client, 59.93, 30.31)
+    org_ids = create_organizations(
+        client,
+        {"name": "Молоко и сыр", "building_id": center, "activity_ids": [dairy]},
+        *({"name": f"Автосервис {i}", "building_id": far, "activity_ids": [cars]} for i in range(5)),
+        *({"name": f"Молочная ферма {i}", "building_id": far, "activity_ids": [dairy]} for i in range(8)),
+    )
+    # one of two buildings in the radius (7 organizations estimated) against the 9 links of the subtree
+    response = client.get("/organizations/search", params = {"lat": 55.75, "lon": 37.61, "radius": 1000, "activity_id": food})
+    assert driver(response) == "geo"
+    assert ids(response) == [org_ids[0]]
+    # one name match against the 9 links of the leaf and the 14 organizations in the rectangle
+    response = client.get("/organizations/search", params = {
+        "min_lat": 55, "max_lat": 60, "min_lon": 30, "max_lon": 38, "activity_id": dairy, "name": "сыр"
+    })
+    assert driver(response) == "name"
+    assert ids(response) == [org_ids[0]]
+    response = client.get("/organizations/search", params = {"activity_id": cars, "name": "сервис 3"})
+    assert ids(response) == [org_ids[4]]
+    response = client.get("/organizations/search", params = {"activity_id": dairy, "include_descendants": False, "name": "о"})
+    assert driver(response) == "activity"
+    assert ids(response) == [org_ids[0], *org_ids[6:]]
+    assert response.headers[TOTAL_HEADER] == "9"
+
+def test_geo_estimate_of_zero_still_searches(client):
+    # far more buildings than organizations: one building in the radius estimates 0 organizations
+    center = create_building(client, 55.75, 37.61)
+    for i in range(9):
+        create_building(client, 50.0 + i, 30.0)
+    [org_id] = create_organizations(client, {"name": "ООО Рога и Копыта", "building_id": center})
+    response = client.get("/organizations/search", params = {"lat": 55.75, "lon": 37.61, "radius": 1000, "name": "Рога"})
+    assert "geo=0" in response.headers[PLAN_HEADER]
+    assert ids(response) == [org_id]
+    # no building in the radius at all
+    response = client.get("/organizations/search", params = {"lat": 0, "lon": 0, "radius": 1000, "name": "Рога"})
+    assert ids(response) == []
+    assert response.headers[TOTAL_HEADER] == "0"
+
+def test_search_pages(client):
+    building = create_building(client)
+    org_ids = create_organizations(client, *({"name": f"Кафе {i}", "building_id": building} for i in range(5)))
+    seen, cursor = [], None
+    while True:
+        response = client.get("/organizations/search", params = {"name": "Кафе", "limit": 2, **({"cursor": cursor} if cursor else {})})
+        seen += ids(response)
+        assert response.headers[TOTAL_HEADER] == "5"
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            break
+    assert seen == org_ids
+
+def test_search_validation(client):
+    assert client.get("/organizations/search").status_code == 400
+    assert client.get("/organizations/search", params = {"lat": 55.75, "lon": 37.61}).status_code == 400
+    assert client.get("/organizations/search", params = {"activity_id": 999}).status_code == 400